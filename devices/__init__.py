@@ -1,4 +1,5 @@
-from pyvisa_device import device, device_error
+from pyvisa_device import device, device_error, close_sessions
+import simulated_transport
 from ke2410 import ke2410
 from ke2450 import ke2450
 from ke2001 import ke2001
@@ -1,4 +1,5 @@
 import time
+import numpy as np
 from pyvisa_device import device, device_error
 
 
@@ -19,11 +20,22 @@ class hp4980(device):
     "INIT:IMM" dev.set_trigger_immediate()
     "TRIG:IMM" dev.send_trigger()
     "FETCh?" dev.execute_measurement()
+
+    "FORM:DATA REAL" dev.set_binary_format(1)
+    "MEM:READ? DBUF" dev.execute_measurements(5)
+
+    "LIST:FREQ" dev.setup_list_sweep([1E3, 1E4, 1E5])
+    "*TRG" dev.execute_list_sweep()
+    "DISP:PAGE MEAS" dev.stop_list_sweep()
     """
 
     def __init__(self, address):
         device.__init__(self, address=address)
-        self.ctrl.write("*RST")
+        if self.new_session:
+            self.ctrl.write("*RST")
+        self.binary = 0
+        self.trig_source = 'INT'
+        self.list_points = 0
 
     def print_idn(self, debug=0):
         if debug == 1:
@@ -38,6 +50,9 @@ class hp4980(device):
         if debug == 1:
             self.logging("Reseting device.")
         self.ctrl.write("*RST")
+        self.binary = 0
+        self.trig_source = 'INT'
+        self.list_points = 0
         return 0
 
     def restart(self, debug=0):
@@ -99,6 +114,16 @@ class hp4980(device):
         self.ctrl.write(":FORM:%s" % mode)
         return 0
 
+    def set_binary_format(self, mode=1, debug=0):
+        if debug == 1:
+            self.logging.info("Setting binary data transfer to %d. Options are [0, 1]." % mode)
+        if mode:
+            self.ctrl.write("FORM:DATA REAL")
+        else:
+            self.ctrl.write("FORM:DATA ASC")
+        self.binary = mode
+        return 0
+
     def set_comparator(self, mode=0, debug=0):
         if debug == 1:
             self.logging("Switching comparator to %d. Options are [0, 1]." % mode)
@@ -248,6 +273,7 @@ class hp4980(device):
         if debug == 1:
             self.logging("Setting trigger source to %s. [INT, EXT, HOLD, BUS]" % mode)
         self.ctrl.write(":TRIG:SOUR %s" % mode)
+        self.trig_source = mode
         return 0
 
     def send_trigger(self, debug=0):
@@ -256,8 +282,94 @@ class hp4980(device):
         self.ctrl.write("TRIG:IMM")
         return 0
 
+    def fetch_values(self, cmd="FETC?"):
+        if self.binary:
+            return self.ctrl.query_binary_values(cmd, datatype='d', is_big_endian=True, container=np.array)
+        return np.array([float(val) for val in self.ctrl.query(cmd).split(",")])
+
     def execute_measurement(self, debug=0):
         if debug == 1:
             self.logging("Fetching data.")
-        vals = self.ctrl.query("FETC?").split(",")
+        if self.trig_source == 'BUS':
+            self.ctrl.write("TRIG:IMM")
+        vals = self.fetch_values("FETC?")
         return float(vals[0]), float(vals[1])
+
+    def execute_measurements(self, n=5, debug=0):
+        """
+        Triggers n measurements into the data buffer and reads them back in a
+        single transfer. Returns an (n, 2) array of the primary and secondary
+        parameter. With averaging set by set_aperture_time every entry is
+        already the mean of that many measurements. Leaves the trigger source
+        on BUS, execute_measurement then triggers for itself.
+
+        Every trigger waits for its measurement to finish (*OPC?), the meter
+        ignores triggers during a measurement. Raises IOError if the buffer
+        holds fewer than n measurements.
+        """
+        if debug == 1:
+            self.logging.info("Fetching %d measurements from the data buffer." % n)
+        if self.trig_source != 'BUS':
+            self.set_trigger_source('BUS')
+        self.ctrl.write("MEM:DIM DBUF, %d" % n)
+        self.ctrl.write("MEM:FILL DBUF")
+        for k in range(n):
+            self.ctrl.query("TRIG:IMM;*OPC?")
+        vals = self.fetch_values("MEM:READ? DBUF")
+        self.ctrl.write("MEM:CLE DBUF")
+
+        ## Entries are primary, secondary, status and bin number, status -1 is an empty entry
+        vals = np.reshape(vals, (-1, 4)) if len(vals) % 4 == 0 else np.zeros((0, 4))
+        if len(vals) < n or (vals[:n, 2] == -1).any():
+            raise IOError("Data buffer holds %d of %d measurements." % (np.sum(vals[:n, 2] != -1), n))
+        return vals[:n, :2]
+
+
+
+    # List sweep functions
+    # ---------------------------------
+
+    def set_list_frequencies(self, vals, debug=0):
+        if debug == 1:
+            self.logging.info("Setting list sweep frequencies to %s Hz." % vals)
+        self.ctrl.write("DISP:PAGE LIST")
+        self.ctrl.write("LIST:FREQ %s" % ",".join(["%E" % val for val in vals]))
+        self.list_points = len(vals)
+        return 0
+
+    def check_list_frequencies(self, debug=0):
+        if debug == 1:
+            self.logging.info("Checking list sweep frequencies.")
+        return [float(val) for val in self.ctrl.query("LIST:FREQ?").split(",")]
+
+    def set_list_mode(self, mode='SEQ', debug=0):
+        if debug == 1:
+            self.logging.info("Setting list sweep mode to %s. Options are ['SEQ', 'STEP']." % mode)
+        self.ctrl.write("LIST:MODE %s" % mode)
+        return 0
+
+    def setup_list_sweep(self, vals, debug=0):
+        if debug == 1:
+            self.logging.info("Setting up a sequential list sweep over %d frequencies." % len(vals))
+        self.set_list_frequencies(vals)
+        self.set_list_mode('SEQ')
+        self.set_trigger_source('BUS')
+        return 0
+
+    def execute_list_sweep(self, debug=0):
+        """
+        Runs one sequential sweep over the list frequencies with a single
+        trigger and returns an (n, 2) array with the primary and secondary
+        parameter for every sweep point.
+        """
+        if debug == 1:
+            self.logging.info("Triggering list sweep.")
+        vals = self.fetch_values("*TRG")
+        return np.reshape(vals, (self.list_points, -1))[:, :2]
+
+    def stop_list_sweep(self, debug=0):
+        if debug == 1:
+            self.logging.info("Returning to single point measurements.")
+        self.ctrl.write("DISP:PAGE MEAS")
+        self.list_points = 0
+        return 0
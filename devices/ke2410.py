@@ -1,8 +1,9 @@
 import time
 from pyvisa_device import device, device_error
+from ramping import ramping
 
 
-class ke2410(device):
+class ke2410(device, ramping):
     """
     Keithley 2410 source meter.
 
@@ -15,16 +16,21 @@ class ke2410(device):
     dev.set_sense('current')
     dev.set_current_limit(0.00005)
     dev.set_output_on()
+    dev.set_ramp(rate=50, step=5, mode='sweep')
+    dev.ramp_voltage(-100)
     print dev.read_current()
     print dev.read_voltage()
     print dev.read_resistance()
+    print dev.read_iv()
     dev.set_output_off()
     dev.reset()
     """
 
     def __init__(self, address):
         device.__init__(self, address=address)
-        self.ctrl.write("*RST")
+        if self.new_session:
+            self.ctrl.write("*RST")
+        self.iv = 0
 
     def print_idn(self, debug=0):
         if debug == 1:
@@ -39,6 +45,7 @@ class ke2410(device):
         if debug == 1:
             self.logging.info("Reseting device.""")
         self.ctrl.write("*RST")
+        self.iv = 0
         return 0
 
 
@@ -124,44 +131,31 @@ class ke2410(device):
         self.ctrl.write(":SOUR:CURR %f" % val)
         return 0
 
-    def ramp_voltage(self, val, debug=0):
-        now = int(round(self.read_voltage()))
-        if debug == 1:
-            self.logging.info("Ramping voltage from %.2f V to %.2f V." % (now, val))
-        if now > val:
-            for v in range(now, val, -25):
-                self.ctrl.write(":SOUR:VOLT %d" % v)
-                time.sleep(1)
-                if debug == 1:
-                    print self.read_voltage()
-            self.ctrl.write(":SOUR:VOLT %d" % val)
+    def program_sweep(self, start, stop, points, delay, abort=1):
+        """ Runs a linear staircase in sweep mode, optionally aborting early on compliance. """
+        self.ctrl.write(":SOUR:VOLT:MODE SWE")
+        self.ctrl.write(":SOUR:SWE:SPAC LIN")
+        self.ctrl.write(":SOUR:SWE:RANG BEST")
+        if abort:
+            self.ctrl.write(":SOUR:SWE:CAB EARL")
         else:
-            for v in range(now, val, +25):
-                self.ctrl.write(":SOUR:VOLT %d" % v)
-                time.sleep(1)
-                if debug == 1:
-                    print self.read_voltage()
-            self.ctrl.write(":SOUR:VOLT %d" % val)
-        return 0
-
-    def ramp_down(self, debug=0):
-        if debug == 1:
-            self.logging.info("Ramping down to 0.00 V.")
-        now = int(round(self.read_voltage()))
-        for v in range(now, 0, -25):
-            self.ctrl.write(":SOUR:VOLT %f" % v)
-            time.delay(1)
-        self.ctrl.write(":SOUR:VOLT 0")
-        return 0
-
-    def ramp_up(self, val, debug=0):
-        if debug == 1:
-            self.logging.info("Ramping up to %.2f V." % val)
-        now = int(round(self.read_voltage()))
-        for v in range(now, val, +25):
-            self.ctrl.write(":SOUR:VOLT %f" % val)
-            time.delay(1)
-        self.ctrl.write(":SOUR:VOLT %f" % val)
+            self.ctrl.write(":SOUR:SWE:CAB NEV")
+        self.ctrl.write(":SOUR:VOLT:STAR %f" % start)
+        self.ctrl.write(":SOUR:VOLT:STOP %f" % stop)
+        self.ctrl.write(":SOUR:SWE:POIN %d" % points)
+        self.ctrl.write(":TRIG:COUN %d" % points)
+        self.ctrl.write(":SOUR:DEL %f" % delay)
+        self.ctrl.write(":FORM:ELEM VOLT,CURR")
+        self.iv = 0
+        self.ctrl.write(":INIT")
+        self.ctrl.query("*OPC?")
+        ## Set the fixed level to the last swept point before leaving sweep mode,
+        ## an aborted sweep stops short of the end point
+        last = float(self.ctrl.query(":FETC?").split(',')[-2])
+        self.ctrl.write(":SOUR:VOLT %f" % last)
+        self.ctrl.write(":SOUR:VOLT:MODE FIX")
+        self.ctrl.write(":TRIG:COUN 1")
+        self.ctrl.write(":SOUR:DEL:AUTO ON")
         return 0
 
     def set_voltage_range(self, val, debug=0):
@@ -182,6 +176,7 @@ class ke2410(device):
         return self.ctrl.query(":SENS:CURR:PROT:TRIP?")
 
     def set_sense(self, prop, debug=0):
+        self.iv = 0
         if prop == 'voltage':
             if debug == 1:
                 self.logging.info("Setting sense to voltage.")
@@ -247,18 +242,34 @@ class ke2410(device):
 
     def read_voltage(self):
         # self.ctrl.write(":SENS:FUNC VOLT")
+        self.iv = 0
         self.ctrl.write(":FORM:ELEM:SENS VOLT")
         val = self.ctrl.query(":MEAS:VOLT?")
         return float(val)
 
     def read_current(self):
         # self.ctrl.write(":SENS:FUNC CURR")
+        self.iv = 0
         self.ctrl.write(":FORM:ELEM:SENS CURR")
         val = self.ctrl.query(":MEAS:CURR?")
         return float(val)
 
     def read_resistance(self):
         # self.ctrl.write(":SENS:FUNC RES")
+        self.iv = 0
         self.ctrl.write(":FORM:ELEM:SENS RES")
         val = self.ctrl.query(":MEAS:RES?")
         return float(val)
+
+    def read_iv(self):
+        """
+        Returns voltage and current from a single :READ?, i.e. one bus
+        transaction and one integration cycle. The sense and format setup is
+        only sent again after another read function or a reset changed it.
+        """
+        if not self.iv:
+            self.ctrl.write(":SENS:FUNC 'CURR'")
+            self.ctrl.write(":FORM:ELEM VOLT,CURR")
+            self.iv = 1
+        vals = self.ctrl.query(":READ?").split(',')
+        return float(vals[0]), float(vals[1])
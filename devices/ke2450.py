@@ -1,8 +1,9 @@
 import time
 from pyvisa_device import device, device_error
+from ramping import ramping
 
 
-class ke2450(device):
+class ke2450(device, ramping):
     """
     Keithley 2450 source meter.
 
@@ -15,16 +16,21 @@ class ke2450(device):
     dev.set_sense('current')
     dev.set_current_limit(0.00005)
     dev.set_output_on()
+    dev.set_ramp(rate=50, step=5, mode='sweep')
+    dev.ramp_voltage(-100)
     print dev.read_current()
     print dev.read_voltage()
     print dev.read_resistance()
+    print dev.read_iv()
     dev.set_output_off()
     dev.reset()
     """
 
     def __init__(self, address):
         device.__init__(self, address=address)
-        self.ctrl.write("*RST")
+        if self.new_session:
+            self.ctrl.write("*RST")
+        self.iv = 0
 
     def print_idn(self, debug=0):
         if debug == 1:
@@ -39,6 +45,7 @@ class ke2450(device):
         if debug == 1:
             self.logging.info("Reseting device.""")
         self.ctrl.write("*RST")
+        self.iv = 0
         return 0
 
 
@@ -107,45 +114,15 @@ class ke2450(device):
         self.ctrl.write(":SOUR:CURR %f" % val)
         return 0
 
-    def ramp_voltage(self, val, debug=0):
-        now = int(round(self.read_voltage()))
-        if debug == 1:
-            self.logging.info("Ramping voltage from %.2f V to %.2f V." % (now, val))
-        if now > val:
-            for v in range(now, val, -25):
-                self.ctrl.write(":SOUR:VOLT %d" % v)
-                time.sleep(1)
-                if debug == 1:
-                    print self.read_voltage()
-            self.ctrl.write(":SOUR:VOLT %d" % val)
-        else:
-            for v in range(now, val, +25):
-                self.ctrl.write(":SOUR:VOLT %d" % v)
-                time.sleep(1)
-                if debug == 1:
-                    print self.read_voltage()
-            self.ctrl.write(":SOUR:VOLT %d" % val)
-        self.ctrl.write("SENS:FUNC 'CURR'")
-        return 0
-
-    def ramp_down(self, debug=0):
-        if debug == 1:
-            self.logging.info("Ramping down to 0.00 V.")
-        now = int(round(self.read_voltage()))
-        for v in range(now, 0, -25):
-            self.ctrl.write(":SOUR:VOLT %f" % v)
-            time.delay(1)
-        self.ctrl.write(":SOUR:VOLT 0")
-        return 0
-
-    def ramp_up(self, val, debug=0):
-        if debug == 1:
-            self.logging.info("Ramping up to %.2f V." % val)
-        now = int(round(self.read_voltage()))
-        for v in range(now, val, +25):
-            self.ctrl.write(":SOUR:VOLT %f" % val)
-            time.delay(1)
-        self.ctrl.write(":SOUR:VOLT %f" % val)
+    def program_sweep(self, start, stop, points, delay, abort=1):
+        """ Runs a linear staircase from the trigger model, optionally aborting early on compliance. """
+        fail = 'ON' if abort else 'OFF'
+        self.ctrl.write(':SOUR:SWE:VOLT:LIN %f, %f, %d, %f, 1, BEST, %s, OFF' % (start, stop, points, delay, fail))
+        self.ctrl.write(":INIT")
+        self.ctrl.query("*OPC?")
+        ## Keep the fixed level at the last swept point, an aborted sweep stops short of the end point
+        last = float(self.ctrl.query(':FETC? "defbuffer1", SOUR'))
+        self.ctrl.write(":SOUR:VOLT %f" % last)
         return 0
 
     def set_voltage_range(self, val, debug=0):
@@ -163,9 +140,10 @@ class ke2450(device):
     def check_compliance(self, debug=0):
         if debug == 1:
             self.logging.info("Checking for compliance.")
-        return self.ctrl.query(":SENS:CURR:PROT:TRIP?")
+        return self.ctrl.query(":SOUR:VOLT:ILIM:TRIP?")
 
     def set_sense(self, prop, debug=0):
+        self.iv = 0
         if prop == 'voltage':
             if debug == 1:
                 self.logging.info("Setting sense to voltage.")
@@ -235,6 +213,7 @@ class ke2450(device):
     def setup_current_source(self, debug=0):
         if debug == 1:
             self.logging.info("Set device up for current source and current measurement.")
+        self.iv = 0
         #self.ctrl.write("SOUR:VOLT:PROT PROT20")
         self.ctrl.write("SENS:FUNC 'VOLT'")
         self.ctrl.write("SENS:VOLT:NPLC 1")
@@ -249,6 +228,7 @@ class ke2450(device):
     # ---------------------------------
 
     def read_voltage(self):
+        self.iv = 0
         self.ctrl.write("SENS:FUNC 'VOLT'")
         val = self.ctrl.query(":READ?")
         # val = self.ctrl.query(":MEAS:VOLT?")
@@ -263,5 +243,18 @@ class ke2450(device):
     def read_resistance(self):
         # self.ctrl.write(":SENS:FUNC RES")
         #self.ctrl.write(":FORM:ELEM:SENS RES")
+        self.iv = 0
         val = self.ctrl.query(":MEAS:RES?")
         return float(val)
+
+    def read_iv(self):
+        """
+        Returns voltage and current from a single :READ?, i.e. one bus
+        transaction and one integration cycle. The source value is returned
+        together with the reading from the default buffer.
+        """
+        if not self.iv:
+            self.ctrl.write("SENS:FUNC 'CURR'")
+            self.iv = 1
+        vals = self.ctrl.query(':READ? "defbuffer1", SOUR, READ').split(',')
+        return float(vals[0]), float(vals[1])
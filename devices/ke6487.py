@@ -1,4 +1,5 @@
 import time
+import numpy as np
 from pyvisa_device import device, device_error
 
 
@@ -18,12 +19,21 @@ class ke6487(device):
     print dev.get_nplc()
     dev.setup_ammeter()
     print dev.read_current()
+
+    dev.setup_burst(5)
+    print dev.read_current_burst()
+    print dev.read_current_stats()
+    dev.stop_burst()
     """
 
 
     def __init__(self, address):
         device.__init__(self, address=address)
-        self.ctrl.write("*RST")
+        if self.new_session:
+            self.ctrl.write("*RST")
+        self.burst = 0
+        self.binary = 0
+        self.elem = None
 
     def print_idn(self, debug=0):
         if debug == 1:
@@ -38,6 +48,9 @@ class ke6487(device):
         if debug == 1:
             self.logging.info("Reseting device.""")
         self.ctrl.write("*RST")
+        self.burst = 0
+        self.binary = 0
+        self.elem = None
         return 0
 
     def clear_status(self, debug=0):
@@ -153,3 +166,73 @@ class ke6487(device):
         except ValueError:
             print val.split(',')
             return -1
+
+
+
+    # Buffer functions
+    # ---------------------------------
+
+    def setup_burst(self, n=5, binary=1, debug=0):
+        if debug == 1:
+            self.logging.info("Setting up bursts of %d readings into the trace buffer. Binary transfer %d." % (n, binary))
+        if self.elem is None:
+            self.elem = self.ctrl.query("FORM:ELEM?").strip()
+        self.ctrl.write("FORM:ELEM READ")
+        if binary:
+            self.ctrl.write("FORM:BORD SWAP")
+            self.ctrl.write("FORM:DATA SRE")
+        else:
+            self.ctrl.write("FORM:DATA ASC")
+        self.ctrl.write("TRIG:COUN %d" % n)
+        self.ctrl.write("TRAC:POIN %d" % n)
+        self.ctrl.write("TRAC:FEED SENS")
+        self.burst = n
+        self.binary = binary
+        return 0
+
+    def stop_burst(self, debug=0):
+        if debug == 1:
+            self.logging.info("Returning to single readings.")
+        self.ctrl.write("TRAC:FEED:CONT NEV")
+        self.ctrl.write("TRIG:COUN 1")
+        self.ctrl.write("FORM:DATA ASC")
+        ## Restore the reading elements set before setup_burst
+        if self.elem is not None:
+            self.ctrl.write("FORM:ELEM %s" % self.elem)
+            self.elem = None
+        self.burst = 0
+        self.binary = 0
+        return 0
+
+    def trigger_burst(self, debug=0):
+        if debug == 1:
+            self.logging.info("Acquiring %d readings into the trace buffer." % self.burst)
+        self.ctrl.query(":TRAC:CLE;:TRAC:FEED:CONT NEXT;:INIT;*OPC?")
+        return 0
+
+    def fetch_values(self, cmd):
+        if self.binary:
+            return self.ctrl.query_binary_values(cmd, datatype='f', is_big_endian=False, container=np.array)
+        return self.ctrl.query_ascii_values(cmd, container=np.array)
+
+    def read_current_burst(self):
+        """
+        Takes the number of readings given to setup_burst in one trigger and
+        returns them as an array. Needs setup_burst first; use stop_burst
+        before going back to read_current.
+        """
+        self.trigger_burst()
+        return self.fetch_values("TRAC:DATA?")
+
+    def read_current_stats(self):
+        """
+        Takes a burst and returns mean and standard deviation as calculated by
+        the instrument (CALC3). Note that the instrument returns the sample
+        standard deviation, numpy.std the population one.
+        """
+        self.trigger_burst()
+        self.ctrl.write("CALC3:FORM MEAN")
+        mean = self.fetch_values("CALC3:DATA?")[0]
+        self.ctrl.write("CALC3:FORM SDEV")
+        std = self.fetch_values("CALC3:DATA?")[0]
+        return mean, std
@@ -14,7 +14,8 @@ class ke6510(device):
 
     def __init__(self, address):
         device.__init__(self, address=address)
-        self.ctrl.write("*RST")
+        if self.new_session:
+            self.ctrl.write("*RST")
         self.ctrl.write("*LANG SCPI")
 
     def print_idn(self, debug=0):
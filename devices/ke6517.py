@@ -22,7 +22,8 @@ class ke6517(device):
 
     def __init__(self, address):
         device.__init__(self, address=address)
-        self.ctrl.write("*RST")
+        if self.new_session:
+            self.ctrl.write("*RST")
 
     def print_idn(self, debug=0):
         if debug == 1:
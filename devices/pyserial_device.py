@@ -1,6 +1,15 @@
-import serial 
+import atexit
 import logging
+import threading
+import Queue
 import time
+import simulated_transport
+try:
+    import serial
+    port_errors = (serial.SerialException, ValueError, TypeError)
+except ImportError:
+    serial = None
+    port_errors = (ValueError, TypeError)
 
 
 # Base error class
@@ -39,31 +48,53 @@ class device(object):
     Leakshore 335: baud rate 57600, 7 data bits, 1 start bit, 1 stop bit, odd parity, termination '\n'
     Leakshore 331: baud rate 9600, 7 data bits, 1 start bit, 1 stop bit, odd parity, termination '\r\n'
     Switchcard: baud rate 115200, 8 data bits, 0 start bit, 1 stop bit, no parity bit, termination '\r\n'
+
+    Reader mode:
+    With reader=1 a background thread blocks on the port, splits the incoming
+    stream into frames at the prompt and hands them to the waiting write/query
+    call through a queue. Callers sleep until the prompt arrives instead of
+    polling the port. Only use it for devices that answer with a prompt.
     """
 
-    def __init__(self, port='/dev/ttyUSB0', baudrate=115200, termination='\r\n', timeout=1):
+    def __init__(self, port='/dev/ttyUSB0', baudrate=115200, termination='\r\n', timeout=1, prompt='>', reader=0):
 
         self.termination = termination
         self.timeout = timeout
+        self.prompt = prompt
+        self.reader = reader
 
         ## Set up control
-        self.ctrl = serial.Serial(
-            port=port,
-            baudrate=baudrate,
-            parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_ONE,
-            bytesize=serial.EIGHTBITS,
-            write_timeout=self.timeout,
-            timeout=0.001, 
-            xonxoff=False, 
-            rtscts=False, 
-            dsrdtr=False
-        )
+        if simulated_transport.enabled:
+            self.ctrl = simulated_transport.open_port(port, timeout=(0.1 if reader else 0.001))
+        else:
+            self.ctrl = serial.Serial(
+                port=port,
+                baudrate=baudrate,
+                parity=serial.PARITY_NONE,
+                stopbits=serial.STOPBITS_ONE,
+                bytesize=serial.EIGHTBITS,
+                write_timeout=self.timeout,
+                timeout=(0.1 if reader else 0.001), 
+                xonxoff=False, 
+                rtscts=False, 
+                dsrdtr=False
+            )
 
         ## Set up logger
         self.logging = logging.getLogger('root')
         self.logging.info("Initialising device.")
 
+        ## Set up reader thread
+        if self.reader:
+            self.frames = Queue.Queue()
+            self.lock = threading.Lock()
+            self.deadline = None
+            self.reading = True
+            self.thread = threading.Thread(target=self._read_frames)
+            self.thread.daemon = True
+            self.thread.start()
+            atexit.register(self.close_connection)
+
     def list_ports(self):
         print serial.tools.list_ports()
 
@@ -77,15 +108,30 @@ class device(object):
         return self.ctrl.isOpen()
 
     def close_connection(self):
+        if self.reader and self.reading:
+            self.reading = False
+            self.thread.join(2 * self.timeout)
         return self.ctrl.close()
 
     def flush_input(self):
+        if self.reader:
+            self._drop_frames()
         return self.ctrl.flushInput()
 
     def flush_output(self):
         return self.ctrl.flushOutput()
 
     def write(self, cmd, debug=0):
+        if self.reader:
+            lines = self._transact(cmd)
+            if lines is None:
+                if debug == 1:
+                    print "Timeout"
+                return -1
+            if debug == 1:
+                print lines
+            return 0
+
         lines = []
         start = time.time()
         
@@ -106,6 +152,16 @@ class device(object):
                     return -1
 
     def query(self, cmd, debug=0):
+        if self.reader:
+            lines = self._transact(cmd)
+            if lines is None:
+                if debug == 1:
+                    print "Timeout"
+                return -1
+            if debug == 1:
+                print lines
+            return lines[1:-1]
+
         lines = []
         start = time.time()
         
@@ -127,18 +183,56 @@ class device(object):
 
 
 
+    # Reader functions
+    # ---------------------------------
 
+    def _transact(self, cmd):
+        """
+        Sends a command and blocks until the reader thread delivers the
+        matching frame. Returns the frame as a list of lines, starting with
+        the echoed command and ending with the prompt, or None on timeout.
+        """
+        with self.lock:
+            if not self.reading:
+                return None
+            self._drop_frames()
+            self.deadline = time.time() + self.timeout
+            self.ctrl.write(cmd + self.termination)
+            return self.frames.get()
 
-
-
-
-
-
-
-
-
-
-
-
-
+    def _drop_frames(self):
+        """ Discards frames that arrived without a caller waiting for them. """
+        while True:
+            try:
+                self.frames.get_nowait()
+            except Queue.Empty:
+                return
+
+    def _read_frames(self):
+        """
+        Reader thread. Blocks on the port, cuts the stream at every prompt and
+        queues one frame per prompt. Also wakes a waiting caller with None once
+        its deadline has passed.
+        """
+        buf = ''
+        while self.reading:
+            try:
+                data = self.ctrl.read(self.ctrl.inWaiting() or 1)
+            except port_errors:
+                break
+
+            if data:
+                buf += data
+                while buf.find(self.prompt) != -1:
+                    n = buf.find(self.prompt) + len(self.prompt)
+                    frame, buf = buf[:n].lstrip(), buf[n:]
+                    self.deadline = None
+                    self.frames.put(frame.splitlines(True))
+
+            if self.deadline is not None and time.time() > self.deadline:
+                self.deadline = None
+                self.frames.put(None)
+
+        self.reading = False
+        self.frames.put(None)
 
@@ -1,5 +1,65 @@
-import visa
+import atexit
 import logging
+import simulated_transport
+try:
+    import visa
+except ImportError:
+    visa = None
+
+
+## Process-wide session pool, keyed by VISA resource name
+rm = None
+sessions = {}
+
+
+def resource_name(address):
+    """ Returns the VISA resource name for a GPIB address or a full resource string. """
+    if isinstance(address, basestring) and not address.strip().isdigit():
+        return str(address)
+    return 'GPIB0::%d::INSTR' % int(address)
+
+
+def open_session(address, model=None):
+    """
+    Returns (session, idn, new) for the instrument at address. The first call
+    opens and identifies the instrument, later calls hand out the same session.
+    With the simulated transport enabled, model (the driver class name) picks
+    the simulated instrument.
+    """
+    global rm
+    name = resource_name(address)
+    if name in sessions:
+        ctrl, idn = sessions[name]
+        return ctrl, idn, False
+
+    if simulated_transport.enabled:
+        ctrl = simulated_transport.open_resource(name, model)
+    else:
+        if visa is None:
+            raise ImportError("pyvisa is not installed, only the simulated transport is available.")
+        if rm is None:
+            rm = visa.ResourceManager()
+        ctrl = rm.open_resource(name)
+    idn = ctrl.query("*IDN?")
+    sessions[name] = (ctrl, idn)
+    return ctrl, idn, True
+
+
+def close_sessions():
+    """ Closes all pooled sessions and the resource manager. """
+    global rm
+    for name in sessions.keys():
+        ctrl, idn = sessions.pop(name)
+        try:
+            ctrl.close()
+        except Exception:
+            pass
+    if rm is not None:
+        rm.close()
+        rm = None
+
+atexit.register(close_sessions)
+
 
 
 # Base error class
@@ -15,6 +75,10 @@ class device_error(object):
 class device(object):
     """
     Abstract base class for gpib devices based on pyvisa.
+
+    Sessions are shared through a process-wide pool. Creating a second driver
+    for the same address reuses the open, identified session; new_session
+    tells a driver whether it talks to a freshly opened instrument.
     
     Example:
     dev = device(address=24)
@@ -23,13 +87,12 @@ class device(object):
     def __init__(self, address=24):
 
         ## Set up control
-        rm = visa.ResourceManager()
-        self.ctrl = rm.open_resource('GPIB0::%s::INSTR' % address)
+        self.ctrl, self.idn, self.new_session = open_session(address, self.__class__.__name__)
 
         ## Set up logger
         self.logging = logging.getLogger('root')
         self.logging.info("Initialising device.")
-        self.logging.info(self.ctrl.query("*IDN?"))
+        self.logging.info(self.idn)
 
 
     def findInstruments(self):
@@ -0,0 +1,103 @@
+import math
+import time
+
+
+class ramping(object):
+    """
+    Voltage ramp engine shared by the Keithley source meters.
+
+    The output is moved at a slew rate in V/s in steps of ramp_step volts.
+    In 'step' mode the host sets every step and checks the compliance trip
+    flag after each one. In 'sweep' mode the staircase is programmed into the
+    instrument, which paces the steps with its own source delay and aborts on
+    compliance by itself. Ramps towards 0 V never abort, so the bias can
+    always be taken down. Drivers provide check_compliance() and
+    program_sweep(start, stop, points, delay, abort).
+
+    Example:
+    -------------
+    dev = ke2410(address=24)
+    dev.set_ramp(rate=50, step=5, mode='sweep')
+    if dev.ramp_voltage(-500) == -1:
+        print "Compliance tripped."
+    dev.ramp_down()
+    """
+
+    ramp_rate = 25.         # slew rate in [V/s]
+    ramp_step = 5.          # step size in [V]
+    ramp_mode = 'step'      # ['step', 'sweep']
+
+    def set_ramp(self, rate=25., step=5., mode='step', debug=0):
+        if mode not in ['step', 'sweep']:
+            self.logging.info("Ramp mode %s doesn't exist. Options are ['step', 'sweep']." % mode)
+            return -1
+        if debug == 1:
+            self.logging.info("Setting ramp to %.2f V/s in %.2f V steps (%s)." % (rate, step, mode))
+        self.ramp_rate = abs(float(rate))
+        self.ramp_step = abs(float(step))
+        self.ramp_mode = mode
+        return 0
+
+    def get_source_voltage(self):
+        return float(self.ctrl.query(":SOUR:VOLT?"))
+
+    def is_tripped(self):
+        return int(float(self.check_compliance())) == 1
+
+    def ramp_voltage(self, val, debug=0):
+        """
+        Ramps the source from its present level to val. Returns -1 if the
+        current compliance tripped on the way, the output is then left where
+        the ramp stopped. Ramps towards 0 V run to the end regardless.
+        """
+        now = self.get_source_voltage()
+        if debug == 1:
+            self.logging.info("Ramping voltage from %.2f V to %.2f V." % (now, val))
+
+        n = int(math.ceil(abs(val - now) / self.ramp_step))
+        if n == 0:
+            self.ctrl.write(":SOUR:VOLT %f" % val)
+            return 0
+        delay = abs(val - now) / n / self.ramp_rate
+        abort = abs(val) > abs(now)
+
+        if self.ramp_mode == 'sweep':
+            ret = self.sweep_voltage(now, val, n, delay, abort)
+        else:
+            ret = self.step_voltage(now, val, n, delay, abort, debug)
+        if ret == -1:
+            self.logging.error("Compliance tripped while ramping from %.2f V to %.2f V." % (now, val))
+        return ret
+
+    def ramp_down(self, debug=0):
+        if debug == 1:
+            self.logging.info("Ramping down to 0.00 V.")
+        return self.ramp_voltage(0, debug)
+
+    def ramp_up(self, val, debug=0):
+        if debug == 1:
+            self.logging.info("Ramping up to %.2f V." % val)
+        return self.ramp_voltage(val, debug)
+
+    def step_voltage(self, start, stop, n, delay, abort=1, debug=0):
+        for k in range(1, n + 1):
+            self.ctrl.write(":SOUR:VOLT %f" % (start + (stop - start) * k / float(n)))
+            time.sleep(delay)
+            if abort and self.is_tripped():
+                return -1
+            if debug == 1:
+                print self.get_source_voltage()
+        return 0
+
+    def sweep_voltage(self, start, stop, n, delay, abort=1):
+        ## The sweep is waited for with *OPC?, keep the session open long enough
+        timeout = self.ctrl.timeout
+        if timeout is not None:
+            self.ctrl.timeout = timeout + 1000. * (n + 1) * delay
+        try:
+            self.program_sweep(start, stop, n + 1, delay, abort)
+        finally:
+            self.ctrl.timeout = timeout
+        if abort and self.is_tripped():
+            return -1
+        return 0
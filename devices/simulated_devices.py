@@ -23,9 +23,10 @@ class simulatedSMU(object):
     def check_current_limit(self):
         return self.current_limit
 
-    def ramp_voltage(self, v):
+    def ramp_voltage(self, v, debug=0):
         time.sleep(0.1)
         self.v = v
+        return 0
 
     def read_current(self):
         return self.i
@@ -33,6 +34,9 @@ class simulatedSMU(object):
     def read_voltage(self):
         return self.v
 
+    def read_iv(self):
+        return self.v, self.i
+
 
 class simulatedDMM(object):
     def __init__(self, *args, **kwargs):
@@ -0,0 +1,647 @@
+"""
+Simulated transport for running the measurements without hardware.
+
+Once enabled, pyvisa_device.open_session hands out simulated_resource
+sessions and pyserial_device opens a simulated_port instead of a serial
+port. Both speak the SCPI and switchcard commands the drivers send and share
+one wafer model. The bias supply sets the voltage on the wafer, the switchcard
+selects the channel, and the ammeter and lcr meter read that channel.
+
+Example:
+-------------
+from devices import simulated_transport
+simulated_transport.enable(time_scale=0, noise=1E-3)
+pow_supply = ke2410(24)
+pow_supply.set_output_on()
+pow_supply.ramp_voltage(-100)
+print pow_supply.read_iv()
+
+Configuration (keywords of enable):
+-------------
+seed            random seed of the wafer and the noise
+channels        number of switchcard channels
+latency         per-command latency in [s], keyed by command prefix, see get_latency
+time_scale      factor on every simulated delay, 0 runs as fast as possible
+noise           relative gaussian noise on every reading
+current_floor   absolute noise on currents in [A]
+tau_bias        time constant of the current transient after a bias change in [s]
+tau_channel     time constant of the transient after a channel change in [s]
+bias            resource name of the bias supply, default is the first source meter opened
+"""
+import re
+import time
+import threading
+import numpy as np
+
+
+
+## Transport state
+enabled = False
+wafer = None
+config = {
+    'seed': 0,
+    'channels': 512,
+    'latency': {
+        'default': 0.5E-3,
+        'READ?': 20E-3,
+        'MEAS': 20E-3,
+        'FETC?': 20E-3,
+        'TRIG:IMM': 20E-3,
+        '*TRG': 20E-3,
+        'MATRIX.': 2E-3,
+        'UI.': 2E-3,
+        'SYS.': 2E-3,
+    },
+    'time_scale': 1.,
+    'noise': 1E-3,
+    'current_floor': 1E-13,
+    'tau_bias': 0.5,
+    'tau_channel': 0.02,
+    'bias': None,
+}
+
+
+def enable(**kwargs):
+    """ Switches the device layer to the simulator and creates a fresh wafer. """
+    global enabled, wafer
+    for key, val in kwargs.items():
+        if key == 'latency':
+            config['latency'].update(val)
+        else:
+            config[key] = val
+    wafer = simulated_wafer(config['seed'], config['channels'])
+    enabled = True
+    return 0
+
+
+def disable():
+    global enabled
+    enabled = False
+    return 0
+
+
+def get_latency(cmd):
+    """ Latency of the longest matching command prefix in [s]. """
+    best = ''
+    for key in config['latency']:
+        if cmd.startswith(key) and len(key) > len(best):
+            best = key
+    return config['latency'][best or 'default']
+
+
+def wait(seconds):
+    if seconds > 0:
+        time.sleep(seconds * config['time_scale'])
+
+
+def open_resource(name, model=None):
+    """ Returns a simulated VISA session for the driver class named model. """
+    if model in ['ke2410', 'ke2450']:
+        res = simulated_smu(name, model)
+        if config['bias'] is None:
+            config['bias'] = name
+        return res
+    if model in ['ke6487', 'ke6517', 'ke2001', 'ke6510']:
+        return simulated_ammeter(name, model)
+    if model in ['hp4980', 'hp4284']:
+        return simulated_lcr(name, model)
+    return simulated_resource(name, model)
+
+
+def open_port(port, timeout=0.1):
+    """ Returns a simulated serial port with a switchcard behind it. """
+    return simulated_port(port, timeout)
+
+
+
+# Wafer model
+# ---------------------------------
+
+class simulated_wafer(object):
+    """
+    Per-channel model of the sensor under test. Every cell is a reverse
+    biased diode: the leakage current grows with the depleted volume up to
+    the depletion voltage, then only slowly, and breaks down exponentially
+    above the breakdown voltage (limited to a few thousand times the normal
+    leakage). The capacitance falls as 1/sqrt(V) until
+    full depletion. Bias and channel changes add decaying transients.
+    """
+
+    def __init__(self, seed=0, channels=512):
+        rnd = np.random.RandomState(seed)
+        self.rnd = np.random.RandomState(seed + 1)
+        self.channels = channels
+        self.i_dep = 10 ** rnd.normal(-9.3, 0.2, channels)     # leakage at full depletion in [A]
+        self.v_dep = rnd.normal(180., 10., channels)            # depletion voltage in [V]
+        self.v_bd = rnd.normal(900., 50., channels)             # breakdown voltage in [V]
+        self.c_end = rnd.uniform(20E-12, 60E-12, channels)      # capacitance at full depletion in [F]
+        self.r_ser = rnd.uniform(10., 50., channels)            # series resistance in [Ohm]
+        self.v_bi = 0.7                                         # built-in voltage in [V]
+        self.c_stray = 0.5E-12                                  # capacitance of an open channel in [F]
+
+        ## About one cell in a hundred is shorted
+        bad = rnd.rand(channels) < 0.01
+        self.v_bd[bad] = 20.
+
+        self.bias = 0.
+        self.t_bias = 0.
+        self.channel = 'SHORTALL'
+        self.t_channel = 0.
+        self.measurement = 'IV'
+        self.cvres = 1000000
+
+    def set_bias(self, v):
+        if v != self.bias:
+            self.bias = v
+            self.t_bias = time.time()
+
+    def set_channel(self, channel):
+        if channel != self.channel:
+            self.channel = channel
+            self.t_channel = time.time()
+
+    def noise(self, val, floor=0.):
+        val = val * (1 + self.rnd.normal(0., config['noise']))
+        if floor:
+            val += self.rnd.normal(0., floor)
+        return val
+
+    def transient(self):
+        t = time.time()
+        f = 1. + 0.5 * np.exp(-(t - self.t_bias) / config['tau_bias'])
+        return f * (1. + 0.2 * np.exp(-(t - self.t_channel) / config['tau_channel']))
+
+    def leakage(self, v, c=None):
+        """ Leakage current at bias v of one channel, or of all channels if c is None. """
+        c = slice(None) if c is None else c % self.channels
+        u = abs(v)
+        dep = np.sqrt(np.minimum(u, self.v_dep[c]) / self.v_dep[c]) * (1. + 0.1 * np.maximum(u - self.v_dep[c], 0.) / self.v_dep[c])
+        bd = np.exp(np.minimum((u - self.v_bd[c]) / 10., 8.))
+        return np.sign(v) * self.i_dep[c] * dep * (1. + bd)
+
+    def capacitance(self, v, c):
+        c = c % self.channels
+        u = min(abs(v), self.v_dep[c])
+        return self.c_end[c] * np.sqrt((self.v_dep[c] + self.v_bi) / (u + self.v_bi))
+
+    def total_current(self):
+        return self.noise(np.sum(self.leakage(self.bias)) * self.transient(), config['current_floor'])
+
+    def cell_current(self):
+        if self.measurement != 'IV' or not isinstance(self.channel, int):
+            return self.noise(0., config['current_floor'])
+        return self.noise(self.leakage(self.bias, self.channel) * self.transient(), config['current_floor'])
+
+    def cell_impedance(self, f):
+        """ Series resistance and capacitance seen by the lcr meter. """
+        if self.measurement != 'CV' or not isinstance(self.channel, int):
+            return self.noise(1E3), self.noise(self.c_stray)
+        r = self.r_ser[self.channel % self.channels]
+        return self.noise(r), self.noise(self.capacitance(self.bias, self.channel) + self.c_stray)
+
+
+
+# Simulated VISA sessions
+# ---------------------------------
+
+class simulated_resource(object):
+    """
+    Minimal pyvisa resource. Commands are split at ';', every header is
+    dispatched to a handler method (see handlers) or, if there is none, stored
+    as a setting and returned on the matching query.
+    """
+
+    handlers = {}
+    defaults = {}
+
+    def __init__(self, name, model=None):
+        self.resource_name = name
+        self.model = model
+        self.timeout = 2000
+        self.unknown = 0
+        self.reset()
+
+    def reset(self):
+        self.settings = dict(self.defaults)
+
+    def normalise(self, head):
+        head = head.upper().lstrip(':').replace('SENSE', 'SENS')
+        return re.sub(':LEV(EL)?(?=\\?|$)', '', head)
+
+    def transact(self, cmd):
+        out = []
+        for part in cmd.split(';'):
+            part = part.strip()
+            if not part:
+                continue
+            head, _, arg = part.partition(' ')
+            head = self.normalise(head)
+            wait(get_latency(head))
+            ret = self.handle(head, arg.strip())
+            if ret is not None:
+                out.append(ret)
+        return ';'.join(out)
+
+    def handle(self, head, arg):
+        if head == '*IDN?':
+            return 'SIMULATED,%s,0,%s' % (self.model, self.resource_name)
+        if head == '*RST':
+            self.reset()
+            return None
+        if head in ['*OPC?', '*TST?']:
+            return '1' if head == '*OPC?' else '0'
+        if head in self.handlers:
+            return getattr(self, self.handlers[head])(arg)
+        if head.endswith('?'):
+            if head[:-1] not in self.settings:
+                self.unknown += 1
+            return self.settings.get(head[:-1], '0')
+        self.settings[head] = arg
+        return None
+
+    def write(self, cmd):
+        self.transact(cmd)
+        return len(cmd), 0
+
+    def query(self, cmd):
+        return self.transact(cmd)
+
+    def query_ascii_values(self, cmd, container=list):
+        return container([float(val) for val in self.query(cmd).split(',')])
+
+    def query_binary_values(self, cmd, datatype='f', is_big_endian=False, container=list):
+        ## Values are handed over as they are, without a binary block
+        return self.query_ascii_values(cmd, container)
+
+    def close(self):
+        return None
+
+
+class simulated_smu(simulated_resource):
+    """ Source meter (ke2410, ke2450) driving either the wafer bias or a 1 MOhm load. """
+
+    handlers = {
+        'SOUR:VOLT': 'set_voltage',
+        'SOUR:VOLT?': 'get_voltage',
+        'OUTP': 'set_output',
+        'OUTP:STAT?': 'get_output',
+        'READ?': 'read',
+        'FETC?': 'fetch',
+        'MEAS:VOLT?': 'read_voltage',
+        'MEAS:CURR?': 'read_current',
+        'MEAS:RES?': 'read_resistance',
+        'SENS:CURR:PROT:TRIP?': 'get_trip',
+        'SOUR:VOLT:ILIM:TRIP?': 'get_trip',
+        'SOUR:SWE:VOLT:LIN': 'set_sweep',
+        'INIT': 'run_sweep',
+    }
+    defaults = {
+        'SENS:CURR:PROT': '1.05E-4',
+        'SENS:VOLT:PROT': '210',
+        'SOUR:VOLT:ILIM': '1.05E-4',
+        'SENS:FUNC': "'CURR'",
+        'SOUR:VOLT:MODE': 'FIX',
+        'OUTP:INT:TRIP': '0',
+    }
+
+    def reset(self):
+        simulated_resource.reset(self)
+        self.v = 0.
+        self.output = 0
+        self.sweep = None
+        self.trace = []
+        self.apply()
+
+    def is_bias(self):
+        return self.resource_name == config['bias']
+
+    def apply(self):
+        if self.is_bias():
+            wafer.set_bias(self.v if self.output else 0.)
+
+    def limit(self):
+        if self.model == 'ke2450':
+            return float(self.settings['SOUR:VOLT:ILIM'])
+        return float(self.settings['SENS:CURR:PROT'])
+
+    def current(self):
+        if not self.output:
+            return 0.
+        i = wafer.total_current() if self.is_bias() else wafer.noise(self.v / 1E6, config['current_floor'])
+        return float(np.clip(i, -self.limit(), self.limit()))
+
+    def set_voltage(self, arg):
+        self.v = float(arg)
+        self.apply()
+
+    def get_voltage(self, arg):
+        return '%E' % self.v
+
+    def set_output(self, arg):
+        self.output = int(arg.upper() in ['ON', '1'])
+        self.apply()
+
+    def get_output(self, arg):
+        return '%d' % self.output
+
+    def read(self, arg):
+        if 'SOUR' in arg.upper() or self.settings.get('FORM:ELEM', '').upper() == 'VOLT,CURR':
+            return '%E,%E' % (self.v, self.current())
+        if 'VOLT' in self.settings['SENS:FUNC'].upper():
+            return '%E' % self.v
+        return '%E' % self.current()
+
+    def fetch(self, arg):
+        """ Readings of the last sweep, or the source value of the last one (2450 with SOUR). """
+        if 'SOUR' in arg.upper():
+            return '%E' % (self.trace[-1][0] if self.trace else self.v)
+        return ','.join(['%E,%E' % val for val in self.trace])
+
+    def read_voltage(self, arg):
+        return '%E' % self.v
+
+    def read_current(self, arg):
+        return '%E' % self.current()
+
+    def read_resistance(self, arg):
+        return '%E' % (self.v / self.current() if self.current() else 9.9E37)
+
+    def get_trip(self, arg):
+        if not self.output:
+            return '0'
+        i = wafer.total_current() if self.is_bias() else self.v / 1E6
+        return '%d' % (abs(i) >= self.limit())
+
+    def set_sweep(self, arg):
+        vals = [val.strip() for val in arg.split(',')]
+        self.sweep = (float(vals[0]), float(vals[1]), int(vals[2]), float(vals[3]), vals[6].upper() == 'ON')
+
+    def run_sweep(self, arg):
+        """ Runs the staircase of the 2410 sweep mode or of a 2450 sweep trigger model. """
+        if self.model == 'ke2450' and self.sweep is not None:
+            start, stop, points, delay, abort = self.sweep
+            self.sweep = None
+        elif self.settings['SOUR:VOLT:MODE'].upper().startswith('SWE'):
+            start = float(self.settings['SOUR:VOLT:STAR'])
+            stop = float(self.settings['SOUR:VOLT:STOP'])
+            points = int(self.settings['SOUR:SWE:POIN'])
+            delay = float(self.settings.get('SOUR:DEL', 0))
+            abort = self.settings.get('SOUR:SWE:CAB', 'NEV').upper().startswith('EARL')
+        else:
+            return None
+        self.trace = []
+        for k in range(points):
+            self.set_voltage(start + (stop - start) * k / float(max(points - 1, 1)))
+            wait(delay)
+            self.trace.append((self.v, self.current()))
+            if abort and self.get_trip('') == '1':
+                break
+        return None
+
+
+class simulated_ammeter(simulated_resource):
+    """ Picoammeter or multimeter reading the cell current of the selected channel. """
+
+    handlers = {
+        'READ?': 'read',
+        'MEAS:CURR?': 'read_current',
+        'MEAS:VOLT?': 'read_voltage',
+        'INIT': 'trigger',
+        'TRAC:CLE': 'clear',
+        'TRAC:DATA?': 'get_trace',
+        'CALC3:DATA?': 'get_stats',
+    }
+    defaults = {
+        'FORM:ELEM': 'READ,UNIT,TIME,STAT',
+        'TRIG:COUN': '1',
+        'CURR:NPLC': '1',
+        'CALC3:FORM': 'MEAN',
+    }
+
+    def reset(self):
+        simulated_resource.reset(self)
+        self.trace = []
+
+    def read(self, arg):
+        i = wafer.cell_current()
+        if self.settings['FORM:ELEM'].upper() == 'READ':
+            return '%E' % i
+        return '%EA,%E,%E' % (i, time.time() % 1E5, 0)
+
+    def read_current(self, arg):
+        return '%E' % wafer.cell_current()
+
+    def read_voltage(self, arg):
+        return '%E' % wafer.noise(wafer.bias)
+
+    def clear(self, arg):
+        self.trace = []
+
+    def trigger(self, arg):
+        ## Every reading takes one power line cycle per nplc
+        n = int(float(self.settings['TRIG:COUN']))
+        for k in range(n):
+            wait(float(self.settings['CURR:NPLC']) / 50.)
+            self.trace.append(wafer.cell_current())
+
+    def get_trace(self, arg):
+        return ','.join(['%E' % val for val in self.trace])
+
+    def get_stats(self, arg):
+        if self.settings['CALC3:FORM'].upper().startswith('SDEV'):
+            return '%E' % np.std(self.trace, ddof=1)
+        return '%E' % np.mean(self.trace)
+
+
+class simulated_lcr(simulated_resource):
+    """ LCR meter (hp4980) measuring the cell impedance of the selected channel. """
+
+    handlers = {
+        'FETC?': 'fetch',
+        'TRIG:IMM': 'trigger',
+        'MEM:DIM': 'dim_buffer',
+        'MEM:FILL': 'fill_buffer',
+        'MEM:CLE': 'clear_buffer',
+        'MEM:READ?': 'read_buffer',
+        '*TRG': 'trigger_list',
+        'FREQ': 'set_frequency',
+        'FREQ?': 'get_frequency',
+        'VOLT': 'set_level',
+        'VOLT?': 'get_level',
+    }
+    defaults = {
+        'FUNC:IMP': 'CPD',
+        'DISP:PAGE': 'MEAS',
+        'LIST:FREQ': '',
+    }
+
+    def reset(self):
+        simulated_resource.reset(self)
+        self.f = 1000.
+        self.level = 1.
+        self.buffer = None
+
+    def measure(self, f):
+        """ Primary and secondary parameter for the selected function. """
+        r, c = wafer.cell_impedance(f)
+        w = 2 * np.pi * f
+        d = w * r * c
+        mode = self.settings['FUNC:IMP'].upper()
+        if mode == 'RX':
+            return r, -1. / (w * c)
+        if mode == 'CSRS':
+            return c, r
+        if mode == 'CSD':
+            return c, d
+        if mode in ['CPD', 'CPRP']:
+            cp = c / (1 + d ** 2)
+            rp = (1 + d ** 2) / (w ** 2 * r * c ** 2)
+            return (cp, d) if mode == 'CPD' else (cp, rp)
+        return r, -1. / (w * c)
+
+    def fetch(self, arg):
+        return '%E,%E,%d' % (self.measure(self.f) + (0,))
+
+    def trigger(self, arg):
+        if self.buffer is not None:
+            self.buffer.append(self.measure(self.f))
+
+    def dim_buffer(self, arg):
+        self.size = int(arg.split(',')[-1])
+
+    def fill_buffer(self, arg):
+        self.buffer = []
+
+    def clear_buffer(self, arg):
+        self.buffer = None
+
+    def read_buffer(self, arg):
+        ## Entries not measured yet are returned with status -1
+        vals = (self.buffer or [])[:self.size]
+        return ','.join(['%E,%E,%d,%d' % (a, b, 0, 0) for a, b in vals] + ['9.9E37,9.9E37,-1,0'] * (self.size - len(vals)))
+
+    def trigger_list(self, arg):
+        freqs = [float(val) for val in self.settings['LIST:FREQ'].split(',') if val.strip()]
+        if self.settings['DISP:PAGE'].upper() != 'LIST' or len(freqs) == 0:
+            return self.fetch(arg)
+        for k in range(len(freqs) - 1):
+            wait(get_latency('*TRG'))
+        return ','.join(['%E,%E,%d,%d' % (self.measure(f) + (0, 0)) for f in freqs])
+
+    def set_frequency(self, arg):
+        self.f = float(arg.upper().replace('HZ', ''))
+
+    def get_frequency(self, arg):
+        return '%E' % self.f
+
+    def set_level(self, arg):
+        self.level = float(arg.upper().replace('V', ''))
+
+    def get_level(self, arg):
+        return '%E' % self.level
+
+
+
+# Simulated serial port
+# ---------------------------------
+
+class simulated_port(object):
+    """
+    Minimal pyserial port with a switchcard behind it. Every command line is
+    answered with its echo, the response lines and the '>' prompt.
+    """
+
+    def __init__(self, port, timeout=0.1):
+        self.name = port
+        self.port = port
+        self.timeout = timeout
+        self.is_open = True
+        self.buf = ''
+        self.cond = threading.Condition()
+        self.ui = {'REPRESENTATION': 'HEX', 'TIMEOUT': '5', 'DISPLAY': 'ON'}
+
+    def handle(self, cmd):
+        head, _, arg = cmd.partition(' ')
+        head = head.upper()
+        arg = arg.strip()
+        query = arg == '?'
+        if head == 'MATRIX.CHANNEL':
+            if query:
+                return [str(wafer.channel)]
+            wafer.set_channel(int(arg))
+        elif head == 'MATRIX.SHORTALL':
+            wafer.set_channel('SHORTALL')
+        elif head == 'MATRIX.MEASUREMENT':
+            if query:
+                return [wafer.measurement]
+            wafer.measurement = arg.upper()
+        elif head == 'MATRIX.CVRES':
+            if query:
+                return ['%d' % wafer.cvres]
+            wafer.cvres = int(float(arg))
+        elif head == 'MATRIX.INFO':
+            return ['CHANNEL: %s' % wafer.channel, 'MEASUREMENT: %s' % wafer.measurement, 'CVRES: %d' % wafer.cvres]
+        elif head in ['MATRIX.TEMPERATURE', 'PROBECARD.TEMPERATURE']:
+            return ['%.1f' % wafer.noise(23.)]
+        elif head in ['MATRIX.HUMIDITY', 'PROBECARD.HUMIDITY']:
+            return ['%.1f' % wafer.noise(35.)]
+        elif head.startswith('UI.') and head[3:] in self.ui:
+            if query:
+                return [self.ui[head[3:]]]
+            self.ui[head[3:]] = arg.upper()
+        elif head == 'UI.INFO':
+            return ['%s: %s' % (key, val) for key, val in sorted(self.ui.items())]
+        elif head == 'SYS.REBOOT':
+            wafer.set_channel('SHORTALL')
+        return []
+
+    def write(self, data):
+        for cmd in data.splitlines():
+            if not cmd.strip():
+                continue
+            wait(get_latency(cmd.strip().upper()))
+            lines = [cmd.strip()] + self.handle(cmd.strip())
+            with self.cond:
+                self.buf += '\r\n'.join(lines) + '\r\n>'
+                self.cond.notify_all()
+        return len(data)
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise ValueError("Attempting to use a port that is not open")
+        with self.cond:
+            if not self.buf:
+                self.cond.wait(self.timeout)
+            data, self.buf = self.buf[:size], self.buf[size:]
+        return data
+
+    def readline(self):
+        with self.cond:
+            n = self.buf.find('\n') + 1 or len(self.buf)
+            data, self.buf = self.buf[:n], self.buf[n:]
+        return data
+
+    def inWaiting(self):
+        return len(self.buf)
+
+    @property
+    def in_waiting(self):
+        return len(self.buf)
+
+    def flushInput(self):
+        with self.cond:
+            self.buf = ''
+
+    def flushOutput(self):
+        pass
+
+    def open(self):
+        self.is_open = True
+
+    def isOpen(self):
+        return self.is_open
+
+    def close(self):
+        with self.cond:
+            self.is_open = False
+            self.cond.notify_all()
@@ -33,13 +33,24 @@ class switchcard(device):
     print dev.get_display_mode()
     print dev.set_display_timeout(2)
     print dev.get_display_timeout()
+    print dev.resync()
+    print dev.skipped
 
     time.sleep(1)
     dev.close_connection()
+
+    State cache:
+    -------------
+    The card's last acknowledged state (channel, measurement type, cv
+    resistance and ui settings) is tracked client side. Setters that would
+    not change it are skipped and counted in skipped. reboot and halt clear
+    the cache, resync re-reads it from the card.
     """
 
     def __init__(self, port):
-        device.__init__(self, port=port, baudrate=115200, termination='\r\n')
+        device.__init__(self, port=port, baudrate=115200, termination='\r\n', reader=1)
+        self.state = {}
+        self.skipped = 0
         recv = self.query("SYS.INFO")
         info = [''.join(i).strip() for i in recv]
         self.logging.info(' | '.join(info))
@@ -72,15 +83,75 @@ class switchcard(device):
     def reboot(self, debug=0):
         if debug == 1:
             self.logging.info("Rebooting device.")
+        self.state = {}
         return self.write("SYS.REBOOT")
 
     def halt(self, debug=0):
         if debug == 1:
             self.logging.info("Freezing CPU.")
+        self.state = {}
         return self.write("SYS.HALT")
 
 
 
+    # State cache functions
+    # ---------------------------------
+
+    def set_state(self, key, val, cmd):
+        """
+        Sends cmd unless the cached state says the card already has key set
+        to val. Only acknowledged commands update the cache, a failed one
+        drops the entry so the next request is sent again.
+        """
+        if key in self.state and self.state[key] == val:
+            self.skipped += 1
+            return 0
+        ret = self.write(cmd)
+        if ret == 0:
+            self.state[key] = val
+        else:
+            self.state.pop(key, None)
+        return ret
+
+    def resync(self, debug=0):
+        """
+        Re-reads the matrix and ui state from MATRIX.INFO and UI.INFO. Entries
+        that cannot be parsed are dropped from the cache and will be sent
+        again on the next request.
+        """
+        if debug == 1:
+            self.logging.info("Re-reading matrix state.")
+        keys = [('CHANNEL', 'channel'), ('MEASUREMENT', 'measurement'), ('CVRES', 'cvres'),
+                ('REPRESENTATION', 'representation'), ('TIMEOUT', 'timeout'), ('DISPLAY', 'display')]
+
+        info = {}
+        for recv in [self.query("MATRIX.INFO"), self.query("UI.INFO")]:
+            if recv == -1:
+                continue
+            for line in recv:
+                for sep in [':', '=', ' ']:
+                    if line.find(sep) != -1:
+                        name, val = line.split(sep, 1)
+                        info[name.strip().upper()] = val.strip().upper()
+                        break
+
+        self.state = {}
+        for name, key in keys:
+            for k in info:
+                if k.endswith(name):
+                    self.state[key] = self.parse_state(key, info[k])
+        return self.state
+
+    def parse_state(self, key, val):
+        if key in ['channel', 'cvres', 'timeout']:
+            try:
+                return int(float(val))
+            except ValueError:
+                return val
+        return val
+
+
+
     # Switch functions
     # ---------------------------------
 
@@ -136,13 +207,13 @@ class switchcard(device):
     def set_measurement_type(self, typ, debug=0):
         if debug == 1:
             self.logging.info("Setting measurement type. Valid values are ['IV','CV'].")
-        return self.write("MATRIX.MEASUREMENT %s" % typ)
+        return self.set_state('measurement', typ, "MATRIX.MEASUREMENT %s" % typ)
 
     def set_cv_resistance(self, val, debug=0):
         if debug == 1:
             self.logging.info("Setting measurement type. Valid values are [1e5, 5e5, 1e6, 2e6, 5e6, 1e7, 5e7, 1e8].")
         try:
-            d = self.write("MATRIX.CVRES %d" % val)
+            d = self.set_state('cvres', int(val), "MATRIX.CVRES %d" % val)
             return 0
         except StandardError:
             self.logging.info("This switchcard or firmware version does not have variable CV resistance.")
@@ -151,12 +222,15 @@ class switchcard(device):
     def open_channel(self, channel, debug=0):
         if debug == 1:
             self.logging.info("Selecting measurement channel. Valid values are [0-511].")
-        return self.write("MATRIX.CHANNEL %d" % channel)
+        return self.set_state('channel', int(channel), "MATRIX.CHANNEL %d" % channel)
 
     def shortall(self, debug=0):
         if debug == 1:
             self.logging.info("Shorting all channels to ground.")
-        return self.write("MATRIX.SHORTALL")
+        return self.set_state('channel', 'SHORTALL', "MATRIX.SHORTALL")
+
+    def short_all(self, debug=0):
+        return self.shortall(debug)
 
 
 
@@ -226,14 +300,14 @@ class switchcard(device):
     def set_representation(self, val='HEX', debug=0):
         if debug == 1:
             self.logging.info("Setting the representation of the channel number displayed on the 7 segment display. Valid values are ['DEC','OCT','HEX'].")
-        return self.write("UI.REPRESENTATION %s" % val)
+        return self.set_state('representation', val, "UI.REPRESENTATION %s" % val)
 
     def set_display_timeout(self, val=5, debug=0):
         if debug == 1:
             self.logging.info("Setting how long the display should be on in the AUTO mode. Unit is [s].")
-        return self.write("UI.TIMEOUT %d" % val)
+        return self.set_state('timeout', int(val), "UI.TIMEOUT %d" % val)
 
     def set_display_mode(self, val='OFF', debug=0):
         if debug == 1:
             self.logging.info("Setting display mode. Valid values are ['ON','OFF','AUTO'].")
-        return self.write("UI.DISPLAY %s" % val)
+        return self.set_state('display', val, "UI.DISPLAY %s" % val)
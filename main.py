@@ -1,16 +1,34 @@
 import os
+import sys
 import measurements
+from measurements import plotter
 from optparse import OptionParser
 
 
 def main():
-	usage = "usage: prog [options] id test[(parameter=value parameter2=value)]"
+	usage = "usage: prog [options] id test[(parameter=value parameter2=value)]\n       prog [options] --stations FILE"
 
 	parser = OptionParser(usage=usage, version="prog 0.01")
 	parser.add_option("-l", "--list-tests", action="store_true", dest="list_tests", default=False,  help="list all avaliable measurements")
+	parser.add_option("-s", "--simulate", action="store_true", dest="simulate", default=False, help="run against simulated instruments instead of hardware")
+	parser.add_option("--time-scale", type="float", dest="time_scale", default=1., help="factor on the simulated instrument delays, 0 runs as fast as possible")
+	parser.add_option("-r", "--resume", type="string", dest="resume", default="", help="resume the run RUN (e.g. 03_20180101_120000) of the identifier from its checkpoint", metavar="RUN")
+	parser.add_option("--no-plots", action="store_true", dest="no_plots", default=False, help="don't draw any graphs, for high throughput")
+	parser.add_option("--noise", type="float", dest="noise", default=1E-3, help="relative noise of the simulated readings")
+	parser.add_option("--stations", type="string", dest="stations", default="", help="run the test queues of all stations in FILE concurrently, see stations.py", metavar="FILE")
 
 	(options, args) = parser.parse_args()
 
+	if options.stations:
+		import stations
+		inventory, errors = stations.read_inventory(options.stations)
+		for err in errors:
+			print err
+		if errors:
+			return 1
+		opt = {'simulate': options.simulate, 'time_scale': options.time_scale, 'noise': options.noise, 'no_plots': options.no_plots}
+		return 1 if stations.orchestrator(inventory, opt).run() else 0
+
 	if len(args) < 1:
 		parser.error("You have to give an identifier. Try '-h' to get more info.")
 
@@ -21,34 +39,40 @@ def main():
 		test_list = args[1:]
 
 	if options.list_tests:
-		list_of_tests = []
-		list_of_valid_prefix = ['test', 'msr', 'measurement', 'exp', 'experiment']
-
-		for test_name in dir(measurements):
-			for prefix in list_of_valid_prefix:
-				if len(prefix) < len(test_name):
-					if test_name[len(prefix)].isdigit():
-						list_of_tests.append(test_name)
-
 		print "%-40s | %s" % ("Test Name", "Description")
 		print "-" * 80
-		for test_name in sorted(list_of_tests):
-			test = getattr(measurements, test_name)
-			print "%-40s | %s" % (test_name, test.__doc__)
+		for test_name, doc in measurements.list_tests():
+			print "%-40s | %s" % (test_name, doc)
 
 		return 0
 
+	if options.resume:
+		if len(test_list) != 1:
+			parser.error("Give exactly one test to resume.")
+		if not os.path.exists("logs/%s/%s/checkpoint.json" % (id, options.resume)):
+			parser.error("Run %s of %s has no checkpoint." % (options.resume, id))
+
+	## The plotting process is forked before any instrument is opened
+	if not options.no_plots:
+		plotter.start()
+
+	if options.simulate:
+		import devices
+		devices.simulated_transport.enable(time_scale=options.time_scale, noise=options.noise)
+
 	for test_name in test_list:
 		try:
-			test = getattr(measurements, test_name)
+			test = measurements.load_test(test_name)
 		except AttributeError:
 			print('Unknown Test.')
 			return 1
 
-		msr = test(ide = id)
+		msr = test(ide = id, resume = options.resume)
+		if options.no_plots:
+			msr.plots = 0
 		msr.initialise()
 		msr.execute()
 		msr.finalise()
 
 if __name__=="__main__":
-	main()
+	sys.exit(main())
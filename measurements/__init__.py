@@ -1,11 +1,2 @@
-from measurement import measurement
-from test00_debugging import test00_debugging
-from test01_safety_check import test01_safety_check
-from test02_scan_iv import test02_scan_iv
-from test03_scan_cv import test03_scan_cv
-from test04_single_iv import test04_single_iv
-from test05_single_cv import test05_single_cv
-from test06_longterm_iv import test06_longterm_iv
-from test07_longterm_cv import test07_longterm_cv
-from test08_interpad_res import test08_interpad_res
-from test09_interpad_cap import test09_interpad_cap
+## Tests are found and imported on demand, see registry.py
+from registry import list_tests, load_test
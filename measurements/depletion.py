@@ -0,0 +1,95 @@
+import numpy as np
+from utils import fit_depletion_voltage
+
+
+class depletion_refiner(object):
+    """
+    Adaptive voltage plan for CV scans, passed to the scan as refine.
+
+    The scan starts on the coarse grid of the test's voltage list. After
+    every voltage the 1/C^2 curve of every cell is fitted with two lines
+    (see utils.fit_depletion_voltage). The scan stops as soon as the
+    depletion voltage of every fitted cell is known to better than tol.
+    Once the coarse grid is done, every round adds up to per_round voltages
+    in the middle of the grid gaps that hold the depletion voltages of most
+    unresolved cells, until all cells are resolved, no new voltage would be
+    min_step away from the measured ones or max_points voltages are
+    measured. Added voltages are measured in ascending order, the bias
+    ramps back down for each round.
+
+    data(rows) returns the voltage, channel, capacitance and capacitance
+    error arrays of the scan rows.
+
+    Example:
+    -------------
+    refine = depletion_refiner(self.depletion_data, tol=5.)
+    out = scan(self, plan, stages, self.handle_point, fmt, pow_supply, switch, refine=refine).run()
+    print refine.vdep
+    """
+
+    def __init__(self, data, tol=5., per_round=2, min_step=2., max_points=40, min_points=3):
+        self.data = data
+        self.tol = tol
+        self.per_round = per_round
+        self.min_step = min_step
+        self.max_points = max_points
+        self.min_points = min_points
+        self.rounds = 0
+        self.vdep = {}
+
+    def fit(self, rows):
+        """ Fits every cell, returns channel -> (depletion voltage, uncertainty) in [V]. """
+        v, ch, c, c_err = [np.asarray(a, dtype=float) for a in self.data(rows)]
+        vdep = {}
+        for cell in np.unique(ch):
+            sel = (ch == cell) & np.isfinite(c)
+            if not sel.any():
+                continue
+            vdep[int(cell)] = fit_depletion_voltage(v[sel], c[sel], c_err[sel], self.min_points)
+        return vdep
+
+    def unresolved(self):
+        return [cell for cell in sorted(self.vdep) if not self.vdep[cell][1] < self.tol]
+
+    def __call__(self, scan, done, pending):
+        if len(done) < 2 * self.min_points:
+            return pending
+
+        self.vdep = self.fit(scan.out)
+        open_cells = self.unresolved()
+        if self.vdep and not open_cells:
+            scan.logging.info("Depletion voltage of all %d cells known to better than %.1f V after %d voltages." \
+                % (len(self.vdep), self.tol, len(done)))
+            return []
+        if pending:
+            return pending
+        if len(done) >= self.max_points:
+            scan.logging.warning("%d cells unresolved after %d voltages, stopping refinement." % (len(open_cells), len(done)))
+            return []
+
+        new = self.propose(done, open_cells)
+        if not new:
+            scan.logging.warning("%d cells unresolved and no voltage gap left to refine." % len(open_cells))
+            return []
+        self.rounds += 1
+        scan.logging.info("Refinement round %d: %d of %d cells unresolved, adding %s V." \
+            % (self.rounds, len(open_cells), len(self.vdep), ', '.join(['%.1f' % val for val in new])))
+        return new
+
+    def propose(self, done, cells):
+        """ Mid points of the grid gaps holding the depletion voltages of most cells. """
+        grid = np.unique(np.abs(done))
+        sign = -1. if np.mean(done) < 0 else 1.
+        votes = {}
+        for cell in cells:
+            vdep = self.vdep[cell][0]
+            if not np.isfinite(vdep):
+                continue
+            k = np.searchsorted(grid, abs(vdep))
+            if k == 0 or k == len(grid):
+                continue
+            if grid[k] - grid[k - 1] < 2 * self.min_step:
+                continue
+            votes[k] = votes.get(k, 0) + 1
+        best = sorted(votes, key=lambda k: (-votes[k], k))[:min(self.per_round, self.max_points - len(done))]
+        return [sign * 0.5 * (grid[k - 1] + grid[k]) for k in sorted(best)]
@@ -3,24 +3,33 @@ import time
 import getpass
 import socket
 import glob
+import json
 import logging
 import platform
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
-import matplotlib
+import plotter
 from utils import add_coloring_to_emit_ansi, add_coloring_to_emit_windows
+from utils import data_writer
+from utils import run_catalogue
 
 
 def mkdir(d):
     if not os.path.exists(d):
         os.makedirs(d)
 
+def replace_file(src, dst):
+    ## os.rename doesn't overwrite on Windows
+    try:
+        os.rename(src, dst)
+    except OSError:
+        os.remove(dst)
+        os.rename(src, dst)
+
 
 class measurement(object):
     """ Abstract measurement class. """
 
-    def __init__(self, ide="", dire=""):
+    def __init__(self, ide="", dire="", resume=""):
         self.id = ide
         self.base = dire
 
@@ -28,8 +37,16 @@ class measurement(object):
         self.ldir = "%slogs/%s" % (self.base, self.id)
         mkdir(self.ldir)
 
-        ## Create run directory
-        self.nrun = self.get_run_id(self.id)
+        ## Run catalogue, allocates the run numbers
+        self.status = 'done'
+        self.catalogue_error = None
+        try:
+            self.catalogue = run_catalogue("%slogs/catalogue.sqlite" % self.base)
+        except Exception as e:
+            self.catalogue, self.catalogue_error = None, e
+
+        ## Create run directory, or continue in the one of the resumed run
+        self.nrun = resume if resume else self.get_run_id(self.id)
         self.rdir = "%s/%s" % (self.ldir, self.nrun)
         mkdir(self.rdir)
 
@@ -58,6 +75,29 @@ class measurement(object):
         fileHandler.setFormatter(logFormatter)
         self.logging.addHandler(fileHandler)
 
+        if self.catalogue_error is not None:
+            self.logging.warning("Run catalogue not available, run numbers are taken from %s. %s" % (self.ldir, self.catalogue_error))
+        self.record(rdir=self.rdir, status='running', stop=None)
+
+        ## Settling defaults, see settle()
+        self.settle_mode = 'slope'      # convergence criterion ['slope', 'std']
+        self.settle_window = 5          # number of samples in the sliding window
+        self.settle_tol = 0.01          # relative tolerance on the window mean
+        self.settle_atol = 0.           # absolute tolerance for values close to zero
+
+        ## Ramping defaults, see devices/ramping.py
+        self.ramp_rate = 25.            # slew rate of the bias voltage in [V/s]
+        self.ramp_step = 5.             # step size of the bias ramp in [V]
+        self.ramp_mode = 'step'         # ['step', 'sweep'], sweep lets the source meter pace the ramp
+        self.serpentine = 0             # 1 reverses the channel order on every second voltage, see utils/channel_order.py
+
+        ## Plotting, see plotter.py
+        self.plots = 1                  # 0 skips all graphs (main.py --no-plots)
+        self.plots_background = 1       # 0 draws the graphs on the measurement thread
+
+        ## Checkpoint of the resumed run, see measurements/scan.py
+        self.resume_state = self.load_checkpoint() if resume else None
+
 
 
     def get_time(self):
@@ -73,6 +113,12 @@ class measurement(object):
         return socket.gethostname()
 
     def get_run_id(self, die_name):
+        """ Allocates the next run of die_name in the run catalogue, without one from the run directories. """
+        if self.catalogue is not None:
+            try:
+                return self.catalogue.allocate(die_name, self.__class__.__name__, host=self.get_host_name(), user=self.get_user_name())
+            except Exception as e:
+                self.catalogue, self.catalogue_error = None, e
         id_list = [-1]
         for dname in glob.glob("logs/%s/*" % die_name):
             name = os.path.basename(dname)
@@ -84,103 +130,102 @@ class measurement(object):
         run_id = "%02d_%s" % (new_id, now)
         return run_id
 
+    def record(self, **fields):
+        """ Updates the catalogue entry of this run, see utils/run_catalogue.py. """
+        if self.catalogue is None:
+            return -1
+        try:
+            self.catalogue.update(self.id, self.nrun, **fields)
+        except Exception as e:
+            self.logging.warning("Run catalogue not updated. %s" % e)
+            return -1
+        return 0
+
+    def instruments(self):
+        """ Instrument addresses and ports of the test. """
+        return dict([(key, val) for key, val in vars(self).items() if key.endswith('_address')])
+
+    def settle(self, read, max_wait, atol=None, rtol=None):
+        """
+        Adaptive replacement for a fixed delay. Calls read() until the last
+        settle_window samples have converged, or until max_wait seconds have
+        passed. read() returns one sample or an array of samples along the
+        first axis (e.g. a burst). In 'slope' mode the drift of a linear fit
+        across the window, in 'std' mode the standard deviation of the window
+        must stay below settle_tol (or rtol) times the window mean (or atol).
+
+        Returns the samples of the final window and the settle time in [s].
+        If the samples haven't converged by max_wait, the samples of one more
+        read() after the cap are returned instead, with a settle time of at
+        least max_wait.
+        """
+        if atol is None:
+            atol = self.settle_atol
+        if rtol is None:
+            rtol = self.settle_tol
+
+        samples = []
+        t0 = time.time()
+        while True:
+            vals = np.asarray(read(), dtype=float)
+            samples.extend(np.atleast_1d(vals))
+            t = time.time() - t0
+            win = np.array(samples[-self.settle_window:])
+            if len(samples) >= self.settle_window:
+                if self.settle_mode == 'std':
+                    spread = np.std(win, axis=0)
+                else:
+                    spread = np.abs(np.polyfit(np.arange(len(win)), win, 1)[0]) * (len(win) - 1)
+                if np.all(spread <= np.maximum(rtol * np.abs(np.mean(win, axis=0)), atol)):
+                    return win, t
+
+            ## Not settled within max_wait, the cap holds even if the window is not full yet.
+            ## Measure once more after the cap instead of returning the samples taken while settling.
+            if t >= max_wait:
+                win = np.atleast_1d(np.asarray(read(), dtype=float))
+                return win, time.time() - t0
+
+    def load_checkpoint(self, fn="checkpoint.json"):
+        try:
+            with open('%s/%s' % (self.rdir, fn)) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            self.logging.error("No valid checkpoint in %s." % self.rdir)
+            return None
+        self.logging.info("Resuming run %s from its checkpoint of %s." % (self.nrun, state.get('date')))
+        return state
+
     def save_list(self, out, fn="out.dat", info="Saving output to file %s", fmt="%d", header='# Header'):
         np.savetxt('%s/%s' % (self.rdir, fn), np.array(out), fmt, delimiter='\t',  header=header)
         self.logging.info(info % self.rdir+'/'+fn)
+        self.record(files=[fn])
         return 0
 
-    def print_graph(self, x, y, yerr, xlabel, ylabel, title, fn="out.dat", info="Saving output to file %s"):
-        self.init_style_old()
-        #plt.gca().margins(0.1, 0.1)
-        plt.errorbar(x, y, yerr=yerr, ls=' ', marker='s')
-        plt.gca().yaxis.set_major_formatter(mtick.FormatStrFormatter('%.3E'))
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.title(title)
-        plt.tight_layout()
-        plt.savefig('%s/%s' % (self.rdir, fn), bbox_inches='tight')
-        plt.clf()
+    def open_writer(self, fn="out.dat", info="Streaming output to file %s", fmt="%.5E", header='# Header'):
+        """ Returns a data_writer that appends the rows to fn in the run directory as they come. """
+        ## Keep the rows of the resumed run up to its checkpoint
+        rows = None
+        if self.resume_state is not None and self.resume_state.get('data') == fn:
+            rows = self.resume_state['rows']
+        writer = data_writer('%s/%s' % (self.rdir, fn), header=header, fmt=fmt, rows=rows)
         self.logging.info(info % self.rdir+'/'+fn)
+        self.record(files=[fn])
+        return writer
+
+    def print_graph(self, x, y, yerr, xlabel, ylabel, title, fn="out.dat", info="Saving output to file %s"):
+        """ Queues the graph for the plotting process, see plotter.py. Skipped if plots is 0. """
+        if not self.plots:
+            return 0
+        path = '%s/%s' % (self.rdir, fn)
+        plotter.submit(plotter.render, (np.asarray(x), np.asarray(y), np.asarray(yerr), xlabel, ylabel, title, path), \
+            lambda err: self.plot_done(path, err, info), self.plots_background)
         return 0
 
-    def init_style_old(self):
-        plt.style.use('seaborn-colorblind')
-        #plt.style.use('fivethirtyeight')
-
-        ## Figure
-        plt.rcParams['figure.figsize'] = (7.5, 5.5)
-        plt.rcParams['figure.titlesize'] = 'large'
-        plt.rcParams['figure.titleweight'] = 'normal'
-        plt.rcParams['figure.facecolor'] = 'w'
-        plt.rcParams['figure.edgecolor'] = 'w'
-
-        ## Fonts
-        plt.rcParams['font.size'] = 16
-        plt.rcParams['font.family'] = 'sans-serif'
-        plt.rcParams['font.sans-serif'] = 'arial'
-
-        ## Axes
-        plt.rcParams['axes.linewidth'] = 1.5
-        plt.rcParams['axes.titlesize'] = 'large'
-        plt.rcParams['axes.labelsize'] = 'medium'
-        plt.rcParams['axes.labelweight'] = 'normal'
-        plt.rcParams['axes.spines.left'] = True
-        plt.rcParams['axes.spines.bottom'] = True
-        plt.rcParams['axes.spines.top'] = False
-        plt.rcParams['axes.spines.right'] = False
-        plt.rcParams['axes.grid'] = False
-
-        ## Grid
-        plt.rcParams['grid.color'] = 'k'
-        plt.rcParams['grid.linestyle'] = '--'
-        plt.rcParams['grid.linewidth'] = 0.8
-        plt.rcParams['grid.alpha'] = 0.5                # transparency, between 0.0 and 1.0
-
-        ## Lines
-        plt.rcParams['lines.linewidth'] = 1.3
-        plt.rcParams['lines.markeredgewidth'] = 1.5
-        plt.rcParams['lines.markersize'] = 6
-
-        ## Markers
-        plt.rcParams['markers.fillstyle'] = 'none' # full|left|right|bottom|top|none
-
-        ## Ticks
-        plt.rcParams['xtick.color'] = 'k'
-        plt.rcParams['xtick.labelsize'] = 'small'
-        plt.rcParams['ytick.color'] = 'k'
-        plt.rcParams['ytick.labelsize'] = 'small'
-        plt.rcParams['xtick.minor.visible'] = True
-        plt.rcParams['ytick.minor.visible'] = True
-        plt.rcParams['xtick.major.size'] = 8
-        plt.rcParams['xtick.minor.size'] = 4.5
-        plt.rcParams['xtick.major.width'] = 1.3
-        plt.rcParams['xtick.minor.width'] = 1.3
-        plt.rcParams['ytick.major.size'] = 8
-        plt.rcParams['ytick.minor.size'] = 4.5
-        plt.rcParams['ytick.major.width'] = 1.3
-        plt.rcParams['ytick.minor.width'] = 1.3
-        plt.rcParams['xtick.direction'] = 'out'
-        plt.rcParams['ytick.direction'] = 'out'
-
-        plt.gca().xaxis.set_ticks_position('bottom')
-        plt.gca().yaxis.set_ticks_position('left')
-
-        ## Legend
-        plt.rcParams['legend.frameon'] = False
-        plt.rcParams['legend.framealpha'] = 0.8
-        plt.rcParams['legend.facecolor'] = 'inherit'
-        plt.rcParams['legend.fancybox'] = False
-        plt.rcParams['legend.shadow'] = False
-        plt.rcParams['legend.numpoints'] = 1
-        plt.rcParams['legend.scatterpoints'] = 1
-        plt.rcParams['legend.markerscale'] = 1.0
-        plt.rcParams['legend.fontsize'] = 'small'
-
-        ## Specific
-        plt.rcParams['image.cmap'] = 'viridis'
-        plt.rcParams['contour.negative_linestyle'] = 'dashed'       # dashed | solid
-        plt.rcParams['errorbar.capsize'] = 0                        # length of end cap on error bars in pixels
-        plt.rcParams['savefig.transparent'] = False
+    def plot_done(self, path, err, info="Saving output to file %s"):
+        if err is None:
+            self.logging.info(info % path)
+        else:
+            self.logging.error("Plotting %s failed. %s" % (path, err))
 
 
 
@@ -201,3 +246,4 @@ class measurement(object):
         self.logging.info("Cleaning up.")
         self.logging.info("\t")
         self.logging.info("\t")
+        self.record(status=self.status, stop=time.time())
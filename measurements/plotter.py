@@ -0,0 +1,155 @@
+import atexit
+import multiprocessing
+
+
+## Figure style, applied once per plotting process
+STYLE = {
+    ## Figure
+    'figure.figsize': (7.5, 5.5),
+    'figure.titlesize': 'large',
+    'figure.titleweight': 'normal',
+    'figure.facecolor': 'w',
+    'figure.edgecolor': 'w',
+
+    ## Fonts
+    'font.size': 16,
+    'font.family': 'sans-serif',
+    'font.sans-serif': 'arial',
+
+    ## Axes
+    'axes.linewidth': 1.5,
+    'axes.titlesize': 'large',
+    'axes.labelsize': 'medium',
+    'axes.labelweight': 'normal',
+    'axes.spines.left': True,
+    'axes.spines.bottom': True,
+    'axes.spines.top': False,
+    'axes.spines.right': False,
+    'axes.grid': False,
+
+    ## Grid
+    'grid.color': 'k',
+    'grid.linestyle': '--',
+    'grid.linewidth': 0.8,
+    'grid.alpha': 0.5,                  # transparency, between 0.0 and 1.0
+
+    ## Lines
+    'lines.linewidth': 1.3,
+    'lines.markeredgewidth': 1.5,
+    'lines.markersize': 6,
+
+    ## Markers
+    'markers.fillstyle': 'none',        # full|left|right|bottom|top|none
+
+    ## Ticks
+    'xtick.color': 'k',
+    'xtick.labelsize': 'small',
+    'ytick.color': 'k',
+    'ytick.labelsize': 'small',
+    'xtick.minor.visible': True,
+    'ytick.minor.visible': True,
+    'xtick.major.size': 8,
+    'xtick.minor.size': 4.5,
+    'xtick.major.width': 1.3,
+    'xtick.minor.width': 1.3,
+    'ytick.major.size': 8,
+    'ytick.minor.size': 4.5,
+    'ytick.major.width': 1.3,
+    'ytick.minor.width': 1.3,
+    'xtick.direction': 'out',
+    'ytick.direction': 'out',
+
+    ## Legend
+    'legend.frameon': False,
+    'legend.framealpha': 0.8,
+    'legend.facecolor': 'inherit',
+    'legend.fancybox': False,
+    'legend.shadow': False,
+    'legend.numpoints': 1,
+    'legend.scatterpoints': 1,
+    'legend.markerscale': 1.0,
+    'legend.fontsize': 'small',
+
+    ## Specific
+    'image.cmap': 'viridis',
+    'contour.negative_linestyle': 'dashed',     # dashed | solid
+    'errorbar.capsize': 0,                      # length of end cap on error bars in pixels
+    'savefig.transparent': False,
+}
+
+_styled = 0
+_pool = None
+
+
+
+def apply_style():
+    global _styled
+    if _styled:
+        return
+    import matplotlib
+    import matplotlib.style
+    matplotlib.style.use('seaborn-colorblind')
+    matplotlib.rcParams.update(STYLE)
+    _styled = 1
+
+
+def render(x, y, yerr, xlabel, ylabel, title, fn):
+    """ Draws an error bar graph into fn. Returns None or the error message. """
+    try:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        import matplotlib.ticker as mtick
+
+        apply_style()
+        fig = Figure()
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        ax.xaxis.set_ticks_position('bottom')
+        ax.yaxis.set_ticks_position('left')
+        ax.errorbar(x, y, yerr=yerr, ls=' ', marker='s')
+        ax.yaxis.set_major_formatter(mtick.FormatStrFormatter('%.3E'))
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        ax.set_title(title)
+        fig.tight_layout()
+        fig.savefig(fn, bbox_inches='tight')
+    except Exception as e:
+        return '%s: %s' % (e.__class__.__name__, e)
+    return None
+
+
+def start():
+    """
+    Starts the plotting process. It is forked from the measurement process,
+    so start it before any instrument is opened, otherwise it inherits the
+    open VISA and serial handles and the locks of their reader threads.
+    """
+    global _pool
+    if _pool is None:
+        _pool = multiprocessing.Pool(1)
+        atexit.register(wait)
+    return 0
+
+
+def submit(fn, args, callback=None, background=1):
+    """
+    Runs fn(*args) in the plotting process and calls callback(result) there
+    when done, so the measurement doesn't wait for matplotlib. The process is
+    started by start() or else on first use, and drained at interpreter exit.
+    """
+    if not background:
+        ret = fn(*args)
+        if callback is not None:
+            callback(ret)
+        return
+    start()
+    _pool.apply_async(fn, args, callback=callback)
+
+
+def wait():
+    """ Waits for the queued plots and stops the plotting process. """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+        _pool = None
@@ -0,0 +1,54 @@
+import os
+import ast
+import importlib
+
+
+VALID_PREFIX = ['test', 'msr', 'measurement', 'exp', 'experiment']
+
+
+
+def is_test_name(name):
+    for prefix in VALID_PREFIX:
+        if name.startswith(prefix) and len(prefix) < len(name) and name[len(prefix)].isdigit():
+            return 1
+    return 0
+
+
+def discover(path=None):
+    """
+    Finds the test classes in the modules of path (default: this package)
+    by parsing their source, so nothing of the test or its instrument
+    drivers is imported. Returns a dict of test name to module and docstring.
+    """
+    if path is None:
+        path = os.path.dirname(os.path.abspath(__file__))
+
+    tests = {}
+    for fn in sorted(os.listdir(path)):
+        module, ext = os.path.splitext(fn)
+        if ext != '.py' or not is_test_name(module):
+            continue
+        try:
+            with open(os.path.join(path, fn)) as f:
+                tree = ast.parse(f.read(), fn)
+        except SyntaxError:
+            continue
+        for node in tree.body:
+            if isinstance(node, ast.ClassDef) and is_test_name(node.name):
+                tests[node.name] = {'module': module, 'doc': ast.get_docstring(node, clean=False)}
+    return tests
+
+
+def list_tests():
+    """ Returns (name, docstring) of all tests, sorted by name. """
+    tests = discover()
+    return [(name, tests[name]['doc']) for name in sorted(tests)]
+
+
+def load_test(name):
+    """ Imports the module of test name with its drivers and returns the test class. """
+    tests = discover()
+    if name not in tests:
+        raise AttributeError("Unknown test %s." % name)
+    module = importlib.import_module('%s.%s' % (__name__.rsplit('.', 1)[0], tests[name]['module']))
+    return getattr(module, name)
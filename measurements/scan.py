@@ -0,0 +1,435 @@
+import os
+import time
+import json
+import numpy as np
+from multiprocessing.pool import ThreadPool
+from measurement import replace_file
+
+
+class scan_stop(Exception):
+    """ Raised inside the scan loops to stop the plan early. """
+    pass
+
+
+
+class stage(object):
+    """
+    Readout stage of a scan point.
+
+    read        callable returning the value stored under name in the point
+    settle      1 for the stage the scan waits on after a channel change, its
+                settled window becomes the value (see measurement.settle)
+    atol        absolute settle tolerance, defaults to the measurement's
+    rtol        relative settle tolerance, defaults to the measurement's
+    discard     number of throwaway reads on the first channel after a
+                voltage change
+    always      1 to read the stage also for flagged channels
+    concurrent  1 to read the stage in parallel with the other concurrent
+                stages, only for reads on different instruments
+    only        dict of axis values the stage is read at, e.g. {'mode': 'IV'},
+                by default at every point
+    """
+
+    def __init__(self, name, read, settle=0, atol=None, discard=0, always=0, concurrent=0, only=None, rtol=None):
+        self.name = name
+        self.read = read
+        self.settle = settle
+        self.atol = atol
+        self.rtol = rtol
+        self.discard = discard
+        self.always = always
+        self.concurrent = concurrent
+        self.only = only or {}
+
+
+
+class scan(object):
+    """
+    Generic scan engine for the voltage x channel tests.
+
+    The plan is a list of axes, outermost first. Every axis is a tuple
+    (name, values) or (name, values, setter):
+
+    ('voltage', [v0, v1, ...])      short all channels, ramp, wait for the bias
+    ('channel', [c0, c1, ...])      open the channel unless it is flagged, with
+                                    msr.serpentine every second voltage runs
+                                    the channels backwards
+    ('time', (duration, interval))  repeat the inner axes for duration seconds
+    (name, values, setter)          call setter(value), e.g. an lcr frequency or
+                                    the switchcard measurement type, the
+                                    settle stage settles again after it
+
+    With refine, the voltage axis is adaptive: after every voltage
+    refine(scan, done, pending) gets the voltages measured and still to come
+    and returns the new pending list, e.g. with inserted points or empty to
+    stop early (see depletion.py). The voltages are kept in the checkpoint.
+
+    For every point the stages are read and handler(point) is called with a
+    dict holding the axis values, 'index' (channel position), 'flagged',
+    'settle_time', 'timestamp' (seconds since the scan start) and the stage
+    values. Concurrent stages sit on different instruments and are read by a
+    thread pool, so a point takes the longest of their reads instead of the
+    sum. It returns one row or a list of rows
+    and may set point['flag'] = 1 to skip the channel from then on. Rows are
+    logged with fmt, streamed to the writer (see measurement.open_writer) and
+    collected in out unless keep is 0, which holds memory flat on long runs.
+
+    With a writer, the plan position, flag_list, the elapsed time and the
+    number of rows on disk are saved to checkpoint.json in the run directory
+    whenever the writer flushes its rows, after every voltage and at the end.
+    A measurement created with resume=<run> (main.py --resume) continues
+    after the last saved point: the voltage is ramped up again, the channel
+    loop picks up at the next channel and time axes keep their elapsed time.
+
+    The engine shorts the channels and ramps down on the end of the plan, a
+    compliance trip, a keyboard interrupt or an error, and keeps the rows
+    taken so far. The wall time of every step is summed up in timing.
+
+    Example:
+    -------------
+    plan = [('voltage', self.volt_list), ('channel', self.cell_list)]
+    stages = [stage('cur', volt_meter.read_current_burst, settle=1, concurrent=1),
+              stage('iv', pow_supply.read_iv, always=1, concurrent=1)]
+    out = scan(self, plan, stages, self.handle_point, fmt, pow_supply, switch).run()
+    """
+
+    def __init__(self, msr, plan, stages, handler, fmt=None, source=None, switch=None, bias_atol=1E-9, writer=None, keep=1, refine=None):
+        self.msr = msr
+        self.logging = msr.logging
+        self.plan = list(plan)
+        self.stages = stages
+        self.handler = handler
+        self.fmt = fmt
+        self.source = source
+        self.switch = switch
+        self.bias_atol = bias_atol
+        self.writer = writer
+        self.keep = keep
+        self.serpentine = getattr(msr, 'serpentine', 0)
+
+        ## The refined voltage axis gets its own list, refine() changes it while scanning
+        self.refine = refine
+        self.refine_axis = None
+        if refine is not None:
+            self.refine_axis = [axis[0] for axis in self.plan].index('voltage')
+            axis = self.plan[self.refine_axis]
+            self.plan[self.refine_axis] = (axis[0], [float(v) for v in axis[1]]) + tuple(axis[2:])
+
+        if not hasattr(msr, 'flag_list'):
+            msr.flag_list = np.zeros(sum([len(axis[1]) for axis in plan if axis[0] == 'channel']))
+        self.flag_list = msr.flag_list
+
+        self.out = []
+        self.timing = {}
+        self.points = 0
+        self.aborted = None
+        self.t0 = time.time()
+
+        ## Checkpointing, see save_checkpoint()
+        self.checkpoint = '%s/checkpoint.json' % msr.rdir if writer is not None else None
+        self.state = getattr(msr, 'resume_state', None) if writer is not None else None
+        self.start = {}
+        self.pos = [0] * len(plan)
+        self.t_axis = {}
+        self.last_pos = None
+        self.flushes = 0
+
+        n = len([s for s in stages if s.concurrent])
+        self.pool = ThreadPool(n) if n > 1 else None
+
+    def timed(self, name, fn, *args):
+        t0 = time.time()
+        ret = fn(*args)
+        self.timing[name] = self.timing.get(name, 0.) + time.time() - t0
+        return ret
+
+    def run(self):
+        """ Runs the plan and returns the rows. """
+        self.t0 = time.time()
+        self.msr.record(plan=self.plan_values(), instruments=self.msr.instruments())
+        try:
+            if self.state is None or self.resume():
+                self.loop(0, {})
+                self.save_checkpoint(done=1, force=1)
+        except scan_stop as e:
+            self.aborted = str(e)
+            self.logging.error("%s Stopping scan." % e)
+        except KeyboardInterrupt:
+            self.aborted = 'interrupt'
+            self.logging.error("Keyboard interrupt. Ramping down voltage and shutting down.")
+        except Exception:
+            self.aborted = 'error'
+            self.logging.exception("Scan stopped by an error. Ramping down voltage and shutting down.")
+        if self.aborted is not None:
+            self.msr.status = 'aborted'
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+        self.shutdown()
+        if self.aborted is not None:
+            try:
+                self.save_checkpoint(force=1)
+            except Exception:
+                self.logging.exception("Saving the checkpoint failed.")
+        self.report(time.time() - self.t0)
+        return self.out
+
+    def resume(self):
+        """ Restores the state of an interrupted scan, returns 0 if nothing is left to do. """
+        state = self.state
+        if self.refine_axis is not None and 'voltages' in state:
+            self.plan[self.refine_axis][1][:] = state['voltages']
+        if state.get('test') != self.msr.__class__.__name__ or state.get('plan') != self.plan_shape() \
+            or state.get('serpentine', 0) != self.serpentine:
+            raise scan_stop("Checkpoint of %s doesn't match this scan." % state.get('test'))
+        if self.keep and self.writer.rows:
+            self.out = self.writer.load().tolist()
+        if state.get('done'):
+            self.logging.info("Scan was already completed, nothing to resume.")
+            return 0
+
+        self.flag_list[:] = state['flag_list']
+        self.points = state['points']
+        ## Timestamps continue from the elapsed time of the interrupted run
+        self.t0 = time.time() - state.get('elapsed', 0.)
+        self.start = self.next_position(state['pos'])
+        if self.start is None:
+            return 0
+        self.logging.info("Resuming scan after point %d with %d rows on disk." % (self.points, self.writer.rows))
+        return 1
+
+    def plan_shape(self):
+        return [[axis[0], axis[1][0] if axis[0] == 'time' else len(axis[1])] for axis in self.plan]
+
+    def plan_values(self):
+        """ The axes and their values for the run catalogue. """
+        return [[axis[0], [v if isinstance(v, str) else float(v) for v in axis[1]]] for axis in self.plan]
+
+    def next_position(self, pos):
+        """ Start index of every axis (elapsed time for time axes) for the point after pos. """
+        start = {}
+        carry = 1
+        for k in reversed(range(len(self.plan))):
+            name, values = self.plan[k][0], self.plan[k][1]
+            if name == 'time':
+                if carry and pos[k] >= values[0]:
+                    start[k] = 0.
+                else:
+                    start[k] = pos[k]
+                    carry = 0
+            elif pos[k] + carry < len(values):
+                start[k] = pos[k] + carry
+                carry = 0
+            else:
+                start[k] = 0
+        if carry:
+            return None
+        return start
+
+    def save_checkpoint(self, done=0, force=0):
+        """
+        Saves the position of the last finished point. Without force only if
+        the writer flushed since the last checkpoint, the rows on disk and the
+        position then match after one more flush.
+        """
+        if self.checkpoint is None or self.last_pos is None:
+            return
+        if not force and self.writer.flushes == self.flushes:
+            return
+        self.writer.flush()
+        self.flushes = self.writer.flushes
+        state = {
+            'test': self.msr.__class__.__name__,
+            'date': self.msr.get_date_time(),
+            'plan': self.plan_shape(),
+            'pos': self.last_pos,
+            'elapsed': time.time() - self.t0,
+            'serpentine': self.serpentine,
+            'flag_list': [int(f) for f in self.flag_list],
+            'data': os.path.basename(self.writer.fn),
+            'rows': self.writer.rows,
+            'points': self.points,
+            'done': done,
+        }
+        if self.refine_axis is not None:
+            state['voltages'] = self.plan[self.refine_axis][1]
+        ## Write a temporary file first, the old checkpoint stays valid until the rename
+        tmp = self.checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(tmp, self.checkpoint)
+
+    def shutdown(self):
+        if self.switch is not None:
+            self.switch.short_all()
+        if self.source is not None:
+            self.source.ramp_voltage(0)
+
+
+
+    # Axis functions
+    # ---------------------------------
+
+    def loop(self, k, p):
+        if k == len(self.plan):
+            return self.measure(p)
+
+        axis = self.plan[k]
+        name, values = axis[0], axis[1]
+
+        start = self.start.pop(k, 0)
+
+        if name == 'time':
+            duration, interval = values
+            t0 = time.time() - start
+            self.t_axis[k] = t0
+            while True:
+                p['time'] = time.time() - t0
+                self.loop(k + 1, p)
+                if time.time() - t0 >= duration:
+                    break
+                time.sleep(interval)
+            return
+
+        if k == self.refine_axis:
+            return self.refine_loop(k, p, start)
+
+        for n, j in enumerate(self.axis_order(k)):
+            if n < start:
+                continue
+            self.pos[k] = n
+            val = values[j]
+            p[name] = val
+            if name == 'voltage':
+                self.set_voltage(val, p)
+            elif name == 'channel':
+                self.set_channel(val, j, p)
+            elif len(axis) > 2:
+                self.timed(name, axis[2], val)
+                p['fresh'] = 1
+            self.loop(k + 1, p)
+            if name == 'voltage':
+                self.timed('checkpoint', self.save_checkpoint, 0, 1)
+
+    def refine_loop(self, k, p, start):
+        """ Voltage axis whose remaining points are replaced by refine() after every voltage. """
+        values = self.plan[k][1]
+        n = start
+        while n < len(values):
+            self.pos[k] = n
+            p['voltage'] = values[n]
+            self.set_voltage(values[n], p)
+            self.loop(k + 1, p)
+            n += 1
+            values[n:] = self.timed('refine', self.refine, self, values[:n], values[n:])
+            self.timed('checkpoint', self.save_checkpoint, 0, 1)
+
+    def axis_order(self, k):
+        """ Indices of axis k in scan order, serpentine scans run the channels backwards on every second voltage. """
+        order = range(len(self.plan[k][1]))
+        if self.serpentine and self.plan[k][0] == 'channel':
+            outer = [i for i in range(k) if self.plan[i][0] == 'voltage']
+            if outer and self.pos[outer[-1]] % 2:
+                order.reverse()
+        return order
+
+    def set_voltage(self, v, p):
+        if self.switch is not None:
+            self.timed('switch', self.switch.short_all)
+            time.sleep(self.msr.delay_ch)
+        if self.timed('ramp', self.source.ramp_voltage, v) == -1:
+            raise scan_stop("Current compliance tripped while ramping to %.2f V." % v)
+        win, t_vol = self.timed('bias settle', self.msr.settle, lambda: self.source.read_iv()[1], self.msr.delay_vol, self.bias_atol)
+        self.logging.info("Bias settled after %.2f s" % t_vol)
+        p['first'] = 1
+
+    def set_channel(self, c, j, p):
+        p['index'] = j
+        p['flagged'] = int(self.flag_list[j])
+        p['fresh'] = 1
+        if p['flagged']:
+            return
+        if self.switch is not None:
+            self.timed('switch', self.switch.open_channel, c)
+        if not [s for s in self.stages if s.settle]:
+            self.timed('channel settle', time.sleep, self.msr.delay_ch)
+
+
+
+    # Point functions
+    # ---------------------------------
+
+    def measure(self, p):
+        flagged = p.get('flagged', 0)
+        first = p.get('first') and not flagged
+        fresh = p.get('fresh')
+        active = [s for s in self.stages if (s.always or not flagged) and \
+            all([p.get(key) == val for key, val in s.only.items()])]
+
+        point = dict(p)
+        point['settle_time'] = np.nan
+        point['timestamp'] = time.time() - self.t0
+
+        ## Concurrent stages go to the pool together, the rest one by one
+        par = [s for s in active if s.concurrent]
+        if len(par) > 1:
+            ## A timeout keeps the wait interruptible by Ctrl+C
+            res = self.timed('readout', lambda: self.pool.map_async(lambda s: self.read_stage(s, first, fresh), par).get(1E6))
+            for s, (val, t) in zip(par, res):
+                point[s.name] = val
+                if t is not None:
+                    point['settle_time'] = t
+        else:
+            par = []
+        for s in active:
+            if s in par:
+                continue
+            val, t = self.timed('channel settle' if s.settle and fresh else s.name, self.read_stage, s, first, fresh)
+            point[s.name] = val
+            if t is not None:
+                point['settle_time'] = t
+        if not flagged:
+            p['first'] = 0
+        p['fresh'] = 0
+
+        rows = self.timed('handler', self.handler, point)
+        if point.get('flag') and 'index' in p:
+            self.flag_list[p['index']] = 1
+        if rows is not None:
+            if len(rows) and not np.isscalar(rows[0]):
+                for row in rows:
+                    self.emit(row)
+            else:
+                self.emit(rows)
+            self.points += 1
+        self.last_pos = [time.time() - self.t_axis[k] if k in self.t_axis else self.pos[k] for k in range(len(self.plan))]
+        self.timed('checkpoint', self.save_checkpoint)
+
+    def read_stage(self, s, first, fresh):
+        """ Reads one stage, returns the value and the settle time or None. """
+        ## Throw away the first readings after a voltage change
+        if first:
+            for k in range(s.discard):
+                s.read()
+        if s.settle and fresh:
+            atol = s.atol if s.atol is not None else self.msr.settle_atol
+            return self.msr.settle(s.read, self.msr.delay_ch, atol, s.rtol)
+        return s.read(), None
+
+    def emit(self, row):
+        if self.keep:
+            self.out.append(row)
+        if self.writer is not None:
+            self.writer.write(row)
+        if self.fmt is not None:
+            self.logging.info(self.fmt.format(*row))
+
+    def report(self, total):
+        self.logging.info("\t")
+        self.logging.info("Scan timing: %d points in %.1f s (%.3f s per point)" % (self.points, total, total / max(self.points, 1)))
+        for name in sorted(self.timing, key=self.timing.get, reverse=True):
+            self.logging.info("    %-20s %8.1f s  %5.1f %%" % (name, self.timing[name], 100. * self.timing[name] / max(total, 1E-9)))
+        if self.switch is not None:
+            self.logging.info("Switchcard commands skipped by state cache: %d" % self.switch.skipped)
@@ -25,6 +25,7 @@ from measurement import measurement
 from devices import ke2410 # power supply
 from devices import ke6487 # volt meter
 from devices import switchcard # switch
+from scan import scan, stage
 
 
 
@@ -50,8 +51,10 @@ class test02_scan_iv(measurement):
         self.cell_list = np.loadtxt('config/channels128_from_schematics_sorted.txt', dtype=int)
         self.volt_list = [-10]
 
-        self.delay_vol = 5              # delay between setting voltage and executing measurement in [s]
-        self.delay_ch = 0.3             # delay between setting channel and executing measurement in [s]
+        self.delay_vol = 5              # max. delay between setting voltage and executing measurement in [s]
+        self.delay_ch = 0.3             # max. delay between setting channel and executing measurement in [s]
+        self.settle_tol = 0.01          # relative tolerance for the current to count as settled
+        self.settle_atol = 1E-11        # absolute tolerance for the current to count as settled in [A]
 
         self.flag_list = np.zeros(len(self.cell_list))  # list of cells to skip
 
@@ -69,12 +72,14 @@ class test02_scan_iv(measurement):
         pow_supply.set_terminal('rear')
         pow_supply.set_interlock_on()
         pow_supply.set_output_on()
+        pow_supply.set_ramp(self.ramp_rate, self.ramp_step, self.ramp_mode)
 
         ## Set up volt meter
         volt_meter = ke6487(self.volt_meter_address)
         volt_meter.reset()
         volt_meter.setup_ammeter()
         volt_meter.set_nplc(2)
+        volt_meter.setup_burst(5)
 
         # Set up switch
         switch = switchcard(self.switch_address)
@@ -100,6 +105,8 @@ class test02_scan_iv(measurement):
             'Power supply current limit:      %8.2E A' % lim_cur,
             'Voltage delay:                   %8.2f s' % self.delay_vol,
             'Channel delay:                   %8.2f s' % self.delay_ch,
+            'Settle criterion:                %8s' % self.settle_mode,
+            'Settle tolerance:                %8.2E' % self.settle_tol,
             'Probecard temperature:           %8.1f C' % temp_pc,
             'Switchcard temperature:          %8.1f C' % temp_sc,
             # 'Probecard humidity:              %s %' % humd_pc,
@@ -107,7 +114,7 @@ class test02_scan_iv(measurement):
             'Switchcard measurement setting:  %s' % type_msr,
             'Switchcard display setting:      %s' % type_disp,
             '\n\n',
-            'Nominal Voltage [V]\t Measured Voltage [V]\tChannel [-]\tCurrent [A]\tCurrent Error [A]\tTotal Current[A]\t'
+            'Nominal Voltage [V]\t Measured Voltage [V]\tChannel [-]\tCurrent [A]\tCurrent Error [A]\tTotal Current[A]\tSettle Time [s]\tTime [s]\t'
         ]
 
         ## Print Info
@@ -118,71 +125,18 @@ class test02_scan_iv(measurement):
         self.logging.info(hd[-1])
         self.logging.info("-" * int(1.2 * len(hd[-1])))
 
-        ## Prepare
-        out = []
-
-        ## Loop over voltages
-        try:
-            for v in self.volt_list:
-                switch.short_all()
-                time.sleep(self.delay_ch)
-                pow_supply.ramp_voltage(v)
-                time.sleep(self.delay_vol)
-
-                j = 0
-                for c in self.cell_list:
-
-                    ## Only measure unflagged cells
-                    if self.flag_list[j] == 0:
-
-                        ## Through away first measurements after voltage change
-                        if j == 0:
-                            switch.open_channel(c)
-                            for k in range(3):
-                                volt_meter.read_current()
-                                pow_supply.read_current()
-                                time.sleep(0.001)
-
-                        ## Go on with normal measurement
-                        switch.open_channel(c)
-                        time.sleep(self.delay_ch)
-
-                        cur_tot = pow_supply.read_current()
-                        vol = pow_supply.read_voltage()
-
-                        measurements = np.array([volt_meter.read_current() for _ in range(5)])
-                        means = np.mean(measurements, axis=0)
-                        errs = np.std(measurements, axis=0)
-
-                        i = means
-                        di = errs
-
-                        ## Flag cell if current too large
-                        if i > 1E-6:
-                            self.flag_list[j] = 1
-
-                    ## Handle flagged cells
-                    else:
-                        cur_tot = pow_supply.read_current()
-                        vol = pow_supply.read_voltage()
-
-                        i = np.nan
-                        di = np.nan
-
-                    j += 1
-                    line = [v, vol, j, i, di, cur_tot]
-                    out.append(line)
-                    time.sleep(0.001)
-                    self.logging.info("{:<5.2E}\t{: <5.2E}\t{: <5d}\t{: <8.3E}\t{: <8.3E}\t{: <5.2E}".format(*line))
-
-        except KeyboardInterrupt:
-            switch.short_all()
-            pow_supply.ramp_voltage(0)
-            self.logging.error("Keyboard interrupt. Ramping down voltage and shutting down.")
+        ## Scan over voltages and channels
+        plan = [('voltage', self.volt_list), ('channel', self.cell_list)]
+        stages = [
+            stage('cur', volt_meter.read_current_burst, settle=1, discard=1, concurrent=1),
+            stage('iv', pow_supply.read_iv, discard=3, always=1, concurrent=1),
+        ]
+        fmt = "{:<5.2E}\t{: <5.2E}\t{: <5d}\t{: <8.3E}\t{: <8.3E}\t{: <5.2E}\t{: <5.2f}\t{: <8.1f}"
+        writer = self.open_writer("iv.dat", fmt="%.5E", header="\n".join(hd))
+        out = scan(self, plan, stages, self.handle_point, fmt, pow_supply, switch, writer=writer).run()
+        writer.close()
 
         ## Close connections
-        switch.reset()
-        pow_supply.ramp_voltage(0)
         time.sleep(15)
         pow_supply.set_interlock_off()
         pow_supply.set_output_off()
@@ -191,46 +145,62 @@ class test02_scan_iv(measurement):
 
         ## Save and print
         self.logging.info("\n")
-        self.save_list(out, "iv.dat", fmt="%.5E", header="\n".join(hd))
-        self.print_graph(np.array(out)[:, 2], np.array(out)[:, 5], np.array(out)[:, 5]*0.001, \
-            'Channel Nr. [-]', 'Total Current [A]', 'All Channels ' + self.id, fn="iv_all_channels_%s.png" % self.id)
-        self.print_graph(np.array(out)[:, 2], np.array(out)[:, 3], np.array(out)[:, 4], \
-            'Channel Nr. [-]', 'Leakage Current [A]',  'IV All Channels ' + self.id, fn="iv_all_channels_%s.png" % self.id)
-        if 1:
+        ## Nothing to plot if the scan stopped before the first point
+        if len(out):
+            self.print_graph(np.array(out)[:, 2], np.array(out)[:, 5], np.array(out)[:, 5]*0.001, \
+                'Channel Nr. [-]', 'Total Current [A]', 'All Channels ' + self.id, fn="iv_all_channels_%s.png" % self.id)
+            self.print_graph(np.array(out)[:, 2], np.array(out)[:, 3], np.array(out)[:, 4], \
+                'Channel Nr. [-]', 'Leakage Current [A]',  'IV All Channels ' + self.id, fn="iv_all_channels_%s.png" % self.id)
             ch = 34
-            self.print_graph(np.array([val for val in out if (val[2] == ch)])[:, 1], \
-                np.array([val for val in out if (val[2] == ch)])[:, 3], \
-                np.array([val for val in out if (val[2] == ch)])[:, 4], \
-                'Bias Voltage [V]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_channel_%d_%s.png" % (ch, self.id))
-        if (10 in np.array(out)[:, 0]):
-            self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
-                np.array([val for val in out if (val[0] == 10)])[:, 3], \
-                np.array([val for val in out if (val[0] == 10)])[:, 4], \
-                'Channel Nr. [-]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_all_channels_10V_%s.png" % self.id)
-            self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
-                np.array([val for val in out if (val[0] == 10)])[:, 5], \
-                np.array([val for val in out if (val[0] == 10)])[:, 6], \
-                'Channel Nr. [-]', 'Total Current [A]', 'IV ' + self.id, fn="iv_total_current_all_channels_10V_%s.png" % self.id)
-        if (100 in np.array(out)[:, 0]):
-            self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-                np.array([val for val in out if (val[0] == 100)])[:, 3], \
-                np.array([val for val in out if (val[0] == 100)])[:, 4], \
-                'Channel Nr. [-]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_all_channels_100V_%s.png" % self.id)
-            self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-                np.array([val for val in out if (val[0] == 100)])[:, 5], \
-                np.array([val for val in out if (val[0] == 100)])[:, 6], \
-                'Channel Nr. [-]', 'Total Current [A]', 'IV ' + self.id, fn="iv_total_current_all_channels_100V_%s.png" % self.id)
-        if (1000 in np.array(out)[:, 0]):
-            self.print_graph(np.array([val for val in out if (val[0] == 1000)])[:, 2], \
-                np.array([val for val in out if (val[0] == 1000)])[:, 3], \
-                np.array([val for val in out if (val[0] == 1000)])[:, 4], \
-                'Channel Nr. [-]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_all_channels_1000V_%s.png" % self.id)
-            self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-                np.array([val for val in out if (val[0] == 1000)])[:, 5], \
-                np.array([val for val in out if (val[0] == 1000)])[:, 6], \
-                'Channel Nr. [-]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_total_current_all_channels_1000V_%s.png" % self.id)
+            if (ch in np.array(out)[:, 2]):
+                self.print_graph(np.array([val for val in out if (val[2] == ch)])[:, 1], \
+                    np.array([val for val in out if (val[2] == ch)])[:, 3], \
+                    np.array([val for val in out if (val[2] == ch)])[:, 4], \
+                    'Bias Voltage [V]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_channel_%d_%s.png" % (ch, self.id))
+            if (10 in np.array(out)[:, 0]):
+                self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 3], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 4], \
+                    'Channel Nr. [-]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_all_channels_10V_%s.png" % self.id)
+                self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 5], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 6], \
+                    'Channel Nr. [-]', 'Total Current [A]', 'IV ' + self.id, fn="iv_total_current_all_channels_10V_%s.png" % self.id)
+            if (100 in np.array(out)[:, 0]):
+                self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 3], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 4], \
+                    'Channel Nr. [-]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_all_channels_100V_%s.png" % self.id)
+                self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 5], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 6], \
+                    'Channel Nr. [-]', 'Total Current [A]', 'IV ' + self.id, fn="iv_total_current_all_channels_100V_%s.png" % self.id)
+            if (1000 in np.array(out)[:, 0]):
+                self.print_graph(np.array([val for val in out if (val[0] == 1000)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 1000)])[:, 3], \
+                    np.array([val for val in out if (val[0] == 1000)])[:, 4], \
+                    'Channel Nr. [-]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_all_channels_1000V_%s.png" % self.id)
+                self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 1000)])[:, 5], \
+                    np.array([val for val in out if (val[0] == 1000)])[:, 6], \
+                    'Channel Nr. [-]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_total_current_all_channels_1000V_%s.png" % self.id)
         self.logging.info("\n")
 
 
+    def handle_point(self, p):
+        vol, cur_tot = p['iv']
+        if p['flagged']:
+            i = np.nan
+            di = np.nan
+        else:
+            i = np.mean(p['cur'])
+            di = np.std(p['cur'])
+
+            ## Flag cell if current too large
+            if i > 1E-6:
+                p['flag'] = 1
+
+        return [p['voltage'], vol, p['index'] + 1, i, di, cur_tot, p['settle_time'], p['timestamp']]
+
     def finalise(self):
         self._finalise()
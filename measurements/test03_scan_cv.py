@@ -27,7 +27,10 @@ from measurement import measurement
 from devices import ke2410 # power supply
 from devices import hp4980 # lcr meter
 from devices import switchcard # switch
+from scan import scan, stage
+from depletion import depletion_refiner
 from utils import lcr_series_equ, lcr_parallel_equ, lcr_error_cp
+from utils import correction_table
 
 
 
@@ -53,16 +56,19 @@ class test03_scan_cv(measurement):
         self.cell_list = np.loadtxt('config/channels128_from_schematics_sorted.txt', dtype=int)
         self.volt_list = np.loadtxt('config/voltagesTest.txt', dtype=int)
 
-        self.delay_vol = 30              # delay between setting voltage and executing measurement in [s]
-        self.delay_ch = 0.3              # delay between setting channel and executing measurement in [s]
+        self.delay_vol = 30              # max. delay between setting voltage and executing measurement in [s]
+        self.delay_ch = 0.3              # max. delay between setting channel and executing measurement in [s]
+        self.settle_tol = 0.002          # relative tolerance for r and x to count as settled
 
         self.lcr_vol = 0.501             # ac voltage amplitude in [mV]
         self.lcr_freq = 5000             # ac voltage frequency in [Hz]
         self.cv_res = 1e6                # cv parallel resistor in [Ohm]
 
-        #self.cor_open = np.loadtxt('config/valuesOpen.txt') # open correction for lcr meter
-        #self.cor_short = np.loadtxt('config/valuesShort.txt') # short correction for lcr meter
-        #self.cor_load = np.loadtxt('config/valuesLoad.txt') # load correction for lcr meter
+        self.cor_open_short = 0          # 1 to correct r and x with the open/short tables in config/
+
+        self.adaptive = 0                # 1 takes volt_list as coarse grid and adds voltages around the depletion kink
+        self.vdep_tol = 5.               # depletion voltage uncertainty to stop the adaptive scan at in [V]
+        self.max_points = 40             # max. number of voltages of the adaptive scan
 
         self.flag_list = np.zeros(len(self.cell_list))
 
@@ -70,6 +76,13 @@ class test03_scan_cv(measurement):
 
     def execute(self):
 
+        ## Open/short tables, interpolated to the measurement frequencies
+        self.cor = correction_table('config') if self.cor_open_short else None
+        if self.cor is not None:
+            missing = [f for f in [self.lcr_freq] if not self.cor.covers(f)]
+            if missing:
+                raise ValueError("No open/short tables in config/ around %s Hz." % ', '.join(['%.0f' % f for f in missing]))
+
         ## Set up power supply
         pow_supply = ke2410(self.pow_supply_address)
         pow_supply.reset()
@@ -80,6 +93,7 @@ class test03_scan_cv(measurement):
         pow_supply.set_terminal('rear')
         pow_supply.set_interlock_on()
         pow_supply.set_output_on()
+        pow_supply.set_ramp(self.ramp_rate, self.ramp_step, self.ramp_mode)
 
         ## Set up lcr meter
         lcr_meter = hp4980(self.lcr_meter_address)
@@ -87,12 +101,13 @@ class test03_scan_cv(measurement):
         lcr_meter.set_voltage(self.lcr_vol)
         lcr_meter.set_frequency(self.lcr_freq)
         lcr_meter.set_mode('RX')
+        lcr_meter.set_binary_format(1)
 
         # Set up switch
         switch = switchcard(self.switch_address)
         switch.reboot()
         switch.set_measurement_type('CV')
-		switch.set_cv_resistance(self.cv_res)
+        switch.set_cv_resistance(self.cv_res)
         switch.set_display_mode('OFF')
 
         ## Check settings
@@ -118,14 +133,18 @@ class test03_scan_cv(measurement):
             'CV resistance:                   %8.2E Ohm' % self.cv_res,
             'Voltage delay:                   %8.2f s' % self.delay_vol,
             'Channel delay:                   %8.2f s' % self.delay_ch,
+            'Settle criterion:                %8s' % self.settle_mode,
+            'Settle tolerance:                %8.2E' % self.settle_tol,
             'Probecard temperature:           %8.1f C' % temp_pc,
             'Switchcard temperature:          %8.1f C' % temp_sc,
             # 'Probecard humidity:              %8.1f %' % humd_pc,
             # 'Switchcard humidity:             %8.1f %' % humd_sc,
             'Switchcard measurement setting:  %s' % type_msr,
             'Switchcard display setting:      %s' % type_disp,
+            'Open/short corrected:            %8d' % self.cor_open_short,
+            'Adaptive voltages:               %8d' % self.adaptive,
             '\n\n',
-            'Nominal Voltage [V]\t Measured Voltage [V]\tChannel [-]\tR [Ohm]\tR_Err [Ohm]\tX [Ohm]\tX_Err [Ohm]\tC [F]\tTotal Current [A]\n'
+            'Nominal Voltage [V]\t Measured Voltage [V]\tChannel [-]\tR [Ohm]\tR_Err [Ohm]\tX [Ohm]\tX_Err [Ohm]\tC [F]\tTotal Current [A]\tSettle Time [s]\n'
         ]
 
         ## Print Info
@@ -136,76 +155,22 @@ class test03_scan_cv(measurement):
         self.logging.info(hd[-1])
         self.logging.info("-" * int(1.2 * len(hd[-1])))
 
-        ## Prepare
-        out = []
-
-        ## Loop over voltages
-        try:
-            for v in self.volt_list:
-                switch.short_all()
-                time.sleep(self.delay_ch)
-                pow_supply.ramp_voltage(v)
-                time.sleep(self.delay_vol)
-
-                j = 0
-                for c in self.cell_list:
-
-                    ## Only measure unflagged cells
-                    if self.flag_list[j] == 0:
-
-                        ## Through away first measurements after voltage change
-                        if j == 0:
-                            switch.open_channel(c)
-                            for k in range(3):
-                                lcr_meter.execute_measurement()
-                                pow_supply.read_current()
-                                time.sleep(0.001)
-
-                        ## Go on with normal measurement
-                        switch.open_channel(c)
-                        time.sleep(self.delay_ch)
-
-                        cur_tot = pow_supply.read_current()
-                        vol = pow_supply.read_voltage()
-
-                        measurements = np.array([lcr_meter.execute_measurement() for _ in range(5)])
-                        means = np.mean(measurements, axis=0)
-                        errs = np.std(measurements, axis=0)
-
-                        r, x = means
-                        dr, dx = errs
-
-                        z = np.sqrt(r**2 + x**2)
-                        phi = np.arctan(x/r)
-                        r_s, c_s, l_s, D = lcr_series_equ(self.lcr_freq, z, phi)
-                        r_p, c_p, l_p, D = lcr_parallel_equ(self.lcr_freq, z, phi)
-
-                    ## Handle flagged cells
-                    else:
-                        cur_tot = pow_supply.read_current()
-                        vol = pow_supply.read_voltage()
-
-                        r = np.nan
-                        dr = np.nan
-                        x = np.nan
-                        dx = np.nan
-                        c_s = np.nan
-                        c_p = np.nan
-
-                    j += 1
-                    line = [v, vol, j, r, dr, x, dx, c_s, c_p, cur_tot]
-                    out.append(line)
-                    self.logging.info("{:<5.2E}\t{: <5.2E}\t{: <5d}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <8.3E}\t{: <8.3E}\t{: <5.2E}".format(*line))
-
-        except KeyboardInterrupt:
-            switch.short_all()
-            pow_supply.ramp_voltage(0)
-            self.logging.error("Keyboard interrupt. Ramping down voltage and shutting down.")
-
+        ## Scan over voltages and channels
+        plan = [('voltage', self.volt_list), ('channel', self.cell_list)]
+        stages = [
+            stage('rx', lambda: lcr_meter.execute_measurements(5), settle=1, discard=3, concurrent=1),
+            stage('iv', pow_supply.read_iv, discard=3, always=1, concurrent=1),
+        ]
+        fmt = "{:<5.2E}\t{: <5.2E}\t{: <5d}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <8.3E}\t{: <8.3E}\t{: <5.2E}\t{: <5.2f}"
+        writer = self.open_writer("cv.dat", fmt="%.5E", header="\n".join(hd))
+        refine = depletion_refiner(self.depletion_data, self.vdep_tol, max_points=self.max_points) if self.adaptive else None
+        out = scan(self, plan, stages, self.handle_point, fmt, pow_supply, switch, writer=writer, refine=refine).run()
+        writer.close()
+        if refine is not None and refine.vdep:
+            self.save_list([[ch, v, dv] for ch, (v, dv) in sorted(refine.vdep.items())], "vdep.dat", fmt="%.5E", \
+                header="Channel [-]\tDepletion Voltage [V]\tDepletion Voltage Error [V]")
 
         ## Close connections
-        switch.reset()
-        pow_supply.ramp_voltage(0)
         time.sleep(15)
         pow_supply.set_interlock_off()
         pow_supply.set_output_off()
@@ -213,43 +178,67 @@ class test03_scan_cv(measurement):
 
         ## Save and print
         self.logging.info("\n")
-        self.save_list(out, "cv.dat", fmt="%.5E", header="\n".join(hd))
-        self.print_graph(np.array(out)[:, 2], np.array(out)[:, 8], np.array(out)[:, 8]*0.01, \
-            'Channel Nr. [-]', 'Total Current [A]', 'All Channels ' + self.id, fn="cv_total_current_all_channels_%s.png" % self.id)
-        self.print_graph(np.array(out)[:, 2], np.array(out)[:, 6], np.array(out)[:, 6]*0.01, \
-            'Channel Nr. [-]', 'Capacitance [F]',  'CV All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
-        if 1:
+        ## Nothing to plot if the scan stopped before the first point
+        if len(out):
+            self.print_graph(np.array(out)[:, 2], np.array(out)[:, 8], np.array(out)[:, 8]*0.01, \
+                'Channel Nr. [-]', 'Total Current [A]', 'All Channels ' + self.id, fn="cv_total_current_all_channels_%s.png" % self.id)
+            self.print_graph(np.array(out)[:, 2], np.array(out)[:, 6], np.array(out)[:, 6]*0.01, \
+                'Channel Nr. [-]', 'Capacitance [F]',  'CV All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
             ch = 1
-            self.print_graph(np.array([val for val in out if (val[2] == ch)])[:, 1], \
-                np.array([val for val in out if (val[2] == ch)])[:, 5], \
-                np.array([val for val in out if (val[2] == ch)])[:, 6], \
-                'Bias Voltage [V]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_channel_%d_%s.png" % (ch, self.id))
-            self.print_graph(np.array([val for val in out if (val[2] == ch)])[2:, 1], \
-                np.array([val for val in out if (val[2] == ch)])[2:, 7]**(-2), \
-                np.array([val for val in out if (val[2] == ch)])[2:, 7] * 0.01 * 2 * (np.array([val for val in out if (val[2] == ch)])[2:, 7]*0.01)**(-3), \
-                'Bias Voltage [V]', '1/C^2 [1/F^2]', '1/C2 ' + self.id, fn="1c2v_channel%d_%s.png" % (ch, self.id))
-        if (10 in np.array(out)[:, 0]):
-            self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
-                np.array([val for val in out if (val[0] == 10)])[:, 5], \
-                np.array([val for val in out if (val[0] == 10)])[:, 6], \
-                'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_10V_%s.png" % self.id)
-            self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
-                np.array([val for val in out if (val[0] == 10)])[:, 8], \
-                np.array([val for val in out if (val[0] == 10)])[:, 8]*0.01, \
-                'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_10V_%s.png" % self.id)
-        if (100 in np.array(out)[:, 0]):
-            self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-                np.array([val for val in out if (val[0] == 100)])[:, 5], \
-                np.array([val for val in out if (val[0] == 100)])[:, 6], \
-                'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_100V_%s.png" % self.id)
-            self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-                np.array([val for val in out if (val[0] == 100)])[:, 8], \
-                np.array([val for val in out if (val[0] == 100)])[:, 8]*0.01, \
-                'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_100V_%s.png" % self.id)
+            if (ch in np.array(out)[:, 2]):
+                self.print_graph(np.array([val for val in out if (val[2] == ch)])[:, 1], \
+                    np.array([val for val in out if (val[2] == ch)])[:, 5], \
+                    np.array([val for val in out if (val[2] == ch)])[:, 6], \
+                    'Bias Voltage [V]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_channel_%d_%s.png" % (ch, self.id))
+                self.print_graph(np.array([val for val in out if (val[2] == ch)])[2:, 1], \
+                    np.array([val for val in out if (val[2] == ch)])[2:, 7]**(-2), \
+                    np.array([val for val in out if (val[2] == ch)])[2:, 7] * 0.01 * 2 * (np.array([val for val in out if (val[2] == ch)])[2:, 7]*0.01)**(-3), \
+                    'Bias Voltage [V]', '1/C^2 [1/F^2]', '1/C2 ' + self.id, fn="1c2v_channel%d_%s.png" % (ch, self.id))
+            if (10 in np.array(out)[:, 0]):
+                self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 5], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 6], \
+                    'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_10V_%s.png" % self.id)
+                self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 8], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 8]*0.01, \
+                    'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_10V_%s.png" % self.id)
+            if (100 in np.array(out)[:, 0]):
+                self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 5], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 6], \
+                    'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_100V_%s.png" % self.id)
+                self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 8], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 8]*0.01, \
+                    'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_100V_%s.png" % self.id)
         self.logging.info("\n")
 
         if 0:
             self.save_list(range(0,512,1), "channel_list.txt", fmt='%d', header='')
 
+    def handle_point(self, p):
+        vol, cur_tot = p['iv']
+        if p['flagged']:
+            r = dr = x = dx = c_s = c_p = np.nan
+        else:
+            r, x = np.mean(p['rx'], axis=0)
+            dr, dx = np.std(p['rx'], axis=0)
+            if self.cor is not None:
+                z_cor = self.cor.correct(self.lcr_freq, p['voltage'], p['index'] + 1, r + 1j * x)
+                r, x = z_cor.real, z_cor.imag
+
+            z = np.sqrt(r**2 + x**2)
+            phi = np.arctan(x/r)
+            r_s, c_s, l_s, D = lcr_series_equ(self.lcr_freq, z, phi)
+            r_p, c_p, l_p, D = lcr_parallel_equ(self.lcr_freq, z, phi)
+
+        return [p['voltage'], vol, p['index'] + 1, r, dr, x, dx, c_s, c_p, cur_tot, p['settle_time']]
+
+    def depletion_data(self, rows):
+        """ Voltage, channel, series capacitance and its error from the spread of x, for depletion.py. """
+        out = np.array(rows, dtype=float).reshape(-1, 11)
+        return out[:, 0], out[:, 2], out[:, 7], np.abs(out[:, 7] * out[:, 6] / out[:, 5])
+
     def finalise(self):
         self._finalise()
@@ -20,7 +20,9 @@ from measurement import measurement
 from devices import ke2410 # power supply
 from devices import hp4980 # lcr meter
 from devices import switchcard # switch
+from scan import scan, stage
 from utils import lcr_series_equ, lcr_parallel_equ, lcr_error_cp
+from utils import correction_table
 
 
 
@@ -51,17 +53,23 @@ class test03_scan_cv_frequencyscan(measurement):
 
         self.lcr_vol = 0.501             # ac voltage amplitude in [mV]
         self.lcr_freq = 5000             # ac voltage frequency in [Hz]
+        self.lcr_freq_list = [5E2, 1E3, 2E3, 3E3, 5E3, 1E4, 2E4, 5E4, 1E5, 1E6] # list sweep frequencies in [Hz]
         self.cv_res = 1e6                # cv parallel resistor in [Ohm]
 
-        #self.cor_open = np.loadtxt('config/valuesOpen.txt') # open correction for lcr meter
-        #self.cor_short = np.loadtxt('config/valuesShort.txt') # short correction for lcr meter
-        #self.cor_load = np.loadtxt('config/valuesLoad.txt') # load correction for lcr meter
+        self.cor_open_short = 0          # 1 to correct r and x with the open/short tables in config/
 
         self.flag_list = np.zeros(len(self.cell_list))
 
 
     def execute(self):
 
+        ## Open/short tables, interpolated to the measurement frequencies
+        self.cor = correction_table('config') if self.cor_open_short else None
+        if self.cor is not None:
+            missing = [f for f in self.lcr_freq_list if not self.cor.covers(f)]
+            if missing:
+                raise ValueError("No open/short tables in config/ around %s Hz." % ', '.join(['%.0f' % f for f in missing]))
+
         ## Set up power supply
         pow_supply = ke2410(self.pow_supply_address)
         pow_supply.reset()
@@ -73,6 +81,7 @@ class test03_scan_cv_frequencyscan(measurement):
         pow_supply.set_terminal('rear')
         pow_supply.set_interlock_on()
         pow_supply.set_output_on()
+        pow_supply.set_ramp(self.ramp_rate, self.ramp_step, self.ramp_mode)
 
         ## Set up lcr meter
         lcr_meter = hp4980(self.lcr_meter_address)
@@ -80,6 +89,7 @@ class test03_scan_cv_frequencyscan(measurement):
         lcr_meter.set_voltage(self.lcr_vol)
         lcr_meter.set_frequency(self.lcr_freq)
         lcr_meter.set_mode('RX')
+        lcr_meter.set_binary_format(1)
 
         # Set up switch
         switch = switchcard(self.switch_address)
@@ -100,6 +110,9 @@ class test03_scan_cv_frequencyscan(measurement):
         type_msr = switch.get_measurement_type()
         type_disp = switch.get_display_mode()
 
+        ## Sweep all frequencies with one trigger per reading
+        lcr_meter.setup_list_sweep(self.lcr_freq_list)
+
 
         ## Header
         hd = [
@@ -109,13 +122,14 @@ class test03_scan_cv_frequencyscan(measurement):
             'Power supply current limit:      %8.2E A' % lim_cur,
             'LCR measurement voltage:         %8.2E V' % lcr_vol,
             'LCR measurement frequency:       %8.2E Hz' % lcr_freq,
-			'CV resistance:                   %8.2E Ohm' % self.cv_res,
+            'CV resistance:                   %8.2E Ohm' % self.cv_res,
             'Voltage delay:                   %8.2f s' % self.delay_vol,
             'Channel delay:                   %8.2f s' % self.delay_ch,
             'Probecard temperature:           %8.1f C' % temp_pc,
             'Switchcard temperature:          %8.1f C' % temp_sc,
             'Switchcard measurement setting:  %s' % type_msr,
             'Switchcard display setting:      %s' % type_disp,
+            'Open/short corrected:            %8d' % self.cor_open_short,
             '\n\n',
             'Nominal Voltage [V]\t Measured Voltage [V]\tFrequency[Hz]\tChannel [-]\tR [Ohm]\tR_Err [Ohm]\tX [Ohm]\tX_Err [Ohm]\tC [F]\tTotal Current [A]\n'
         ]
@@ -129,62 +143,19 @@ class test03_scan_cv_frequencyscan(measurement):
         self.logging.info("-" * int(1.2 * len(hd[-1])))
 
 
-        # Prepare
-        out = []
-
-        ## Loop over voltages
-        try:
-            for v in self.volt_list:
-                switch.short_all()
-                time.sleep(self.delay_ch)
-                pow_supply.ramp_voltage(v)
-                time.sleep(self.delay_vol)
-
-                j = 0
-                for c in self.cell_list:
-
-                    ## Only measure unflagged cells
-                    if self.flag_list[j] == 0:
-                        switch.open_channel(c)
-                        time.sleep(self.delay_ch)
-
-                        ## Loop over freqs
-                        for freq_nom in [5E2, 1E3, 2E3, 3E3, 5E3, 1E4, 2E4, 5E4, 1E5, 1E6]:
-                            lcr_meter.set_frequency(freq_nom)
-                            time.sleep(1)
-                            freq = float(lcr_meter.check_frequency())
-
-                            cur_tot = pow_supply.read_current()
-                            vol = pow_supply.read_voltage()
-
-                            measurements = np.array([lcr_meter.execute_measurement() for _ in range(5)])
-                            means = np.mean(measurements, axis = 0)
-                            errs = np.std(measurements, axis = 0)
-
-                            R, X = means
-                            dR, dX = errs
-
-                            time.sleep(0.001)
-
-                            z = np.sqrt(R**2 + X**2)
-                            phi = np.arctan(X/R)
-                            r_s, c_s, l_s, D = lcr_series_equ(freq, z, phi)
-                            r_p, c_p, l_p, D = lcr_parallel_equ(freq, z, phi)
-
-                            j += 1
-                            line = [v, vol, freq, j, R, dR, X, dX, c_s, c_p, cur_tot]
-                            out.append(line)
-                            self.logging.info("{:<5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <5d}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <8.3E}\t{: <8.3E}\t{:    <5.2E}".format(*line))
-
-        except KeyboardInterrupt:
-            switch.short_all()
-            pow_supply.ramp_voltage(0)
-            self.logging.error("Keyboard interrupt. Ramping down voltage and shutting down.")
-
+        ## Scan over voltages and channels, the list sweep covers the frequencies
+        plan = [('voltage', self.volt_list), ('channel', self.cell_list)]
+        stages = [
+            stage('iv', pow_supply.read_iv, always=1, concurrent=1),
+            stage('sweeps', lambda: np.array([lcr_meter.execute_list_sweep() for _ in range(5)]), concurrent=1),
+        ]
+        fmt = "{:<5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <5d}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <8.3E}\t{: <8.3E}\t{: <5.2E}"
+        writer = self.open_writer("cv.dat", fmt="%.5E", header="\n".join(hd))
+        out = scan(self, plan, stages, self.handle_point, fmt, pow_supply, switch, writer=writer).run()
+        writer.close()
 
         ## Close connections
-        switch.reset()
-        pow_supply.ramp_voltage(0)
+        lcr_meter.stop_list_sweep()
         time.sleep(15)
         pow_supply.set_interlock_off()
         pow_supply.set_output_off()
@@ -192,43 +163,69 @@ class test03_scan_cv_frequencyscan(measurement):
 
         ## Save and print
         self.logging.info("\n")
-        self.save_list(out, "cv.dat", fmt="%.5E", header="\n".join(hd))
-        self.print_graph(np.array(out)[:, 2], np.array(out)[:, 8], np.array(out)[:, 8]*0.01, \
-            'Channel Nr. [-]', 'Total Current [A]', 'All Channels ' + self.id, fn="cv_total_current_all_channels_%s.png" % self.id)
-        self.print_graph(np.array(out)[:, 2], np.array(out)[:, 6], np.array(out)[:, 6]*0.01, \
-            'Channel Nr. [-]', 'Capacitance [F]',  'CV All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
-        if 0:
-            ch = 1
-            self.print_graph(np.array([val for val in out if (val[2] == ch)])[:, 1], \
-                np.array([val for val in out if (val[2] == ch)])[:, 5], \
-                np.array([val for val in out if (val[2] == ch)])[:, 6], \
-                'Bias Voltage [V]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_channel_%d_%s.png" % (ch, self.id))
-            self.print_graph(np.array([val for val in out if (val[2] == ch)])[2:, 1], \
-                np.array([val for val in out if (val[2] == ch)])[2:, 7]**(-2), \
-                np.array([val for val in out if (val[2] == ch)])[2:, 7] * 0.01 * 2 * (np.array([val for val in out if (val[2] == ch)])[2:, 7]*0.01)**(-3), \
-                'Bias Voltage [V]', '1/C^2 [1/F^2]', '1/C2 ' + self.id, fn="1c2v_channel%d_%s.png" % (ch, self.id))
-        if (10 in np.array(out)[:, 0]):
-            self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
-                np.array([val for val in out if (val[0] == 10)])[:, 5], \
-                np.array([val for val in out if (val[0] == 10)])[:, 6], \
-                'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_10V_%s.png" % self.id)
-            self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
-                np.array([val for val in out if (val[0] == 10)])[:, 8], \
-                np.array([val for val in out if (val[0] == 10)])[:, 8]*0.01, \
-                'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_10V_%s.png" % self.id)
-        if (100 in np.array(out)[:, 0]):
-            self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-                np.array([val for val in out if (val[0] == 100)])[:, 5], \
-                np.array([val for val in out if (val[0] == 100)])[:, 6], \
-                'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_100V_%s.png" % self.id)
-            self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-                np.array([val for val in out if (val[0] == 100)])[:, 8], \
-                np.array([val for val in out if (val[0] == 100)])[:, 8]*0.01, \
-                'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_100V_%s.png" % self.id)
+        ## Nothing to plot if the scan stopped before the first point
+        if len(out):
+            self.print_graph(np.array(out)[:, 2], np.array(out)[:, 8], np.array(out)[:, 8]*0.01, \
+                'Channel Nr. [-]', 'Total Current [A]', 'All Channels ' + self.id, fn="cv_total_current_all_channels_%s.png" % self.id)
+            self.print_graph(np.array(out)[:, 2], np.array(out)[:, 6], np.array(out)[:, 6]*0.01, \
+                'Channel Nr. [-]', 'Capacitance [F]',  'CV All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
+            if 0:
+                ch = 1
+                self.print_graph(np.array([val for val in out if (val[2] == ch)])[:, 1], \
+                    np.array([val for val in out if (val[2] == ch)])[:, 5], \
+                    np.array([val for val in out if (val[2] == ch)])[:, 6], \
+                    'Bias Voltage [V]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_channel_%d_%s.png" % (ch, self.id))
+                self.print_graph(np.array([val for val in out if (val[2] == ch)])[2:, 1], \
+                    np.array([val for val in out if (val[2] == ch)])[2:, 7]**(-2), \
+                    np.array([val for val in out if (val[2] == ch)])[2:, 7] * 0.01 * 2 * (np.array([val for val in out if (val[2] == ch)])[2:, 7]*0.01)**(-3), \
+                    'Bias Voltage [V]', '1/C^2 [1/F^2]', '1/C2 ' + self.id, fn="1c2v_channel%d_%s.png" % (ch, self.id))
+            if (10 in np.array(out)[:, 0]):
+                self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 5], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 6], \
+                    'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_10V_%s.png" % self.id)
+                self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 8], \
+                    np.array([val for val in out if (val[0] == 10)])[:, 8]*0.01, \
+                    'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_10V_%s.png" % self.id)
+            if (100 in np.array(out)[:, 0]):
+                self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 5], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 6], \
+                    'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_100V_%s.png" % self.id)
+                self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 8], \
+                    np.array([val for val in out if (val[0] == 100)])[:, 8]*0.01, \
+                    'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_100V_%s.png" % self.id)
         self.logging.info("\n")
 
         if 0:
             self.save_list(range(0,512,1), "channel_list.txt", fmt='%d', header='')
 
+    def handle_point(self, p):
+        if p['flagged']:
+            return None
+        vol, cur_tot = p['iv']
+
+        ## Whole spectrum per sweep, shape (readings, frequencies, 2)
+        means = np.mean(p['sweeps'], axis=0)
+        errs = np.std(p['sweeps'], axis=0)
+
+        rows = []
+        for k in range(len(self.lcr_freq_list)):
+            freq = self.lcr_freq_list[k]
+            R, X = means[k]
+            dR, dX = errs[k]
+            if self.cor is not None:
+                z_cor = self.cor.correct(freq, p['voltage'], p['index'] + 1, R + 1j * X)
+                R, X = z_cor.real, z_cor.imag
+
+            z = np.sqrt(R**2 + X**2)
+            phi = np.arctan(X/R)
+            r_s, c_s, l_s, D = lcr_series_equ(freq, z, phi)
+            r_p, c_p, l_p, D = lcr_parallel_equ(freq, z, phi)
+            rows.append([p['voltage'], vol, freq, p['index'] + 1, R, dR, X, dX, c_s, c_p, cur_tot])
+        return rows
+
     def finalise(self):
         self._finalise()
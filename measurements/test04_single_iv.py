@@ -104,8 +104,7 @@ class test04_single_iv(measurement):
                     print "Compliance " + "{: <5.2E}".format(self.lim_cur) + "A reached"
                     break
 
-                cur_tot = pow_supply.read_current()
-                vol = pow_supply.read_voltage()
+                vol, cur_tot = pow_supply.read_iv()
 
                 measurements = np.array([volt_meter.read_current() for _ in range(5)])
                 means = np.mean(measurements, axis=0)
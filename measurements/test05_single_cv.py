@@ -126,8 +126,7 @@ class test05_single_cv(measurement):
 
                 #print pow_supply.check_current_limit()
                 #print pow_supply.read_current()
-                vol = pow_supply.read_voltage()
-                cur_tot = pow_supply.read_current()
+                vol, cur_tot = pow_supply.read_iv()
 
                 # for freq_nom in [self.lcr_freq]:
                 for freq_nom in [1E4]: #[5E2, 1E3, 5E3, 7.5E3, 9E3, 1E4, 1.1E4, 1.5E4, 2E4, 5E4, 1E5, 2E5, 1E6]
@@ -101,8 +101,7 @@ class test06_longterm_iv(measurement):
             for v in self.volt_list:
                 pow_supply.ramp_voltage(v)
 
-                vol = pow_supply.read_voltage()
-                cur_tot = pow_supply.read_current()
+                vol, cur_tot = pow_supply.read_iv()
 
                 t = 0
                 t0 = time.time()
@@ -116,8 +116,7 @@ class test07_longterm_cv(measurement):
                 pow_supply.ramp_voltage(v)
                 time.sleep(self.delay_msr)
 
-                vol = pow_supply.read_voltage()
-                cur_tot = pow_supply.read_current()
+                vol, cur_tot = pow_supply.read_iv()
 
                 t = 0
                 t0 = time.time()
@@ -125,8 +124,7 @@ class test07_longterm_cv(measurement):
                     t = time.time() - t0
                     time.sleep(0.1)
 
-                    vol = pow_supply.read_voltage()
-                    cur_tot = pow_supply.read_current()
+                    vol, cur_tot = pow_supply.read_iv()
 
                     measurements = np.array([lcr_meter.execute_measurement() for _ in range(5)])
                     means = np.mean(measurements, axis=0)
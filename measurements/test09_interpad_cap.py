@@ -112,8 +112,7 @@ class test09_interpad_cap(measurement):
                 pow_supply.ramp_voltage(v)
                 time.sleep(self.delay_vol)
 
-                cur_tot = pow_supply.read_current()
-                vol = pow_supply.read_voltage()
+                vol, cur_tot = pow_supply.read_iv()
 
                 for freq_nom in [5E2, 1E3, 5E3, 1E4, 2E4, 5E4, 1E5, 1E6]:
                     lcr_meter.set_frequency(freq_nom)
@@ -20,6 +20,7 @@ from measurement import measurement
 from devices import ke2410 # power supply
 from devices import hp4980 # lcr meter
 from devices import switchcard # switch
+from scan import scan, stage
 from utils import lcr_series_equ, lcr_parallel_equ, lcr_error_cp
 
 
@@ -111,8 +112,8 @@ class test13_scan_cv_overnight(measurement):
         self.logging.info("Switchcard display setting:      %s" % type_disp)
         self.logging.info("\t")
 
-        self.logging.info("\tVoltage [V]\tTime [s]\tChannel [-]\tR [kOhm]\tX [kOhm]\tC [pF]\tTotal Current[A]")
-        self.logging.info("\t--------------------------------------------------------------------------")
+        self.logging.info("Nominal Voltage [V]\tMeasured Voltage [V]\tTime [s]\tChannel [-]\tR [Ohm]\tX [Ohm]\tC [pF]\tTotal Current[A]")
+        self.logging.info("-" * 110)
 
 
         ## Prepare
@@ -129,85 +130,70 @@ class test13_scan_cv_overnight(measurement):
            + ' Switchcard temperature:          %8.1f C\n' % temp_sc \
            + ' Switchcard measurement setting:  %s\n' % type_msr \
            + ' Switchcard display setting:      %s\n\n\n' % type_disp \
-           + ' Nominal Voltage [V]\tMeasured Voltage [V]\tTime [s]\tChannel [-]\tR [kOhm]\tX [kOhm]\tC [pF]\tTotal Current[A]\n'
-
-        ## Loop over voltages
-        t = 0
-        try:
-            t0 = time.time()
-            while (time.time() - t0 < 12*3600):
-                for v in self.volt_list:
-                    pow_supply.ramp_voltage(v)
-                    time.sleep(self.delay_vol)
-                    time.sleep(0.001)
-
-                    for c in self.cell_list:
-                        switch.open_channel(c)
-                        
-                        t = 0
-                        t1 = time.time()
-                        while t < 60:
-                            t = time.time() - t1
-                            vol = pow_supply.read_voltage()
-                            cur_tot = pow_supply.read_current()
-                            r, x = lcr_meter.execute_measurement()
-                        
-                            cap = (-10**(12))/(2*np.pi*self.lcr_freq*x)
-                            time.sleep(1)           
-                            
-                            out.append([v, vol, t, c, r, x, cap, cur_tot])
-                            self.logging.info("\t%.2f \t%.1f \t%4d \t%.3f \t%.3f \t%.3E \t%.2E" % (vol, t, c, r/1000., x/1000., cap, cur_tot))
-  
-  
-        except KeyboardInterrupt:
-            pow_supply.ramp_voltage(0)
-            self.logging.error("Keyboard interrupt. Ramping down voltage and shutting down.")
-
+           + ' Nominal Voltage [V]\tMeasured Voltage [V]\tTime [s]\tChannel [-]\tR [Ohm]\tX [Ohm]\tC [pF]\tTotal Current[A]\n'
+
+        ## Repeat the voltage cycle for 12 h, follow every cell for 60 s
+        plan = [('time', (12*3600, 0)), ('voltage', self.volt_list), ('channel', self.cell_list), ('time', (60, 1))]
+        stages = [
+            stage('iv', pow_supply.read_iv, concurrent=1),
+            stage('rx', lcr_meter.execute_measurement, concurrent=1),
+        ]
+        fmt = "{:<5.2E}\t{: <5.2E}\t{: <5.1f}\t{: <5d}\t{: <5.2E}\t{: <5.2E}\t{: <5.3E}\t{: <5.2E}"
+        writer = self.open_writer("cv.dat", fmt="%.5E", header=hd)
+        out = scan(self, plan, stages, self.handle_point, fmt, pow_supply, switch, writer=writer, keep=0).run()
+        writer.close()
+        out = writer.load()
 
         ## Close connections
-        pow_supply.ramp_voltage(0)
         pow_supply.set_output_off()
         pow_supply.reset()
 
         ## Save and print
         self.logging.info("\n")
-        self.save_list(out, "cv.dat", fmt="%.5E", header=hd)
-        self.print_graph(np.array(out)[:, 2], np.array(out)[:, 6], np.array(out)[:, 6]*0.001, \
-            'Channel Nr. [-]', 'Total Current [A]', 'All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
-        self.print_graph(np.array(out)[:, 2], np.array(out)[:, 5], np.array(out)[:, 5]*0.001, \
-            'Channel Nr. [-]', 'Capacitance [F]',  'CV All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
-        if (len(self.cell_list) > 2):
+        ## Nothing to plot if the scan stopped before the first point
+        if len(out):
+            self.print_graph(np.array(out)[:, 2], np.array(out)[:, 6], np.array(out)[:, 6]*0.001, \
+                'Channel Nr. [-]', 'Total Current [A]', 'All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
+            self.print_graph(np.array(out)[:, 2], np.array(out)[:, 5], np.array(out)[:, 5]*0.001, \
+                'Channel Nr. [-]', 'Capacitance [F]',  'CV All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
             ch = int(len(self.cell_list) * 0.1) + 1
-            self.print_graph(np.array([val for val in out if (val[2] == ch)])[:, 1], \
-                np.array([val for val in out if (val[2] == ch)])[:, 6], \
-                np.array([val for val in out if (val[2] == ch)])[:, 7], \
-                'Bias Voltage [V]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_channel_%d_%s.png" % (ch, self.id))   
-            self.print_graph(np.array([val for val in out if (val[2] == ch)])[2:, 1], \
-                np.array([val for val in out if (val[2] == ch)])[2:, 6]**(-2), \
-                np.array([val for val in out if (val[2] == ch)])[2:, 7] * 2 * np.array([val for val in out if (val[2] == ch)])[2:, 6]**(-3), \
-                'Bias Voltage [V]', '1/C^2 [1/F^2]', '1/C2 ' + self.id, fn="1c2v_channel%d_%s.png" % (ch, self.id))
-        # if (10 in out[:, 0]):
-        #     self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
-        #         np.array([val for val in out if (val[0] == 10)])[:, 5], \
-        #         np.array([val for val in out if (val[0] == 10)])[:, 6], \
-        #         'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_10V_%s.png" % self.id)
-        #     self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
-        #         np.array([val for val in out if (val[0] == 10)])[:, 7], \
-        #         np.array([val for val in out if (val[0] == 10)])[:, 7]*0.01, \
-        #         'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_10V_%s.png" % self.id)
-        # if (100 in out[:, 0]):
-        #     self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-        #         np.array([val for val in out if (val[0] == 100)])[:, 5], \
-        #         np.array([val for val in out if (val[0] == 100)])[:, 6], \
-        #         'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_100V_%s.png" % self.id)
-        #     self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
-        #         np.array([val for val in out if (val[0] == 100)])[:, 7], \
-        #         np.array([val for val in out if (val[0] == 100)])[:, 7]*0.01, \
-        #         'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_100V_%s.png" % self.id)
+            if (len(self.cell_list) > 2) and (ch in np.array(out)[:, 2]):
+                self.print_graph(np.array([val for val in out if (val[2] == ch)])[:, 1], \
+                    np.array([val for val in out if (val[2] == ch)])[:, 6], \
+                    np.array([val for val in out if (val[2] == ch)])[:, 7], \
+                    'Bias Voltage [V]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_channel_%d_%s.png" % (ch, self.id))   
+                self.print_graph(np.array([val for val in out if (val[2] == ch)])[2:, 1], \
+                    np.array([val for val in out if (val[2] == ch)])[2:, 6]**(-2), \
+                    np.array([val for val in out if (val[2] == ch)])[2:, 7] * 2 * np.array([val for val in out if (val[2] == ch)])[2:, 6]**(-3), \
+                    'Bias Voltage [V]', '1/C^2 [1/F^2]', '1/C2 ' + self.id, fn="1c2v_channel%d_%s.png" % (ch, self.id))
+            # if (10 in out[:, 0]):
+            #     self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
+            #         np.array([val for val in out if (val[0] == 10)])[:, 5], \
+            #         np.array([val for val in out if (val[0] == 10)])[:, 6], \
+            #         'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_10V_%s.png" % self.id)
+            #     self.print_graph(np.array([val for val in out if (val[0] == 10)])[:, 2], \
+            #         np.array([val for val in out if (val[0] == 10)])[:, 7], \
+            #         np.array([val for val in out if (val[0] == 10)])[:, 7]*0.01, \
+            #         'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_10V_%s.png" % self.id)
+            # if (100 in out[:, 0]):
+            #     self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+            #         np.array([val for val in out if (val[0] == 100)])[:, 5], \
+            #         np.array([val for val in out if (val[0] == 100)])[:, 6], \
+            #         'Channel Nr. [-]', 'Parallel Capacitance [F]', 'CV ' + self.id, fn="cv_all_channels_100V_%s.png" % self.id)
+            #     self.print_graph(np.array([val for val in out if (val[0] == 100)])[:, 2], \
+            #         np.array([val for val in out if (val[0] == 100)])[:, 7], \
+            #         np.array([val for val in out if (val[0] == 100)])[:, 7]*0.01, \
+            #         'Channel Nr. [-]', 'Total Current [A]', 'CV ' + self.id, fn="cv_total_current_all_channels_100V_%s.png" % self.id)
         self.logging.info("\n")
 
         if 0:
             self.save_list(range(0,512,1), "channel_list.txt", fmt='%d', header='')
     
+    def handle_point(self, p):
+        vol, cur_tot = p['iv']
+        r, x = p['rx']
+        cap = (-10**(12))/(2*np.pi*self.lcr_freq*x)
+        return [p['voltage'], vol, p['time'], p['channel'], r, x, cap, cur_tot]
+
     def finalise(self):
         self._finalise()
\ No newline at end of file
@@ -0,0 +1,227 @@
+# ============================================================================
+# File: test16_scan_ivcv.py
+# ------------------------------
+#
+# Notes:
+#   IV and CV map in one bias ramp. The switchcard measurement type is
+#   switched per voltage ('block') or per channel ('channel').
+#
+# Layout:
+#   configure and prepare
+#   for each voltage:
+#       set voltage
+#       for each measurement type (block) / channel:
+#           for each channel / measurement type (channel):
+#               measure voltage, current, total current (IV)
+#               measure voltage, r, x and calculate cp, cs (CV)
+#   split into iv.dat and cv.dat
+#   finish
+#
+# Status:
+#   works in the simulation
+#
+# ============================================================================
+
+import time
+import logging
+import numpy as np
+from measurement import measurement
+from devices import ke2410 # power supply
+from devices import ke6487 # volt meter
+from devices import hp4980 # lcr meter
+from devices import switchcard # switch
+from scan import scan, stage
+from utils import lcr_series_equ, lcr_parallel_equ
+
+
+
+class test16_scan_ivcv(measurement):
+    """Measurement of I-V and C-V curves for individual cells in a single bias ramp."""
+
+    def initialise(self):
+        self.logging.info("\t")
+        self.logging.info("------------------------------------------")
+        self.logging.info("IV+CV Scan")
+        self.logging.info("------------------------------------------")
+        self.logging.info(self.__doc__)
+        self.logging.info("\t")
+
+        self._initialise()
+        self.pow_supply_address = 24    # gpib address of the power supply
+        self.volt_meter_address = 23    # gpib address of the multi meter
+        self.lcr_meter_address = 17     # gpib address of the lcr meter
+        self.switch_address = 'COM3'    # serial port of switch card
+
+        self.lim_cur = 0.0005           # compliance in [A]
+        self.lim_vol = 100              # compliance in [V]
+
+        self.cell_list = np.loadtxt('config/channels128_from_schematics_sorted.txt', dtype=int)
+        self.volt_list = np.loadtxt('config/voltagesTest.txt', dtype=int)
+        self.switch_mode = 'block'      # ['block', 'channel'], switch the measurement type once per voltage or per channel
+
+        self.delay_vol = 30             # max. delay between setting voltage and executing measurement in [s]
+        self.delay_ch = 0.3             # max. delay between setting channel and executing measurement in [s]
+        self.settle_tol_iv = 0.01       # relative tolerance for the current to count as settled
+        self.settle_atol_iv = 1E-11     # absolute tolerance for the current to count as settled in [A]
+        self.settle_tol_cv = 0.002      # relative tolerance for r and x to count as settled
+
+        self.lcr_vol = 0.501            # ac voltage amplitude in [mV]
+        self.lcr_freq = 5000            # ac voltage frequency in [Hz]
+        self.cv_res = 1e6               # cv parallel resistor in [Ohm]
+
+        self.flag_list = np.zeros(len(self.cell_list))  # list of cells to skip
+
+
+
+    def execute(self):
+
+        ## Set up power supply
+        pow_supply = ke2410(self.pow_supply_address)
+        pow_supply.reset()
+        pow_supply.set_source('voltage')
+        pow_supply.set_sense('current')
+        pow_supply.set_current_limit(self.lim_cur)
+        pow_supply.set_voltage(0)
+        pow_supply.set_terminal('rear')
+        pow_supply.set_interlock_on()
+        pow_supply.set_output_on()
+        pow_supply.set_ramp(self.ramp_rate, self.ramp_step, self.ramp_mode)
+
+        ## Set up volt meter
+        volt_meter = ke6487(self.volt_meter_address)
+        volt_meter.reset()
+        volt_meter.setup_ammeter()
+        volt_meter.set_nplc(2)
+        volt_meter.setup_burst(5)
+
+        ## Set up lcr meter
+        lcr_meter = hp4980(self.lcr_meter_address)
+        lcr_meter.reset()
+        lcr_meter.set_voltage(self.lcr_vol)
+        lcr_meter.set_frequency(self.lcr_freq)
+        lcr_meter.set_mode('RX')
+        lcr_meter.set_binary_format(1)
+
+        # Set up switch
+        switch = switchcard(self.switch_address)
+        switch.reboot()
+        switch.set_measurement_type('CV')
+        switch.set_cv_resistance(self.cv_res)
+        switch.set_measurement_type('IV')
+        switch.set_display_mode('OFF')
+
+        ## Check settings
+        lim_vol = pow_supply.check_voltage_limit()
+        lim_cur = pow_supply.check_current_limit()
+        lcr_vol = float(lcr_meter.check_voltage())
+        lcr_freq = float(lcr_meter.check_frequency())
+        temp_pc = switch.get_probecard_temperature()
+        temp_sc = switch.get_matrix_temperature()
+        type_disp = switch.get_display_mode()
+
+        ## Header
+        hd = [
+            'Scan IV+CV\n',
+            'Measurement Settings:',
+            'Power supply voltage limit:      %8.2E V' % lim_vol,
+            'Power supply current limit:      %8.2E A' % lim_cur,
+            'LCR measurement voltage:         %8.2E V' % lcr_vol,
+            'LCR measurement frequency:       %8.2E Hz' % lcr_freq,
+            'CV resistance:                   %8.2E Ohm' % self.cv_res,
+            'Voltage delay:                   %8.2f s' % self.delay_vol,
+            'Channel delay:                   %8.2f s' % self.delay_ch,
+            'Settle criterion:                %8s' % self.settle_mode,
+            'Settle tolerance IV:             %8.2E' % self.settle_tol_iv,
+            'Settle tolerance CV:             %8.2E' % self.settle_tol_cv,
+            'Probecard temperature:           %8.1f C' % temp_pc,
+            'Switchcard temperature:          %8.1f C' % temp_sc,
+            'Switchcard switching mode:       %s' % self.switch_mode,
+            'Switchcard display setting:      %s' % type_disp,
+            '\n\n',
+            'Nominal Voltage [V]\t Measured Voltage [V]\tChannel [-]\tType [-]\tCurrent [A]\tCurrent Error [A]\t' \
+                'R [Ohm]\tR_Err [Ohm]\tX [Ohm]\tX_Err [Ohm]\tC_s [F]\tC_p [F]\tTotal Current [A]\tSettle Time [s]\tTime [s]\t'
+        ]
+
+        ## Print Info
+        for line in hd[1:-2]:
+            self.logging.info(line)
+        self.logging.info("\t")
+        self.logging.info("\t")
+        self.logging.info(hd[-1])
+        self.logging.info("-" * int(1.2 * len(hd[-1])))
+
+        ## Scan over voltages, measurement types and channels
+        types = ('type', ['IV', 'CV'], switch.set_measurement_type)
+        if self.switch_mode == 'channel':
+            plan = [('voltage', self.volt_list), ('channel', self.cell_list), types]
+        else:
+            plan = [('voltage', self.volt_list), types, ('channel', self.cell_list)]
+        stages = [
+            stage('cur', volt_meter.read_current_burst, settle=1, discard=1, concurrent=1, only={'type': 'IV'}, \
+                atol=self.settle_atol_iv, rtol=self.settle_tol_iv),
+            stage('rx', lambda: lcr_meter.execute_measurements(5), settle=1, discard=3, concurrent=1, only={'type': 'CV'}, \
+                rtol=self.settle_tol_cv),
+            stage('iv', pow_supply.read_iv, discard=3, always=1, concurrent=1),
+        ]
+        fmt = "{:<5.2E}\t{: <5.2E}\t{: <5d}\t{: <2d}\t{: <8.3E}\t{: <8.3E}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t{: <5.2E}\t" \
+            "{: <8.3E}\t{: <8.3E}\t{: <5.2E}\t{: <5.2f}\t{: <8.1f}"
+        writer = self.open_writer("ivcv.dat", fmt="%.5E", header="\n".join(hd))
+        out = scan(self, plan, stages, self.handle_point, fmt, pow_supply, switch, writer=writer).run()
+        writer.close()
+
+        ## Close connections
+        time.sleep(15)
+        pow_supply.set_interlock_off()
+        pow_supply.set_output_off()
+        pow_supply.reset()
+        volt_meter.reset()
+
+        ## Split into the layouts of test02_scan_iv and test03_scan_cv
+        out = np.array(out).reshape(-1, 15)
+        iv = out[out[:, 3] == 0][:, [0, 1, 2, 4, 5, 12, 13, 14]]
+        cv = out[out[:, 3] == 1][:, [0, 1, 2, 6, 7, 8, 9, 10, 11, 12, 13]]
+        self.save_list(iv, "iv.dat", fmt="%.5E", header="\n".join(hd[:-1] + [
+            'Nominal Voltage [V]\t Measured Voltage [V]\tChannel [-]\tCurrent [A]\tCurrent Error [A]\tTotal Current[A]\tSettle Time [s]\tTime [s]\t']))
+        self.save_list(cv, "cv.dat", fmt="%.5E", header="\n".join(hd[:-1] + [
+            'Nominal Voltage [V]\t Measured Voltage [V]\tChannel [-]\tR [Ohm]\tR_Err [Ohm]\tX [Ohm]\tX_Err [Ohm]\tC [F]\tTotal Current [A]\tSettle Time [s]\n']))
+
+        ## Save and print
+        self.logging.info("\n")
+        if len(iv):
+            self.print_graph(iv[:, 2], iv[:, 3], iv[:, 4], \
+                'Channel Nr. [-]', 'Leakage Current [A]',  'IV All Channels ' + self.id, fn="iv_all_channels_%s.png" % self.id)
+            ch = iv[0, 2]
+            self.print_graph(iv[iv[:, 2] == ch][:, 1], iv[iv[:, 2] == ch][:, 3], iv[iv[:, 2] == ch][:, 4], \
+                'Bias Voltage [V]', 'Leakage Current [A]', 'IV ' + self.id, fn="iv_channel_%d_%s.png" % (ch, self.id))
+        if len(cv):
+            self.print_graph(cv[:, 2], cv[:, 8], cv[:, 8]*0.01, \
+                'Channel Nr. [-]', 'Parallel Capacitance [F]',  'CV All Channels ' + self.id, fn="cv_all_channels_%s.png" % self.id)
+            ch = cv[0, 2]
+            self.print_graph(cv[cv[:, 2] == ch][:, 1], cv[cv[:, 2] == ch][:, 7]**(-2), 2 * 0.01 * cv[cv[:, 2] == ch][:, 7]**(-2), \
+                'Bias Voltage [V]', '1/C^2 [1/F^2]', '1/C2 ' + self.id, fn="1c2v_channel%d_%s.png" % (ch, self.id))
+        self.logging.info("\n")
+
+    def handle_point(self, p):
+        vol, cur_tot = p['iv']
+        i = di = r = dr = x = dx = c_s = c_p = np.nan
+        if p['type'] == 'IV' and not p['flagged']:
+            i = np.mean(p['cur'])
+            di = np.std(p['cur'])
+
+            ## Flag cell if current too large
+            if i > 1E-6:
+                p['flag'] = 1
+
+        elif p['type'] == 'CV' and not p['flagged']:
+            r, x = np.mean(p['rx'], axis=0)
+            dr, dx = np.std(p['rx'], axis=0)
+            z = np.sqrt(r**2 + x**2)
+            phi = np.arctan(x/r)
+            r_s, c_s, l_s, D = lcr_series_equ(self.lcr_freq, z, phi)
+            r_p, c_p, l_p, D = lcr_parallel_equ(self.lcr_freq, z, phi)
+
+        return [p['voltage'], vol, p['index'] + 1, int(p['type'] == 'CV'), i, di, r, dr, x, dx, c_s, c_p, cur_tot, \
+            p['settle_time'], p['timestamp']]
+
+    def finalise(self):
+        self._finalise()
@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import multiprocessing
+from Queue import Empty
+from devices.pyvisa_device import resource_name
+
+
+## Station inventory
+# A JSON dict of station name to the wafer identifier, the test queue and the
+# test settings to override after initialise(), usually the instrument
+# addresses. GPIB addresses of a second interface board are given as full
+# VISA resource names. See config/stations.json.
+#
+# {
+#     "station1": {"wafer": "HPK_1001", "tests": ["test02_scan_iv", "test03_scan_cv"],
+#                  "pow_supply_address": 24, "volt_meter_address": 23, "switch_address": "COM3"},
+#     "station2": {"wafer": "HPK_1002", "tests": ["test16_scan_ivcv"],
+#                  "pow_supply_address": "GPIB1::24::INSTR", "switch_address": "COM5"}
+# }
+RESERVED = ['wafer', 'tests']
+
+
+
+def plain(val):
+    """ JSON strings are unicode, the drivers expect str. """
+    if isinstance(val, unicode):
+        return str(val)
+    if isinstance(val, list):
+        return [plain(v) for v in val]
+    if isinstance(val, dict):
+        return dict([(plain(k), plain(v)) for k, v in val.items()])
+    return val
+
+
+def read_inventory(fn):
+    """ Reads and checks the station inventory, returns the stations and a list of errors. """
+    with open(fn) as f:
+        stations = plain(json.load(f))
+
+    errors = []
+    owner = {}
+    for name in sorted(stations):
+        station = stations[name]
+        if not station.get('wafer') or not station.get('tests'):
+            errors.append("Station %s needs a wafer and a list of tests." % name)
+            continue
+        ## Two stations must not share a wafer (run directory) or an instrument
+        shared = [('wafer', str(station['wafer']))]
+        shared += [('address', resource_name(val).upper()) for key, val in station.items() if key.endswith('_address')]
+        for key in shared:
+            if key in owner:
+                errors.append("Station %s uses %s %s of station %s." % (name, key[0], key[1], owner[key]))
+            owner[key] = name
+    return stations, errors
+
+
+def run_station(name, station, options, queue):
+    """
+    Worker process of one station. Runs its test queue one after another and
+    reports to queue. The console output of the tests goes to
+    logs/<wafer>/station_<name>.txt, every test logs to its own run directory.
+    """
+    import measurements
+    from measurements import plotter
+
+    ldir = "logs/%s" % station['wafer']
+    if not os.path.exists(ldir):
+        os.makedirs(ldir)
+    sys.stdout = sys.stderr = open("%s/station_%s.txt" % (ldir, name), 'a', 1)
+
+    ## The plotting process is forked before any instrument is opened
+    if not options['no_plots']:
+        plotter.start()
+
+    if options['simulate']:
+        import devices
+        devices.simulated_transport.enable(time_scale=options['time_scale'], noise=options['noise'])
+
+    settings = dict([(key, val) for key, val in station.items() if key not in RESERVED])
+    for k, test_name in enumerate(station['tests']):
+        t0 = time.time()
+        msr = None
+        try:
+            test = measurements.load_test(test_name)
+            msr = test(ide=station['wafer'])
+            if options['no_plots']:
+                msr.plots = 0
+            queue.put(('start', name, k, test_name, msr.rdir))
+            msr.initialise()
+            for key, val in settings.items():
+                setattr(msr, key, val)
+            msr.execute()
+            msr.finalise()
+            ## Scans catch compliance trips, instrument errors and Ctrl+C themselves
+            if msr.status != 'done':
+                queue.put(('failed', name, k, test_name, 'Test ended with status %s, see %s.' % (msr.status, msr.rdir)))
+                break
+            queue.put(('done', name, k, test_name, time.time() - t0))
+        except BaseException as e:
+            if msr is not None:
+                msr.logging.exception("Test %s stopped by an error." % test_name)
+                msr.record(status='failed', stop=time.time())
+            queue.put(('failed', name, k, test_name, '%s: %s' % (e.__class__.__name__, e)))
+            break
+        finally:
+            ## Every test gets fresh log handlers
+            if msr is not None:
+                for handler in list(msr.logging.handlers):
+                    msr.logging.removeHandler(handler)
+                    handler.close()
+    ## Worker processes skip the atexit handlers, drain the queued plots here
+    if not options['no_plots']:
+        plotter.wait()
+    queue.put(('exit', name))
+
+
+
+class orchestrator(object):
+    """
+    Runs the test queues of several probe stations concurrently, one worker
+    process per station, and prints the progress of all stations.
+
+    Example:
+    -------------
+    stations, errors = read_inventory('config/stations.json')
+    orchestrator(stations, {'simulate': 0, 'time_scale': 1., 'noise': 1E-3, 'no_plots': 0}).run()
+    """
+
+    def __init__(self, stations, options, interval=10.):
+        self.stations = stations
+        self.options = options
+        self.interval = interval
+        self.queue = multiprocessing.Queue()
+        self.procs = {}
+        self.state = dict([(name, {'test': '-', 'k': -1, 'rdir': '', 'status': 'waiting', 'done': 0, 'failed': 0}) \
+            for name in stations])
+
+    def run(self):
+        """ Starts all stations and waits for them, returns the number of failed tests. """
+        t0 = time.time()
+        for name in sorted(self.stations):
+            proc = multiprocessing.Process(target=run_station, name=name, args=(name, self.stations[name], self.options, self.queue))
+            proc.start()
+            self.procs[name] = proc
+            self.state[name]['status'] = 'running'
+        print "Started %d stations." % len(self.procs)
+
+        last = 0.
+        try:
+            while [name for name in self.procs if self.state[name]['status'] == 'running']:
+                try:
+                    self.update(self.queue.get(timeout=1.))
+                except Empty:
+                    pass
+                self.check_workers()
+                if time.time() - last >= self.interval:
+                    self.report(time.time() - t0)
+                    last = time.time()
+        except KeyboardInterrupt:
+            ## The workers got the interrupt too, their scans ramp down on their own
+            print "Keyboard interrupt, waiting for the stations to shut down."
+        for proc in self.procs.values():
+            proc.join()
+        while not self.queue.empty():
+            self.update(self.queue.get())
+        self.report(time.time() - t0)
+        return sum([s['failed'] for s in self.state.values()])
+
+    def update(self, msg):
+        s = self.state[msg[1]]
+        if msg[0] == 'start':
+            s['k'], s['test'], s['rdir'] = msg[2], msg[3], msg[4]
+            print "[%s] Starting %s in %s." % (msg[1], msg[3], msg[4])
+        elif msg[0] == 'done':
+            s['done'] += 1
+            print "[%s] Finished %s after %.0f s." % (msg[1], msg[3], msg[4])
+        elif msg[0] == 'failed':
+            s['k'], s['test'] = msg[2], msg[3]
+            s['failed'] += 1
+            s['status'] = 'failed'
+            print "[%s] %s failed: %s" % (msg[1], msg[3], msg[4])
+        elif msg[0] == 'exit' and s['status'] == 'running':
+            s['status'] = 'finished'
+
+    def check_workers(self):
+        for name, proc in self.procs.items():
+            if not proc.is_alive() and self.state[name]['status'] == 'running' and self.queue.empty():
+                self.state[name]['status'] = 'crashed'
+                self.state[name]['failed'] += 1
+                print "[%s] Worker exited with code %s." % (name, proc.exitcode)
+
+    def progress(self, rdir):
+        """ Points done and planned of the scan in rdir from its checkpoint, see measurements/scan.py. """
+        try:
+            with open('%s/checkpoint.json' % rdir) as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None, None
+        total = 1
+        for name, size in state['plan']:
+            if name == 'time':
+                total = None
+            elif total is not None:
+                total *= size
+        return state['points'], total
+
+    def report(self, elapsed):
+        lines = ['%-12s %-20s %-24s %6s %14s %10s' % ('Station', 'Wafer', 'Test', 'Queue', 'Points', 'Status')]
+        lines.append('-' * 92)
+        for name in sorted(self.state):
+            s = self.state[name]
+            points, total = self.progress(s['rdir']) if s['rdir'] else (None, None)
+            if points is None:
+                pts = '-'
+            elif total:
+                pts = '%d/%d %3.0f%%' % (points, total, 100. * points / total)
+            else:
+                pts = '%d' % points
+            queue = '%d/%d' % (s['k'] + 1, len(self.stations[name]['tests']))
+            lines.append('%-12s %-20s %-24s %6s %14s %10s' % (name, self.stations[name]['wafer'], s['test'], queue, pts, s['status']))
+        lines.append('-' * 92)
+        lines.append('%d tests finished, %d failed after %.0f s' % (sum([s['done'] for s in self.state.values()]), \
+            sum([s['failed'] for s in self.state.values()]), elapsed))
+        print '\n'.join(lines)
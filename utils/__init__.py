@@ -1 +1,4 @@
-from tools import *
\ No newline at end of file
+from tools import *
+from data_writer import data_writer
+from correction_table import correction_table
+from run_catalogue import run_catalogue
\ No newline at end of file
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+import os
+import numpy as np
+from optparse import OptionParser
+from run_file import read_array, read_info, parse_header
+
+
+## Switch card model
+# The 512 channels are routed through a tree of relays, the octal digits of
+# the channel number from the most significant one select bank, group and
+# relay. Going to a channel in another group of the same bank re-routes the
+# group and relay levels, one in another bank all three.
+LEVELS = [64, 8, 1]
+
+
+
+## Definitions
+def relay_path(c, levels=LEVELS):
+    return [(int(c) // size) % 8 for size in levels]
+
+
+def relay_ops(a, b, levels=LEVELS):
+    """ Number of relay levels switched going from channel a to channel b. """
+    pa, pb = relay_path(a, levels), relay_path(b, levels)
+    for k in range(len(levels)):
+        if pa[k] != pb[k]:
+            return len(levels) - k
+    return 0
+
+
+def read_map(fn):
+    """
+    Returns the pad to channel dict of a channels128_map*.txt file, switchcard
+    channel in the first and pad in the last column. Pad 9999 is unconnected,
+    '#' and '//' start comments.
+    """
+    pads = {}
+    with open(fn) as f:
+        for line in f:
+            row = line.split('#')[0].split('//')[0].split()
+            if len(row) >= 2 and int(row[-1]) != 9999:
+                pads[int(row[-1])] = int(row[0])
+    return pads
+
+
+def column_names(fn):
+    if fn.endswith('.run'):
+        return [c[0] for c in read_info(fn)[0]['columns']]
+    hd = []
+    with open(fn) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            hd.append(line)
+    return parse_header(hd)[2]
+
+
+def find_column(names, key):
+    for k, name in enumerate(names):
+        if name.lower().replace(' ', '').startswith(key):
+            return k
+    return None
+
+
+def read_transitions(fn):
+    """
+    Returns the measured (from channel, to channel, settle time) of a cost file.
+    That is either a table with these three columns or the data file of a
+    scan (iv.dat, cv.dat or .run) with a channel and a settle time column,
+    where every channel change at the same voltage is one transition.
+    """
+    names = column_names(fn)
+    dat = read_array(fn)
+    dat = dat.reshape(-1, dat.shape[-1]) if dat.size else np.zeros((0, 3))
+    i_ch = find_column(names, 'channel')
+    i_st = find_column(names, 'settletime')
+    if i_ch is None or i_st is None:
+        if dat.shape[1] != 3:
+            raise ValueError("%s has no channel and settle time columns." % fn)
+        return [(int(a), int(b), t) for a, b, t in dat if np.isfinite(t)]
+
+    trans = []
+    for prev, row in zip(dat[:-1], dat[1:]):
+        if row[0] != prev[0] or row[i_ch] == prev[i_ch] or not np.isfinite(row[i_st]):
+            continue
+        trans.append((int(prev[i_ch]), int(row[i_ch]), row[i_st]))
+    return trans
+
+
+def cost_matrix(cells, trans=[], switch_time=0.01, default_settle=0.3, levels=LEVELS):
+    """
+    Time in [s] of going from cells[i] to cells[j]: the relay switching plus
+    the settle time. Settle times are the mean of the measured transitions,
+    for pairs that were not measured the mean of all transitions into the
+    cell, otherwise default_settle.
+    """
+    n = len(cells)
+    index = dict([(int(c), k) for k, c in enumerate(cells)])
+    pair_sum, pair_n = np.zeros((n, n)), np.zeros((n, n))
+    cell_sum, cell_n = np.zeros(n), np.zeros(n)
+    for a, b, t in trans:
+        if b not in index:
+            continue
+        cell_sum[index[b]] += t
+        cell_n[index[b]] += 1
+        if a in index:
+            pair_sum[index[a], index[b]] += t
+            pair_n[index[a], index[b]] += 1
+
+    settle = np.where(cell_n > 0, cell_sum / np.maximum(cell_n, 1), default_settle)[None, :].repeat(n, axis=0)
+    settle = np.where(pair_n > 0, pair_sum / np.maximum(pair_n, 1), settle)
+    relays = np.array([[relay_ops(a, b, levels) for b in cells] for a in cells], dtype=float)
+    cost = relays * switch_time + settle
+    np.fill_diagonal(cost, 0.)
+    return cost, relays
+
+
+def path_cost(cost, order):
+    order = np.asarray(order)
+    return cost[order[:-1], order[1:]].sum()
+
+
+def scan_cost(cost, order, serpentine=0):
+    """ Mean time per voltage step, serpentine scans run every second step backwards. """
+    if serpentine:
+        return 0.5 * (path_cost(cost, order) + path_cost(cost, order[::-1]))
+    return path_cost(cost, order)
+
+
+def nearest_neighbour(cost, start):
+    n = len(cost)
+    order = [start]
+    free = np.ones(n, dtype=bool)
+    free[start] = 0
+    for k in range(n - 1):
+        row = np.where(free, cost[order[-1]], np.inf)
+        nxt = int(row.argmin())
+        order.append(nxt)
+        free[nxt] = 0
+    return order
+
+
+def two_opt(cost, order, max_passes=100):
+    """
+    Reverses segments of the path as long as that shortens it. The cost may be
+    asymmetric, the reversed segment is priced from the backward edges.
+    """
+    p = np.array(order)
+    n = len(p)
+    for npass in range(max_passes):
+        improved = 0
+        for i in range(n - 1):
+            fwd = np.concatenate([[0.], np.cumsum(cost[p[:-1], p[1:]])])
+            bwd = np.concatenate([[0.], np.cumsum(cost[p[1:], p[:-1]])])
+            j = np.arange(i + 1, n)
+            delta = (bwd[j] - bwd[i]) - (fwd[j] - fwd[i])
+            if i > 0:
+                delta += cost[p[i - 1], p[j]] - cost[p[i - 1], p[i]]
+            nxt = np.minimum(j + 1, n - 1)
+            delta += np.where(j < n - 1, cost[p[i], p[nxt]] - cost[p[j], p[nxt]], 0.)
+            k = int(delta.argmin())
+            if delta[k] < -1E-12:
+                p[i:j[k] + 1] = p[i:j[k] + 1][::-1].copy()
+                improved = 1
+        if not improved:
+            break
+    return list(p)
+
+
+def plan_order(cost, serpentine=0, starts=16):
+    """
+    Returns the cell indices in the order of least scan time. Serpentine scans
+    run the order forwards and backwards, so both directions are minimised.
+    """
+    n = len(cost)
+    if n < 3:
+        return range(n)
+    c = cost + cost.T if serpentine else cost
+    ## Nearest neighbour tours from a few start cells, the best one is refined
+    tries = [nearest_neighbour(c, s) for s in np.unique(np.linspace(0, n - 1, min(starts, n)).astype(int))]
+    best = min(tries, key=lambda o: path_cost(c, o))
+    return two_opt(c, best)
+
+
+def print_plan(cells, order, cost, relays, serpentine=0, pads={}, fn=''):
+    chans = dict([(ch, pad) for pad, ch in pads.items()])
+    lines = ['%-6s %8s %6s %10s %10s' % ('Step', 'Channel', 'Pad', 'Relays', 'Cost [s]')]
+    lines.append('-' * 44)
+    for k, i in enumerate(order):
+        prev = order[k - 1] if k else None
+        lines.append('%-6d %8d %6s %10s %10s' % (k, cells[i], chans.get(int(cells[i]), '-'), \
+            '%d' % relays[prev, i] if k else '-', '%.3f' % cost[prev, i] if k else '-'))
+    lines.append('-' * 44)
+    file_order = range(len(cells))
+    for name, o in [('File order', file_order), ('Planned order', order)]:
+        lines.append('%-14s %8.0f relay levels, %8.2f s per voltage step' % (name, scan_cost(relays, o, serpentine), scan_cost(cost, o, serpentine)))
+    print '\n'.join(lines)
+    if fn:
+        with open(fn, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+
+## Main Executable
+def main():
+    usage = "usage: ./channel_order.py -i config/channels128_from_schematics_sorted.txt -o config/channels128_planned.txt [options]"
+
+    parser = OptionParser(usage=usage, version="prog 0.1")
+    parser.add_option("-i", "--input", action="store", dest="input", type="string", help="channel list in scan order, one channel per line")
+    parser.add_option("-o", "--output", action="store", dest="output", type="string", default="", help="planned channel list")
+    parser.add_option("-c", "--costs", action="append", dest="costs", type="string", default=[], \
+        help="measured settle costs, a 'from to seconds' table or the iv.dat/cv.dat/.run of a scan, can be repeated")
+    parser.add_option("-m", "--map", action="store", dest="map", type="string", default="", help="pad to channel map, e.g. config/channels128_map.txt")
+    parser.add_option("--pads", action="store_true", dest="pads", default=False, help="input and cost tables give pad numbers, needs --map")
+    parser.add_option("--serpentine", action="store_true", dest="serpentine", default=False, help="plan for scans that reverse the order on every second voltage")
+    parser.add_option("--switch-time", action="store", dest="switch_time", type="float", default=0.01, help="time per switched relay level in [s]")
+    parser.add_option("--settle", action="store", dest="settle", type="float", default=0.3, help="settle time of unmeasured transitions in [s]")
+    parser.add_option("--report", action="store", dest="report", type="string", default="", help="write the plan to this file")
+    (options, args) = parser.parse_args()
+
+    if not options.input:
+        parser.error("Give a channel list.")
+    if options.pads and not options.map:
+        parser.error("--pads needs the channel map.")
+
+    pads = read_map(options.map) if options.map else {}
+    cells = np.loadtxt(options.input, dtype=int, comments='#', ndmin=1)
+    trans = []
+    for fn in options.costs:
+        trans += read_transitions(fn)
+    if options.pads:
+        missing = [c for c in cells if c not in pads]
+        if missing:
+            parser.error("Pads %s are not in %s." % (', '.join(map(str, missing)), options.map))
+        cells = np.array([pads[c] for c in cells])
+        trans = [(pads.get(a, -1), pads.get(b, -1), t) for a, b, t in trans]
+
+    cost, relays = cost_matrix(cells, trans, options.switch_time, options.settle)
+    order = plan_order(cost, options.serpentine)
+    print "Planned %d channels with %d measured transitions." % (len(cells), len(trans))
+    print_plan(cells, order, cost, relays, options.serpentine, pads, options.report)
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write('\n'.join(['%d' % cells[i] for i in order]) + '\n')
+        print "Saved the planned order to %s." % options.output
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+import os
+import sys
+import glob
+import time
+import multiprocessing
+from optparse import OptionParser
+import correct_cv
+import correct_iv
+
+
+## Definitions
+def find_files(patterns):
+    """ Run files (*_CV.txt, *_IV.txt, *.run) in the given directories or globs, and the patterns without any. """
+    files = []
+    missing = []
+    for pat in patterns:
+        found = []
+        for fn in glob.glob(pat):
+            if os.path.isdir(fn):
+                for ext in ['*_CV.txt', '*_IV.txt', '*.run']:
+                    found += glob.glob(os.path.join(fn, ext))
+            else:
+                found.append(fn)
+        if not found:
+            print "No run files in %s." % pat
+            missing.append(pat)
+        for fn in sorted(found):
+            name = os.path.basename(fn)
+            if '_corrected' in name or '_Open_' in name or '_Short_' in name:
+                continue
+            if fn not in files:
+                files.append(fn)
+    return files, missing
+
+
+def file_type(fn):
+    name = os.path.basename(fn).upper()
+    if '_IV' in name:
+        return 'iv'
+    return 'cv'
+
+
+def output_name(fn, outdir):
+    out = os.path.splitext(fn)[0] + '_corrected.txt'
+    if outdir:
+        out = os.path.join(outdir, os.path.basename(out))
+    return out
+
+
+def correct_file(task):
+    """ Corrects one file, runs in a worker process. Returns a summary line. """
+    fn, fn_out, typ, dat_open, dat_short, opt = task
+    t0 = time.time()
+    try:
+        if typ == 'iv':
+            hd = correct_iv.read_header(fn)
+            out = correct_iv.process_file(correct_iv.read_file(fn), opt['fInvert'], opt['fCorrect'])
+            correct_iv.save_file(fn, fn_out, out, hd, opt['fInvert'], opt['fCorrect'])
+        else:
+            hd = correct_cv.read_header(fn)
+            out = correct_cv.process_data(correct_cv.read_file(fn), dat_open, dat_short, opt['freq'], opt['fInvert'], opt['fCorrect'])
+            correct_cv.save_file(fn, fn_out, out, hd, opt['fInvert'], opt['fCorrect'])
+        return [fn, typ, 'ok', len(out), time.time() - t0, fn_out]
+    except Exception as e:
+        return [fn, typ, 'failed: %s' % e, 0, time.time() - t0, '']
+
+
+def make_tasks(files, options):
+    """ Groups the CV files by their open/short files and reads every reference once. """
+    opt = {'freq': options.freq, 'fInvert': options.fInvert}
+    refs = {}
+    tasks = []
+    failed = []
+    for fn in files:
+        typ = file_type(fn) if options.type == 'auto' else options.type
+        fcor = options.fCorrect if options.fCorrect is not None else int(typ == 'iv')
+        dat_open, dat_short = None, None
+        if typ == 'cv':
+            if options.open_file != '' and options.short_file != '':
+                key = (options.open_file, options.short_file)
+            else:
+                key = correct_cv.default_correction_files(fn)
+            if key not in refs:
+                try:
+                    refs[key] = (correct_cv.read_file(key[0]), correct_cv.read_file(key[1]))
+                except Exception as e:
+                    refs[key] = None
+                    print "Can't read correction files %s, %s: %s" % (key[0], key[1], e)
+            if refs[key] is None:
+                failed.append([fn, typ, 'failed: no correction files', 0, 0., ''])
+                continue
+            dat_open, dat_short = refs[key]
+        tasks.append((fn, output_name(fn, options.outdir), typ, dat_open, dat_short, dict(opt, fCorrect=fcor)))
+    return tasks, failed, len([r for r in refs.values() if r is not None])
+
+
+def print_summary(res, total, fn=''):
+    lines = ['%-60s %-4s %6s %8s  %s' % ('File', 'Type', 'Rows', 'Time [s]', 'Status')]
+    lines.append('-' * 100)
+    for r in res:
+        lines.append('%-60s %-4s %6d %8.2f  %s' % (r[0], r[1], r[3], r[4], r[2]))
+    lines.append('-' * 100)
+    lines.append('%d files, %d corrected, %d failed in %.1f s' % (len(res), len([r for r in res if r[2] == 'ok']), \
+        len([r for r in res if r[2] != 'ok']), total))
+    print '\n'.join(lines)
+    if fn:
+        with open(fn, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+
+## Main Executable
+def main():
+    usage = "usage: ./correct_batch.py [options] dir_or_glob [dir_or_glob ...]"
+
+    parser = OptionParser(usage=usage, version="prog 0.1")
+    parser.add_option("-j", "--jobs", action="store", dest="jobs", type="int", default=multiprocessing.cpu_count(), help="number of worker processes")
+    parser.add_option("-t", "--type", action="store", dest="type", type="choice", choices=['auto', 'cv', 'iv'], default='auto', help="cv, iv or auto from the file name")
+    parser.add_option("--outdir", action="store", dest="outdir", type="string", default="", help="output directory, default is next to the input")
+    parser.add_option("--report", action="store", dest="report", type="string", default="", help="write the summary to this file")
+    parser.add_option("--inv", "--invert", action="store", dest="fInvert", type="int", default=0, help="flag to invert voltages")
+    parser.add_option("--cor", "--correct", action="store", dest="fCorrect", type="int", default=None, help="correction flag, default 1 for IV and 0 for CV")
+    parser.add_option("--freq", "--frequency", action="store", dest="freq", type="int", default=10000, help="frequency for the open-short correction")
+    parser.add_option("--ocf", "--open_correction_file", action="store", dest="open_file", type="string", default="", help="open correction file for all CV files")
+    parser.add_option("--scf", "--short_correction_file", action="store", dest="short_file", type="string", default="", help="short correction file for all CV files")
+    (options, args) = parser.parse_args()
+
+    if len(args) < 1:
+        parser.error("Give at least one directory or glob.")
+    if options.outdir and not os.path.exists(options.outdir):
+        os.makedirs(options.outdir)
+
+    t0 = time.time()
+    files, missing = find_files(args)
+    tasks, res, nref = make_tasks(files, options)
+    print "Correcting %d files with %d sets of correction files in %d processes." % (len(tasks), nref, options.jobs)
+
+    if options.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(options.jobs, len(tasks)))
+        try:
+            ## A timeout keeps the wait interruptible by Ctrl+C
+            res += pool.map_async(correct_file, tasks).get(1E6)
+        finally:
+            pool.terminate()
+    else:
+        res += [correct_file(task) for task in tasks]
+
+    print_summary(res, time.time() - t0, options.report)
+    return 0 if all([r[2] == 'ok' for r in res]) and not missing else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
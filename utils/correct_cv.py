@@ -4,6 +4,7 @@ import sys
 import numpy as np
 from cmath import *
 from optparse import OptionParser
+from run_file import read_array, header_lines
 
 # Constants
 kBoltzmann = 8.61733 * 10**(-5)  # [ev/K]
@@ -66,27 +67,69 @@ def lcr_error_cs(f, z, z_err, phi, phi_err):
 
 
 def read_file(fn):
-    dat = np.loadtxt(fn, dtype='float', comments='#')
+    dat = read_array(fn)
     return dat
 
 
 def read_header(fn):
     hd = ''
-    with open(fn) as f:
-        next(f)
-        for line in f:
-            if line[0] == '#':
-                if line[1:8] == 'HexPlot':
-                    pass
-                elif line[1:8] == 'Voltage':
-                    pass
-                elif line[1:4] == '[V]':
-                    pass
-                else:
-                    hd += line.rstrip() + "\n"
+    if fn.endswith('.run'):
+        lines = header_lines(fn)
+    else:
+        with open(fn) as f:
+            lines = f.readlines()
+    for line in lines[1:]:
+        if line[0] == '#':
+            if line[1:8] == 'HexPlot':
+                pass
+            elif line[1:8] == 'Voltage':
+                pass
+            elif line[1:4] == '[V]':
+                pass
+            else:
+                hd += line.rstrip() + "\n"
     return hd
 
 
+def default_correction_files(fn):
+    """ Open and short files of a run file in the default location, empty strings if the path doesn't tell. """
+    fOpen = ''
+    fShort = ''
+
+    if os.name == 'nt':
+        m = '\\'
+        sp = fn.split(m)
+        ln = len(sp)
+    else:
+        m = '/'
+        sp = fn.split(m)
+        ln = len(sp)
+
+    if (ln == 1):
+        return fOpen, fShort
+    else:
+        path = ''
+        typ = ''
+        wp = sp[-1].split('_')
+        for s in sp[:-2]:
+            path += s + m
+        for w in wp[:-2]:
+            typ += w + '_'
+        typ = typ[:-1]
+        num = wp[-2]
+        name = typ + '_' + num
+
+    # Top folder
+    # fOpen += '%s' % path + typ + '_Correction_Open' + m + typ + '_Open_CV.txt'
+    # fShort += '%s' % path + typ + '_Correction_Short' + m + typ + '_Short_CV.txt'
+
+    # Same folder
+    fOpen += '%s' % path + name + m + typ + '_Open_CV.txt'
+    fShort += '%s' % path + name + m + typ + '_Short_CV.txt'
+
+    return fOpen, fShort
+
+
 def find_correction_file(fn, open_file, short_file):
 
     # if files are provided, use them
@@ -96,44 +139,14 @@ def find_correction_file(fn, open_file, short_file):
 
     # else look for default paths
     else:
-        fOpen = ''
-        fShort = ''
-
-        if os.name == 'nt':
-            m = '\\'
-            sp = fn.split(m)
-            ln = len(sp)
-        else:
-            m = '/'
-            sp = fn.split(m)
-            ln = len(sp)
-
-        if (ln == 1):
+        fOpen, fShort = default_correction_files(fn)
+        if fOpen == '':
             print "Something went wrong. Can't find correction files."
             sys.exit()
-        else:
-            path = ''
-            typ = ''
-            wp = sp[-1].split('_')
-            for s in sp[:-2]:
-                path += s + m
-            for w in wp[:-2]:
-                typ += w + '_'
-            typ = typ[:-1]
-            num = wp[-2]
-            name = typ + '_' + num
-
-        # Top folder
-        # fOpen += '%s' % path + typ + '_Correction_Open' + m + typ + '_Open_CV.txt'
-        # fShort += '%s' % path + typ + '_Correction_Short' + m + typ + '_Short_CV.txt'
-
-        # Same folder
-        fOpen += '%s' % path + name + m + typ + '_Open_CV.txt'
-        fShort += '%s' % path + name + m + typ + '_Short_CV.txt'
 
     try:
-        tmp = np.loadtxt(fOpen, dtype='float', comments='#')
-        tmp = np.loadtxt(fShort, dtype='float', comments='#')
+        tmp = read_array(fOpen)
+        tmp = read_array(fShort)
         print "Using corrections from:\n"
         print fOpen
         print fShort
@@ -144,76 +157,92 @@ def find_correction_file(fn, open_file, short_file):
     return fOpen, fShort
 
 
+def lcr_impedance(r, phi):
+    z = np.zeros(len(r), dtype=complex)
+    z.real = r * np.cos(phi)
+    z.imag = r * np.sin(phi)
+    return z
+
+
+def make_key(v, ch):
+    # Complex keys sort by voltage first, then by channel
+    key = np.zeros(len(v), dtype=complex)
+    key.real = v
+    key.imag = ch
+    return key
+
+
+def join(ref, keys):
+    """ Index of the first entry of ref equal to each key, -1 where there is none. """
+    if len(ref) == 0:
+        return -np.ones(len(keys), dtype=int)
+    uniq, first = np.unique(ref, return_index=True)
+    pos = np.searchsorted(uniq, keys).clip(0, len(uniq) - 1)
+    return np.where(uniq[pos] == keys, first[pos], -1)
+
+
+def take(dat, idx, col):
+    return np.where(idx >= 0, dat[idx, col], np.nan)
+
+
 def process_file(dat, fOpen, fShort, freq, fInvert, fCor):
     dat_open = read_file(fOpen)
     dat_short = read_file(fShort)
+    return process_data(dat, dat_open, dat_short, freq, fInvert, fCor)
+
+
+def process_data(dat, dat_open, dat_short, freq, fInvert, fCor):
+    # Voltages in their order of appearance, lines in file order within a voltage
+    volts, first, inv = np.unique(dat[:, 0], return_index=True, return_inverse=True)
+    order = np.argsort(first[inv], kind='mergesort')
+
+    # Only voltages with more than one measured and one open line are corrected
+    v_open = np.sort(dat_open[:, 0])
+    n_open = np.searchsorted(v_open, volts, 'right') - np.searchsorted(v_open, volts, 'left')
+    n_msr = np.bincount(inv)
+    dat = dat[order][((n_msr > 1) & (n_open > 1))[inv[order]]]
+
+    v = dat[:, 0]
+    ch = dat[:, 1]
+    v_msr = dat[:, 5]
+    temp = dat[:, 7]
+    hum = dat[:, 8]
+    r = np.where(dat[:, 11] == 0, np.nan, dat[:, 11])
+    r_err = dat[:, 12]
+    phi = dat[:, 13]
+    phi_err = dat[:, 14]
+    tot_curr = dat[:, 4]
+
+    if (fInvert):
+        v_cor = np.abs(v)
+    else:
+        v_cor = v
+
+    # Open values of the same voltage and channel, short values of the channel at any voltage
+    i_open = join(make_key(dat_open[:, 0], dat_open[:, 1]), make_key(v, ch))
+    i_short = join(make_key(np.zeros(len(dat_short)), dat_short[:, 1]), make_key(np.zeros(len(ch)), ch))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = lcr_impedance(r, phi)
+        cp = lcr_parallel_equ(freq, abs(z), np.angle(z))[1] * 10**12
+
+        z_open = lcr_impedance(take(dat_open, i_open, 11), take(dat_open, i_open, 13))
+        z_ocor = lcr_open_cor(z, z_open)
+        cp_ocor = lcr_parallel_equ(freq, abs(z_ocor), np.angle(z_ocor))[1] * 10**12
+        cp_ocor_err = lcr_error_cp(freq, r, r_err, phi, phi_err) * 10**12
+
+        z_short = lcr_impedance(take(dat_short, i_short, 11), take(dat_short, i_short, 13))
+        z_scor = lcr_open_short_cor(z, z_open, z_short)
+        cp_scor = lcr_parallel_equ(freq, abs(z_scor), np.angle(z_scor))[1] * 10**12
+        cp_scor_err = cp_ocor_err
+
+    if (1): # ocor
+        z_cor, cp_cor, cp_cor_err = z_ocor, cp_ocor, cp_ocor_err
+    else: # scor
+        z_cor, cp_cor, cp_cor_err = z_scor, cp_scor, cp_scor_err
 
-    volts = []
-    for line in dat:
-        v = line[0]
-        if v in volts:
-            pass
-        else:
-            volts.append(v)
-
-    out = []
-    for volt in volts:
-        tmp_msr = np.array([val for val in dat if (val[0] == volt)])
-        tmp_open = np.array([val for val in dat_open if (val[0] == volt)])
-
-        if (len(tmp_open) > 1 and len(tmp_msr) > 1):
-
-            for line in tmp_msr:
-                v = line[0]
-                ch = line[1]
-                v_msr = line[5]
-                temp = line[7]
-                hum = line[8]
-                r = line[11]
-                r_err = line[12]
-                phi = line[13]
-                phi_err = line[14]
-                tot_curr = line[4]
-
-                if (r == 0):
-					r = np.nan
-
-                if (fInvert):
-                    v_cor = np.abs(v)
-                else:
-                    v_cor = v
-
-                z = rect(r, phi)
-                cp = lcr_parallel_equ(freq, abs(z), phase(z))[1] * 10**12
-                cs = lcr_series_equ(freq, abs(z), phase(z))[1] * 10**12
-
-                r_open = np.array([val for val in tmp_open if (val[1] == ch)])[0, 11]
-                phi_open = np.array([val for val in tmp_open if (val[1] == ch)])[0, 13]
-                z_open = rect(r_open, phi_open)
-                
-                z_ocor = lcr_open_cor(z, z_open)
-                cp_ocor = lcr_parallel_equ(freq, abs(z_ocor), phase(z_ocor))[1] * 10**12
-                cs_ocor = lcr_series_equ(freq, abs(z_ocor), phase(z_ocor))[1] * 10**12
-                cp_ocor_err = lcr_error_cp(freq, r, r_err, phi, phi_err) * 10**12
-                
-                r_short = np.array(
-                    [val for val in dat_short if (val[1] == ch)])[0, 11]
-                phi_short = np.array(
-                    [val for val in dat_short if (val[1] == ch)])[0, 13]
-                z_short = rect(r_short, phi_short)
-
-                z_scor = lcr_open_short_cor(z, z_open, z_short)
-                cp_scor = lcr_parallel_equ(freq, abs(z_scor), phase(z_scor))[1] * 10**12
-                cp_scor_err = lcr_error_cp(freq, r, r_err, phi, phi_err) * 10**12
-
-                if (1): # ocor
-                    out.append([v_cor, ch, cp_ocor, cp_ocor_err, tot_curr, v_msr, cp, temp, hum, abs(z_ocor), phase(z_ocor),
-                            abs(z), phase(z), abs(z_open), phase(z_open), abs(z_short), phase(z_short)])
-                else: # scor
-                    out.append([v_cor, ch, cp_scor, cp_scor_err, tot_curr, v_msr, cp, temp, hum, abs(z_scor), phase(z_scor),
-                            abs(z), phase(z), abs(z_open), phase(z_open), abs(z_short), phase(z_short)])
-                        
-    return np.array(out)
+    return np.column_stack([v_cor, ch, cp_cor, cp_cor_err, tot_curr, v_msr, cp, temp, hum, abs(z_cor), np.angle(z_cor),
+                            abs(z), np.angle(z), abs(z_open), np.angle(z_open), abs(z_short), np.angle(z_short)])
 
 
 def save_file(fn, fn2, dat, hd, fInvert, fCorrect):
@@ -1,6 +1,7 @@
 #!/usr/bin/python
 import numpy as np
 from optparse import OptionParser
+from run_file import read_array, header_lines
 
 
 ## Constants
@@ -17,24 +18,27 @@ def correct_temperature(i, t):
 
 
 def read_file(fn):
-    dat = np.loadtxt(fn, dtype='float', comments='#')
+    dat = read_array(fn)
     return dat
 
 
 def read_header(fn):
     hd = ''
-    with open(fn) as f:
-        next(f)
-        for line in f:
-            if line[0] == '#':
-                if line[1:8] == 'HexPlot':
-                    pass
-                elif line[1:8] == 'Voltage':
-                    pass
-                elif line[1:4] == '[V]':
-                    pass
-                else:
-                    hd += line.rstrip() + "\n"
+    if fn.endswith('.run'):
+        lines = header_lines(fn)
+    else:
+        with open(fn) as f:
+            lines = f.readlines()
+    for line in lines[1:]:
+        if line[0] == '#':
+            if line[1:8] == 'HexPlot':
+                pass
+            elif line[1:8] == 'Voltage':
+                pass
+            elif line[1:4] == '[V]':
+                pass
+            else:
+                hd += line.rstrip() + "\n"
     return hd
 
 
@@ -0,0 +1,172 @@
+import os
+import re
+import glob
+import numpy as np
+
+
+class correction_table(object):
+    """
+    Open, short and load impedances of the probe card, read from the
+    values<Kind><N>kHz.txt files in path and indexed by kind, frequency,
+    voltage and channel. The parsed tables are cached in cache (default
+    logs/corrections_cache.npz) and only re-read when a source file changes.
+
+    Between the measured frequencies the open admittance and the short and
+    load impedances are interpolated linearly in frequency. Frequencies
+    outside the measured range are refused with a ValueError, check them
+    with covers() first. Voltages are matched to the nearest
+    tabulated absolute voltage, a table measured at one voltage only holds
+    for all. Channels are the channel numbers of the scan output.
+
+    Example:
+    -------------
+    cor = correction_table('config')
+    z = cor.correct(20000, -100, [1, 2, 3], r + 1j * x)
+    """
+
+    kinds = {'Open': 'open', 'Short': 'short', 'Load': 'load'}
+    pattern = re.compile(r'values(Open|Short|Load)(\d+(?:\.\d+)?)kHz\.txt$')
+
+    def __init__(self, path='config', cache=None):
+        self.path = path
+        self.cache = cache if cache is not None else os.path.join('logs', 'corrections_cache.npz')
+        self.tables = {}
+        self.load()
+
+    def sources(self):
+        src = []
+        for fn in sorted(glob.glob(os.path.join(self.path, 'values*kHz.txt'))):
+            m = self.pattern.search(os.path.basename(fn))
+            if m:
+                src.append((self.kinds[m.group(1)], float(m.group(2)) * 1E3, fn))
+        return src
+
+    def stamp(self, src):
+        return np.array(['%s:%d:%d' % (fn, os.path.getmtime(fn), os.path.getsize(fn)) for kind, f, fn in src])
+
+
+
+    # Loading
+    # ---------------------------------
+
+    def load(self):
+        src = self.sources()
+        stamp = self.stamp(src)
+        if self.read_cache(stamp):
+            return 0
+        for kind in sorted(set([s[0] for s in src])):
+            self.tables[kind] = self.build([s for s in src if s[0] == kind])
+        self.write_cache(stamp)
+        return 0
+
+    @staticmethod
+    def read_source(fn):
+        """ Returns voltage, channel and complex impedance of a values file. """
+        dat = np.loadtxt(fn, comments='#', ndmin=2)
+        if dat.shape[1] >= 9:
+            ## Scan CV layout, nominal voltage, channel, R and X
+            return np.abs(dat[:, 0]), dat[:, 2].astype(int), dat[:, 3] + 1j * dat[:, 5]
+        ## Channel, R and X
+        return np.zeros(len(dat)), dat[:, 0].astype(int), dat[:, 1] + 1j * dat[:, 2]
+
+    def build(self, src):
+        dats = [(f, self.read_source(fn)) for kind, f, fn in src]
+        freqs = np.array(sorted(set([f for f, dat in dats])))
+        channels = np.unique(np.concatenate([dat[1] for f, dat in dats]))
+        if max([len(np.unique(dat[0])) for f, dat in dats]) > 1:
+            volts = np.unique(np.concatenate([dat[0] for f, dat in dats]))
+        else:
+            volts = np.array([np.nan])
+
+        z = np.zeros((len(freqs), len(volts), len(channels)), dtype=complex) * np.nan
+        for f, (v, ch, val) in dats:
+            fi = np.searchsorted(freqs, f)
+            vi = np.searchsorted(volts, v) if len(volts) > 1 else np.zeros(len(v), dtype=int)
+            ci = np.searchsorted(channels, ch)
+            ## The first line of a (voltage, channel) pair wins
+            z[fi, vi[::-1], ci[::-1]] = val[::-1]
+        return {'freqs': freqs, 'volts': volts, 'channels': channels, 'z': z}
+
+    def read_cache(self, stamp):
+        try:
+            dat = np.load(self.cache)
+            if list(dat['stamp']) != list(stamp):
+                return 0
+            for kind in set(self.kinds.values()):
+                if '%s_z' % kind in dat.files:
+                    self.tables[kind] = dict([(key, dat['%s_%s' % (kind, key)]) for key in ['freqs', 'volts', 'channels', 'z']])
+        except (IOError, OSError, KeyError, ValueError):
+            return 0
+        return 1
+
+    def write_cache(self, stamp):
+        arrays = {'stamp': stamp}
+        for kind in self.tables:
+            for key in self.tables[kind]:
+                arrays['%s_%s' % (kind, key)] = self.tables[kind][key]
+        tmp = self.cache + '.tmp'
+        try:
+            if os.path.dirname(self.cache) and not os.path.exists(os.path.dirname(self.cache)):
+                os.makedirs(os.path.dirname(self.cache))
+            with open(tmp, 'wb') as f:
+                np.savez(f, **arrays)
+            if os.path.exists(self.cache):
+                os.remove(self.cache)
+            os.rename(tmp, self.cache)
+        except (IOError, OSError):
+            return -1
+        return 0
+
+
+
+    # Lookup
+    # ---------------------------------
+
+    def covers(self, f, short=1):
+        """ True if the open (and short) tables were measured around the frequency f. """
+        for kind in ['open', 'short'] if short else ['open']:
+            freqs = self.tables[kind]['freqs'] if kind in self.tables else []
+            if len(freqs) == 0 or not freqs[0] * (1 - 1E-9) <= f <= freqs[-1] * (1 + 1E-9):
+                return False
+        return True
+
+    def interpolate(self, freqs, vals, f):
+        if len(freqs) == 1:
+            return vals[0]
+        k = int(np.clip(np.searchsorted(freqs, f) - 1, 0, len(freqs) - 2))
+        w = (f - freqs[k]) / (freqs[k + 1] - freqs[k])
+        return vals[k] * (1 - w) + vals[k + 1] * w
+
+    def lookup(self, kind, f, v, ch):
+        """ Impedance of kind at frequency f for the voltages v and channels ch, NaN where not tabulated. """
+        tab = self.tables[kind]
+        if not tab['freqs'][0] * (1 - 1E-9) <= f <= tab['freqs'][-1] * (1 + 1E-9):
+            raise ValueError("The %s table is measured from %.0f to %.0f Hz, not at %.0f Hz." \
+                % (kind, tab['freqs'][0], tab['freqs'][-1], f))
+        v, ch = np.broadcast_arrays(np.abs(np.atleast_1d(v)).astype(float), np.atleast_1d(ch).astype(int))
+
+        if len(tab['volts']) > 1:
+            vi = np.abs(tab['volts'][:, None] - v[None, :]).argmin(axis=0)
+        else:
+            vi = np.zeros(len(v), dtype=int)
+        ci = np.searchsorted(tab['channels'], ch).clip(0, len(tab['channels']) - 1)
+        found = tab['channels'][ci] == ch
+
+        vals = tab['z'][:, vi, ci]
+        if kind == 'open':
+            z = 1 / self.interpolate(tab['freqs'], 1 / vals, f)
+        else:
+            z = self.interpolate(tab['freqs'], vals, f)
+        return np.where(found, z, np.nan)
+
+    def correct(self, f, v, ch, z, short=1):
+        """ Open (short=0) or open-short corrected impedance z measured at f, v and ch. """
+        scalar = np.ndim(z) == 0
+        z = np.atleast_1d(z)
+        z_open = self.lookup('open', f, v, ch)
+        if short:
+            z_short = self.lookup('short', f, v, ch)
+            z_cor = (z - z_short) / (1 - (z - z_short) / z_open)
+        else:
+            z_cor = 1 / (1 / z - 1 / z_open)
+        return z_cor[0] if scalar else z_cor
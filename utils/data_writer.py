@@ -0,0 +1,103 @@
+import os
+import time
+import atexit
+import numpy as np
+
+
+class data_writer(object):
+    """
+    Streaming replacement for np.savetxt. Rows are appended as they are
+    measured and written out every flush_rows rows or flush_time seconds,
+    followed by an fsync, so a crash loses at most the last unflushed rows.
+    The file is closed at interpreter exit if the test didn't get to it. The
+    output reads back with np.loadtxt like a file from save_list.
+
+    rows        number of data rows to keep of an existing file, which is
+                then appended to instead of overwritten (resumed runs)
+
+    Example:
+    -------------
+    w = data_writer('logs/run/iv.dat', header='Voltage [V]\\tCurrent [A]')
+    w.write([10., 1.2E-9])
+    w.close()
+    """
+
+    def __init__(self, fn, header='', fmt='%.5E', delimiter='\t', flush_rows=50, flush_time=10., rows=None):
+        self.fn = fn
+        self.fmt = fmt
+        self.delimiter = delimiter
+        self.flush_rows = flush_rows
+        self.flush_time = flush_time
+        self.rows = 0
+        self.buf = []
+        self.flushes = 0
+
+        if rows is None:
+            self.f = open(fn, 'w')
+            if header:
+                self.f.write('# ' + header.replace('\n', '\n# ') + '\n')
+        else:
+            self.rows = self.truncate(fn, rows)
+            self.f = open(fn, 'a')
+        self.flush()
+        atexit.register(self.close)
+
+    def format_row(self, row):
+        row = np.atleast_1d(np.asarray(row, dtype=float))
+        if self.fmt.count('%') == 1:
+            return self.delimiter.join([self.fmt % val for val in row])
+        return self.fmt % tuple(row)
+
+    def write(self, row):
+        self.buf.append(self.format_row(row) + '\n')
+        self.rows += 1
+        if len(self.buf) >= self.flush_rows or time.time() - self.t_flush >= self.flush_time:
+            self.flush()
+
+    def flush(self):
+        if self.f is None:
+            return
+        if self.buf:
+            self.f.write(''.join(self.buf))
+            self.buf = []
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.t_flush = time.time()
+        self.flushes += 1
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush()
+        self.f.close()
+        self.f = None
+
+    def load(self):
+        """ Reads the rows written so far back as a 2D array. """
+        self.flush()
+        return np.loadtxt(self.fn, delimiter=self.delimiter, ndmin=2)
+
+    @staticmethod
+    def truncate(fn, rows):
+        """ Cuts the file after the header and the first rows data rows. """
+        end = 0
+        n = 0
+        with open(fn, 'rb+') as f:
+            for line in f.read().splitlines(True):
+                if not line.startswith('#'):
+                    if n == rows or not line.endswith('\n'):
+                        break
+                    n += 1
+                end += len(line)
+            f.truncate(end)
+        return n
+
+    @staticmethod
+    def repair(fn):
+        """ Cuts a partly written last line, e.g. after a power cut. """
+        with open(fn, 'rb+') as f:
+            data = f.read()
+            end = data.rfind('\n') + 1
+            if end < len(data):
+                f.truncate(end)
+        return end
@@ -0,0 +1,230 @@
+#!/usr/bin/python
+import os
+import glob
+import json
+import time
+import random
+import sqlite3
+from optparse import OptionParser
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    wafer       TEXT NOT NULL,
+    num         INTEGER NOT NULL,
+    run         TEXT NOT NULL,
+    test        TEXT,
+    status      TEXT,
+    start       REAL,
+    stop        REAL,
+    host        TEXT,
+    user        TEXT,
+    rdir        TEXT,
+    instruments TEXT,
+    plan        TEXT,
+    files       TEXT,
+    PRIMARY KEY (wafer, num)
+);
+CREATE INDEX IF NOT EXISTS runs_test ON runs (wafer, test, num);
+"""
+JSON_FIELDS = ['instruments', 'plan', 'files']
+FIELDS = ['wafer', 'num', 'run', 'test', 'status', 'start', 'stop', 'host', 'user', 'rdir'] + JSON_FIELDS
+
+## Errors of concurrent writers that go away when tried again
+TRANSIENT = ['locked', 'busy', 'schema has changed']
+
+
+
+## Definitions
+def dir_run_numbers(ldir):
+    """ Run numbers of the run directories (nn_yyyymmdd_hhmmss) in ldir. """
+    nums = []
+    for dname in glob.glob("%s/*" % ldir):
+        name = os.path.basename(dname)
+        if len(name.split("_")) == 3 and name.split("_")[0].isdigit():
+            nums.append(int(name.split("_")[0]))
+    return nums
+
+
+def transient(e):
+    return isinstance(e, sqlite3.OperationalError) and any([msg in str(e) for msg in TRANSIENT])
+
+
+class run_catalogue(object):
+    """
+    SQLite index of the runs in the logs directory, one row per run with its
+    wafer identifier, run number and name, test, status, start and stop time,
+    host, user, run directory, instrument addresses, voltage/channel plan
+    and output files.
+
+    Run numbers are allocated in a write transaction, so concurrent runs on
+    the same wafer get different numbers. The first run of a wafer that is
+    not in the catalogue yet continues after its existing run directories.
+    Transient errors of concurrent writers are retried for up to timeout
+    seconds.
+
+    Example:
+    -------------
+    cat = run_catalogue('logs/catalogue.sqlite')
+    run = cat.allocate('HPK_1001', 'test02_scan_iv')
+    cat.update('HPK_1001', run, status='done', files=['iv.dat'])
+    print cat.latest('HPK_1001', fn='iv.dat')
+    """
+
+    def __init__(self, fn='logs/catalogue.sqlite', timeout=30.):
+        self.fn = fn
+        self.ldir = os.path.dirname(fn)
+        self.timeout = timeout
+        self.db = sqlite3.connect(fn, timeout=timeout, isolation_level=None)
+        self.retry(self.create)
+
+    def close(self):
+        self.db.close()
+
+    def retry(self, func, *args):
+        """ Calls func(*args) until it passes without a transient error or timeout is over. """
+        t0 = time.time()
+        while True:
+            try:
+                return func(*args)
+            except sqlite3.OperationalError as e:
+                if not transient(e) or time.time() - t0 > self.timeout:
+                    raise
+                time.sleep(0.05 + 0.1 * random.random())
+
+    def create(self):
+        """ Creates the tables in a write transaction, concurrent processes may open a new catalogue. """
+        cur = self.db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for sql in SCHEMA.split(';'):
+                if sql.strip():
+                    cur.execute(sql)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        return 0
+
+    def allocate(self, wafer, test='', **fields):
+        """ Adds a new run of wafer and returns its name, e.g. 03_20180101_120000. """
+        return self.retry(self.add_run, wafer, test, fields)
+
+    def add_run(self, wafer, test, fields):
+        cur = self.db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            num = cur.execute("SELECT MAX(num) FROM runs WHERE wafer = ?", (wafer,)).fetchone()[0]
+            if num is None:
+                num = max(dir_run_numbers(os.path.join(self.ldir, wafer)) + [-1])
+            num += 1
+            run = "%02d_%s" % (num, time.strftime("%Y%m%d_%H%M%S", time.localtime()))
+            row = dict(fields, wafer=wafer, num=num, run=run, test=test, status='running', start=time.time())
+            self.insert(cur, row)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        return run
+
+    def insert(self, cur, row):
+        keys = [key for key in FIELDS if key in row]
+        vals = [json.dumps(row[key]) if key in JSON_FIELDS else row[key] for key in keys]
+        cur.execute("INSERT INTO runs (%s) VALUES (%s)" % (', '.join(keys), ', '.join(['?'] * len(keys))), vals)
+
+    def update(self, wafer, run, **fields):
+        """ Sets fields of a run, a list in files is added to the recorded files. """
+        return self.retry(self.set_fields, wafer, run, dict(fields))
+
+    def set_fields(self, wafer, run, fields):
+        cur = self.db.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            if 'files' in fields:
+                old = cur.execute("SELECT files FROM runs WHERE wafer = ? AND run = ?", (wafer, run)).fetchone()
+                files = json.loads(old[0]) if old and old[0] else []
+                fields['files'] = files + [fn for fn in fields['files'] if fn not in files]
+            keys = [key for key in FIELDS if key in fields]
+            vals = [json.dumps(fields[key]) if key in JSON_FIELDS else fields[key] for key in keys]
+            cur.execute("UPDATE runs SET %s WHERE wafer = ? AND run = ?" % ', '.join(['%s = ?' % key for key in keys]), \
+                vals + [wafer, run])
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+        return 0
+
+    def runs(self, wafer=None, test=None, fn=None, status=None, limit=None):
+        """ Rows as dicts, latest first. test may contain * wildcards, fn is an output file name. """
+        where, args = [], []
+        for key, val in [('wafer', wafer), ('status', status)]:
+            if val is not None:
+                where.append('%s = ?' % key)
+                args.append(val)
+        if test is not None:
+            where.append("test GLOB ?")
+            args.append(test)
+        if fn is not None:
+            where.append("files LIKE ?")
+            args.append('%%%s%%' % json.dumps(fn))
+        sql = "SELECT %s FROM runs" % ', '.join(FIELDS)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY start DESC, num DESC"
+        if limit:
+            sql += " LIMIT %d" % limit
+        rows = []
+        for vals in self.retry(lambda: self.db.execute(sql, args).fetchall()):
+            row = dict(zip(FIELDS, vals))
+            for key in JSON_FIELDS:
+                row[key] = json.loads(row[key]) if row[key] else None
+            rows.append(row)
+        return rows
+
+    def latest(self, wafer, test=None, fn=None, status='done'):
+        """ Path of the output file fn (or the run directory) of the latest run, None if there is none. """
+        rows = self.runs(wafer, test, fn, status, limit=1)
+        if not rows:
+            return None
+        return os.path.join(rows[0]['rdir'], fn) if fn else rows[0]['rdir']
+
+
+
+## Main Executable
+def main():
+    usage = "usage: ./run_catalogue.py [options] [wafer]"
+
+    parser = OptionParser(usage=usage, version="prog 0.1")
+    parser.add_option("-c", "--catalogue", action="store", dest="catalogue", type="string", default="logs/catalogue.sqlite", help="catalogue file")
+    parser.add_option("-t", "--test", action="store", dest="test", type="string", default=None, help="test name, * is a wildcard")
+    parser.add_option("-f", "--file", action="store", dest="fn", type="string", default=None, help="output file name, e.g. iv.dat")
+    parser.add_option("--status", action="store", dest="status", type="string", default=None, help="run status, e.g. done")
+    parser.add_option("--latest", action="store_true", dest="latest", default=False, help="print the path of the latest finished run only")
+    (options, args) = parser.parse_args()
+
+    if not os.path.exists(options.catalogue):
+        parser.error("No catalogue %s." % options.catalogue)
+    cat = run_catalogue(options.catalogue)
+    wafer = args[0] if args else None
+
+    if options.latest:
+        if wafer is None:
+            parser.error("Give a wafer.")
+        path = cat.latest(wafer, options.test, options.fn, options.status or 'done')
+        if path is None:
+            print "No matching run of %s." % wafer
+            return 1
+        print path
+        return 0
+
+    print '%-20s %-20s %-28s %-10s %-20s %s' % ('Wafer', 'Run', 'Test', 'Status', 'Start', 'Files')
+    print '-' * 120
+    for row in cat.runs(wafer, options.test, options.fn, options.status):
+        start = time.strftime("%Y/%m/%d %H:%M:%S", time.localtime(row['start'])) if row['start'] else '-'
+        print '%-20s %-20s %-28s %-10s %-20s %s' % (row['wafer'], row['run'], row['test'], row['status'], start, \
+            ', '.join(row['files'] or []))
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+import os
+import json
+import numpy as np
+from optparse import OptionParser
+
+
+## File layout
+# Line 1     'AXIOM-RUN <version> <offset>\n'
+# Header     JSON with the columns, the metadata and the original text header,
+#            padded with spaces up to offset (a multiple of 64 bytes)
+# Data       little endian records of the column dtypes, one per row, until
+#            the end of the file. A partly written last record is ignored.
+MAGIC = 'AXIOM-RUN'
+VERSION = 1
+ALIGN = 64
+
+
+
+## Definitions
+def column_dtype(name):
+    if name.lower().startswith('channel'):
+        return '<i4'
+    return '<f8'
+
+
+def parse_header(lines):
+    """ Splits the '#' lines of a .dat/.txt file into text, metadata and column names. """
+    text = []
+    meta = {}
+    for line in lines:
+        line = line.rstrip('\r\n')
+        line = line[2:] if line.startswith('# ') else line[1:]
+        text.append(line)
+        if ':' in line and '\t' not in line:
+            key, val = line.split(':', 1)
+            if key.strip() and val.strip():
+                meta[key.strip()] = val.strip()
+    names = []
+    for line in reversed(text):
+        if '[' in line and '\t' in line:
+            names = [n.strip() for n in line.split('\t') if n.strip()]
+            break
+    return '\n'.join(text), meta, names
+
+
+def make_columns(names, n):
+    if len(names) != n:
+        names = ['col%d' % k for k in range(n)]
+    columns = []
+    for name in names:
+        while name in [c[0] for c in columns]:
+            name += '_'
+        columns.append([name, column_dtype(name)])
+    return columns
+
+
+class run_writer(object):
+    """
+    Appends rows to a binary run file. An existing file with the same columns
+    is appended to, otherwise it is created.
+
+    Example:
+    -------------
+    w = run_writer('cv.run', [['Voltage [V]', '<f8'], ['Channel [-]', '<i4']], meta={'Frequency': '1E+04 Hz'})
+    w.write([10., 3])
+    w.close()
+    """
+
+    def __init__(self, fn, columns, meta={}, header=''):
+        self.fn = fn
+        self.columns = [[str(c[0]), str(c[1])] for c in columns]
+        self.dtype = np.dtype([tuple(c) for c in self.columns])
+
+        if os.path.exists(fn) and os.path.getsize(fn) > 0:
+            info, offset = read_info(fn)
+            if info['columns'] != self.columns:
+                raise ValueError("%s has different columns." % fn)
+            ## Drop a partly written last record
+            n = (os.path.getsize(fn) - offset) // self.dtype.itemsize
+            self.f = open(fn, 'rb+')
+            self.f.truncate(offset + n * self.dtype.itemsize)
+            self.f.seek(0, 2)
+        else:
+            info = json.dumps({'columns': self.columns, 'meta': meta, 'header': header})
+            offset = len('%s %d %10d\n' % (MAGIC, VERSION, 0)) + len(info) + 1
+            offset += -offset % ALIGN
+            first = '%s %d %10d\n' % (MAGIC, VERSION, offset)
+            self.f = open(fn, 'wb')
+            self.f.write(first + info + ' ' * (offset - len(first) - len(info) - 1) + '\n')
+
+    def write(self, row):
+        self.f.write(np.array([tuple(row)], dtype=self.dtype).tostring())
+
+    def write_rows(self, dat):
+        dat = np.asarray(dat)
+        if dat.dtype != self.dtype:
+            dat = np.array([tuple(row) for row in dat], dtype=self.dtype)
+        self.f.write(dat.tostring())
+
+    def flush(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.flush()
+            self.f.close()
+            self.f = None
+
+
+def read_info(fn):
+    """ Returns the header dict and the data offset of a run file. """
+    with open(fn, 'rb') as f:
+        first = f.readline().split()
+        if len(first) != 3 or first[0] != MAGIC:
+            raise ValueError("%s is not a run file." % fn)
+        offset = int(first[2])
+        info = json.loads(f.read(offset - f.tell()))
+    info['columns'] = [[str(c[0]), str(c[1])] for c in info['columns']]
+    return info, offset
+
+
+def read_run(fn):
+    """ Memory maps the records of a run file, returns them and the header dict. """
+    info, offset = read_info(fn)
+    dtype = np.dtype([tuple(c) for c in info['columns']])
+    n = (os.path.getsize(fn) - offset) // dtype.itemsize
+    if n == 0:
+        return np.zeros(0, dtype=dtype), info
+    return np.memmap(fn, dtype=dtype, mode='r', offset=offset, shape=(n,)), info
+
+
+def to_array(rec):
+    """ Converts records to the 2D float array np.loadtxt gives for the .dat file. """
+    return np.array([rec[name] for name in rec.dtype.names], dtype=float).T.reshape(len(rec), len(rec.dtype.names))
+
+
+def header_lines(fn):
+    """ Returns the header of a run file as the '#' lines of the text file. """
+    info = read_info(fn)[0]
+    return ['# ' + str(line) + '\n' for line in info['header'].split('\n')]
+
+
+def read_array(fn):
+    """ Reads a .run file or a text .dat/.txt file as a 2D float array. """
+    if fn.endswith('.run'):
+        return to_array(read_run(fn)[0])
+    return np.loadtxt(fn, dtype='float', comments='#')
+
+
+
+## Converters
+def text_to_run(fn_in, fn_out):
+    hd = []
+    with open(fn_in) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            hd.append(line)
+    dat = np.loadtxt(fn_in, dtype='float', comments='#', ndmin=2)
+    text, meta, names = parse_header(hd)
+    columns = make_columns(names, dat.shape[1])
+    if os.path.exists(fn_out):
+        os.remove(fn_out)
+    w = run_writer(fn_out, columns, meta=meta, header=text)
+    w.write_rows(dat)
+    w.close()
+    return len(dat)
+
+
+def run_to_text(fn_in, fn_out, fmt='%.5E'):
+    rec, info = read_run(fn_in)
+    np.savetxt(fn_out, to_array(rec), fmt=fmt, delimiter='\t', header=str(info['header']))
+    return len(rec)
+
+
+
+## Main Executable
+def main():
+    usage = "usage: ./run_file.py -i input_file -o output_file"
+
+    parser = OptionParser(usage=usage, version="prog 0.1")
+    parser.add_option("-i", "--input", action="store", dest="input", type="string", help="input file, .run or text")
+    parser.add_option("-o", "--output", action="store", dest="output", type="string", help="output file, .run or text")
+    parser.add_option("--fmt", action="store", dest="fmt", type="string", default="%.5E", help="number format of text output")
+    (options, args) = parser.parse_args()
+
+    if not options.input or not options.output:
+        parser.error("Give an input and an output file.")
+
+    if options.input.endswith('.run'):
+        n = run_to_text(options.input, options.output, options.fmt)
+    else:
+        n = text_to_run(options.input, options.output)
+    print "Converted %d rows from %s to %s." % (n, options.input, options.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -158,6 +158,95 @@ def extract_depletion_voltage(volts, caps, caps_err, v1_low, v1_up, v2_low, v2_u
     return vdep
 
 
+def fit_line(x, y, y_err=None):
+    """
+    Returns slope, offset, their covariance and chi2 of a weighted straight
+    line fit. Without errors the points are weighted equally.
+    """
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    w = np.ones(len(x)) if y_err is None else 1. / np.asarray(y_err, dtype=float)**2
+
+    s, sx, sy = w.sum(), (w*x).sum(), (w*y).sum()
+    sxx, sxy = (w*x*x).sum(), (w*x*y).sum()
+    det = s*sxx - sx**2
+    a = (s*sxy - sx*sy) / det
+    b = (sxx*sy - sx*sxy) / det
+    cov = np.array([[s, -sx], [-sx, sxx]]) / det
+    chi2 = (w * (y - a*x - b)**2).sum()
+
+    return a, b, cov, chi2
+
+
+def fit_depletion_voltage(volts, caps, caps_err=None, min_points=3):
+    """
+    Returns depletion voltage and its uncertainty in [V] from a CV curve,
+    without given fit ranges. 1/C^2 is fitted with two lines, the rising part
+    and the plateau, for every split of the points with at least min_points
+    on each side. Splits whose lines don't cross between the two parts are
+    dropped, so a curve without min_points on the plateau isn't fitted. The
+    best split gives the depletion voltage at the crossing of the lines. The
+    uncertainty is the fit error, scaled up by chi2/ndf if
+    that is above one, and half the spread of the crossings of all splits
+    within one unit of chi2 of the best. Returns nan and inf if the curve
+    can't be fitted.
+
+    volts    ... volts in [V]
+    caps     ... capacitance in [F]
+    caps_err ... capacitance error in [F], optional
+    """
+
+    x = np.abs(np.asarray(volts, dtype=float))
+    c = np.asarray(caps, dtype=float)
+    c_err = np.ones(len(c)) * np.nan if caps_err is None else np.asarray(caps_err, dtype=float)
+    ok = np.isfinite(x) & np.isfinite(c) & (c != 0)
+    x, c, c_err = x[ok], c[ok], c_err[ok]
+
+    y = 1 / c**2
+    y_err = 2*np.abs(c_err / c**3)
+    if caps_err is None or not np.all(y_err > 0):
+        y_err = None
+
+    idx = np.argsort(x, kind='mergesort')
+    x, y = x[idx], y[idx]
+    y_err = y_err[idx] if y_err is not None else None
+    if len(x) < 2*min_points:
+        return np.nan, np.inf
+
+    fits = []
+    for k in range(min_points, len(x) - min_points + 1):
+        e1 = y_err[:k] if y_err is not None else None
+        e2 = y_err[k:] if y_err is not None else None
+        a1, b1, cov1, chi1 = fit_line(x[:k], y[:k], e1)
+        a2, b2, cov2, chi2 = fit_line(x[k:], y[k:], e2)
+        if a1 == a2:
+            continue
+        d = a1 - a2
+        vdep = (b2 - b1) / d
+        ## The lines must cross between the two parts, with the plateau points above
+        if not x[k - 1] <= vdep <= x[k]:
+            continue
+        g1 = np.array([-vdep / d, -1 / d])
+        g2 = np.array([vdep / d, 1 / d])
+        var = g1.dot(cov1).dot(g1) + g2.dot(cov2).dot(g2)
+        fits.append((chi1 + chi2, vdep, var))
+    if not fits:
+        return np.nan, np.inf
+
+    chi_min, vdep, var = min(fits)
+    ndf = len(x) - 4
+    scale = chi_min / ndf if ndf > 0 else 1.
+    if y_err is None or scale > 1:
+        var *= scale
+        chi_min /= scale
+        fits = [(f[0] / scale, f[1], f[2]) for f in fits]
+    near = [f[1] for f in fits if f[0] <= chi_min + 1]
+    spread = 0.5 * (max(near) - min(near))
+
+    return vdep, np.sqrt(var + spread**2)
+
+
 def calculate_active_thickness(cap, area):
     """
     Returns active thickness in [cm] from capacitance value.